@@ -38,6 +38,8 @@ class AstDatasetCreatorArguments(Arguments):
         parser.add_argument('--recompute_l2g', action='store_true', default=False, help="")
         parser.add_argument('--remove_type_annotations', action='store_true', default=False, help="")
         parser.add_argument('--seed', type=int, default=None, help="")
+        parser.add_argument('--columnar', action='store_true', default=False,
+                            help="Store merged nodes and edges in columnar format")
         return parser
 
     def add_positional_argument(self):
@@ -49,6 +51,11 @@ class AstDatasetCreatorArguments(Arguments):
     def additional_arguments(self):
         self.parser.add_argument('--chunksize', default=10000, type=int, help='Chunksize for preparing dataset. Larger chunks are faster to process, but they take more memory.')
         self.parser.add_argument('--keep_frac', default=1.0, type=float, help="Fraction of the dataset to keep")
+        self.parser.add_argument('--num_workers', default=1, type=int,
+                                 help="Number of processes for extracting AST graphs from modules")
+        self.parser.add_argument('--incremental', action='store_true', default=False,
+                                 help="Skip extraction for packages that did not change since the last run and "
+                                      "append new packages to existing merged graph")
 
     def parse(self):
         return self.parser.parse_args()
@@ -61,7 +68,11 @@ class DatasetCreatorArguments(AstDatasetCreatorArguments):
         self.parser.add_argument('output_directory', help='')
 
     def additional_arguments(self):
-        pass
+        self.parser.add_argument('--incremental', action='store_true', default=False,
+                                 help="Skip extraction for environments that did not change since the last run and "
+                                      "append new environments to existing merged graph")
+        self.parser.add_argument('--num_workers', default=1, type=int,
+                                 help="Number of processes for extracting function bodies")
 
 
 class TypePredictorTrainerArguments(Arguments):
@@ -104,6 +115,14 @@ class TypePredictorTrainerArguments(Arguments):
         parser.add_argument('--no_localization', action='store_true')
         parser.add_argument('--restrict_allowed', action='store_true', default=False)
         parser.add_argument('--no_graph', action='store_true', default=False)
+        parser.add_argument('--batch_cache_commit_interval', dest='batch_cache_commit_interval', default=1000, type=int,
+                            help='Number of newly encoded records after which the batch cache is saved')
+        parser.add_argument('--batch_hot_cache_size', dest='batch_hot_cache_size', default=10000, type=int,
+                            help='Number of encoded records kept in memory')
+        parser.add_argument('--preencode_batches', action='store_true', default=False,
+                            help='Encode the dataset before training into a memory mapped array')
+        parser.add_argument('--preencode_workers', dest='preencode_workers', default=1, type=int,
+                            help='Number of processes for preencoding')
         return parser
 
     def add_positional_argument(self):
@@ -1,6 +1,10 @@
-from copy import copy, deepcopy
+from bisect import bisect_right
+from copy import deepcopy
+from multiprocessing import Pool
 from typing import List, Tuple, Iterable
 
+import numpy as np
+
 from SourceCodeTools.nlp import create_tokenizer
 from spacy.gold import biluo_tags_from_offsets as spacy_biluo_tags_from_offsets
 
@@ -119,73 +123,134 @@ def overlap(p1: Tuple, p2: Tuple) -> bool:
         return False
 
 
-def resolve_self_collision(offsets):
-    no_collisions = []
+class IntervalIndex:
+    """
+    Index of closed intervals [start, end] that answers overlap queries for many ranges at once. Overlap has the
+    same meaning as in `overlap`. Intervals are grouped into classes by length (powers of two) and sorted by start
+    within every class. An interval from a class with maximal length `max_length` can overlap the range [start, end]
+    only if its start is within [start - max_length, end], therefore, candidates for every range are contiguous in
+    the sorted starts and are found with `searchsorted` for all ranges together.
+    """
+    def __init__(self, starts, ends):
+        """
+        :param starts: interval starts
+        :param ends: interval ends, inclusive
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        lengths = ends - starts
+        length_classes = np.floor(np.log2(np.maximum(lengths, 0) + 1)).astype(np.int64)
+
+        self._num_intervals = len(starts)
+        self._groups = []
+        for length_class in np.unique(length_classes):
+            positions = np.flatnonzero(length_classes == length_class)
+            positions = positions[np.argsort(starts[positions], kind="stable")]
+            self._groups.append((starts[positions], ends[positions], positions, lengths[positions].max()))
+
+    def __len__(self):
+        return self._num_intervals
+
+    def query(self, starts, ends):
+        """
+        Find all pairs of overlapping ranges and intervals.
+        :param starts: range starts
+        :param ends: range ends, inclusive
+        :return: tuple of arrays (range_positions, interval_positions) sorted by range position, then by interval
+            position
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        range_positions = []
+        interval_positions = []
+        for group_starts, group_ends, positions, max_length in self._groups:
+            lower = np.searchsorted(group_starts, starts - max_length, side="left")
+            upper = np.searchsorted(group_starts, ends, side="right")
+            counts = np.maximum(upper - lower, 0)
+
+            candidate_ranges = np.repeat(np.arange(len(starts)), counts)
+            candidates = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lower, counts)
+            overlapping = group_ends[candidates] >= starts[candidate_ranges]
+
+            range_positions.append(candidate_ranges[overlapping])
+            interval_positions.append(positions[candidates[overlapping]])
+
+        if len(range_positions) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        range_positions = np.concatenate(range_positions)
+        interval_positions = np.concatenate(interval_positions)
+        order = np.lexsort((interval_positions, range_positions))
+        return range_positions[order], interval_positions[order]
+
+    def overlaps_any(self, starts, ends):
+        """
+        :return: boolean array, True for ranges that overlap at least one interval
+        """
+        overlapping = np.zeros(len(starts), dtype=np.bool_)
+        overlapping[self.query(starts, ends)[0]] = True
+        return overlapping
+
+
+class NonOverlappingSpans:
+    """
+    Set of spans that do not overlap each other. Spans are kept sorted by start, and because they do not overlap,
+    ends are sorted as well. Checking for overlap with a new span requires looking only at the kept span with the
+    closest start.
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
 
-    for ind_1, offset_1 in enumerate(offsets):
-        # keep first
-        if any(map(lambda x: overlap(offset_1, x), no_collisions)):
-            pass
-        else:
-            no_collisions.append(offset_1)
-        # new = []
-        # evict = []
-        #
-        # for ind_2, offset_2 in enumerate(no_collisions):
-        #     if overlap(offset_1, offset_2):
-        #         # keep smallest
-        #         if (offset_1[1] - offset_1[0]) <= (offset_2[1] - offset_2[0]):
-        #             evict.append(ind_2)
-        #             new.append(offset_1)
-        #         else:
-        #             pass
-        #     else:
-        #         new.append(offset_1)
-        #
-        # for ind in sorted(evict, reverse=True):
-        #     no_collisions.pop(ind)
-        #
-        # no_collisions.extend(new)
+    def overlaps(self, start, end):
+        position = bisect_right(self.starts, end)
+        return position > 0 and self.ends[position - 1] >= start
 
-    return no_collisions
+    def add(self, start, end):
+        position = bisect_right(self.starts, end)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
 
 
-def resolve_self_collisions2(offsets):
+def resolve_self_collision(offsets):
     """
-    Resolve self collision in favour of the smallest entity.
-    :param offsets:
-    :return:
+    Resolve self collision in favour of the entity that appears first.
+    :param offsets: list of offsets (start, end, ...)
+    :return: list of non-overlapping offsets in the original order
     """
-    offsets = copy(offsets)
+    kept = NonOverlappingSpans()
     no_collisions = []
 
-    while len(offsets) > 0:
-        offset_1 = offsets.pop(0)
-        evict = []
-        new = []
-
-        add = True
-        for ind_2, offset_2 in enumerate(no_collisions):
-            if overlap(offset_1, offset_2):
-                # keep smallest
-                if (offset_1[1] - offset_1[0]) <= (offset_2[1] - offset_2[0]):
-                    evict.append(ind_2)
-                    new.append(offset_1)
-                else:
-                    pass
-                add = False
+    for offset in offsets:
+        if not kept.overlaps(offset[0], offset[1]):
+            kept.add(offset[0], offset[1])
+            no_collisions.append(offset)
 
-        if add:
-            new.append(offset_1)
+    return no_collisions
 
-        for ind in sorted(evict, reverse=True):
-            no_collisions.pop(ind)
 
-        no_collisions.extend(new)
+def resolve_self_collisions2(offsets):
+    """
+    Resolve self collision in favour of the smallest entity. Offsets are visited from the smallest to the largest
+    (among equal, the one that appears later first), and an offset is kept when it does not overlap already kept
+    offsets. Identical offsets are kept once.
+    :param offsets: list of offsets (start, end, ...)
+    :return: list of non-overlapping offsets in the original order
+    """
+    offsets = list(dict.fromkeys(offsets))
+    by_size = sorted(range(len(offsets)), key=lambda ind: (offsets[ind][1] - offsets[ind][0], -ind))
 
-    no_collisions = list(set(no_collisions))
+    kept = NonOverlappingSpans()
+    keep = [False] * len(offsets)
 
-    return no_collisions
+    for ind in by_size:
+        start, end = offsets[ind][0], offsets[ind][1]
+        if not kept.overlaps(start, end):
+            kept.add(start, end)
+            keep[ind] = True
+
+    return [offset for offset, keep_offset in zip(offsets, keep) if keep_offset]
 
 
 def align_tokens_with_graph(doc, spans, tokenzer_name):
@@ -202,9 +267,42 @@ def align_tokens_with_graph(doc, spans, tokenzer_name):
     return doc, node_tags
 
 
-def source_code_graph_alignment(source_codes, node_spans, tokenizer="codebert"):
+_worker_nlp = None
+_worker_tokenizer_name = None
+
+
+def _init_alignment_worker(tokenizer):
+    global _worker_nlp, _worker_tokenizer_name
+    _worker_nlp = create_tokenizer(tokenizer)
+    _worker_tokenizer_name = tokenizer
+
+
+def _align_in_worker(code_and_spans):
+    code, spans = code_and_spans
+    return align_tokens_with_graph(
+        _worker_nlp(code), resolve_self_collisions2(spans), tokenzer_name=_worker_tokenizer_name
+    )
+
+
+def source_code_graph_alignment(source_codes, node_spans, tokenizer="codebert", num_workers=1, chunksize=16):
+    """
+    Align tokens of source codes with graph nodes.
+    :param source_codes: iterable with source codes
+    :param node_spans: iterable with lists of node offsets (start, end, node_id) for every source code
+    :param tokenizer: tokenizer name
+    :param num_workers: number of processes. When greater than one, files are streamed through a pool of workers,
+        every worker creates its own tokenizer
+    :param chunksize: number of files sent to a worker at once
+    :return: generator of tokens and node tags, in the order of source codes
+    """
     supported_tokenizers = ["spacy", "codebert"]
     assert tokenizer in supported_tokenizers, f"Only these tokenizers supported for alignment: {supported_tokenizers}"
+
+    if num_workers > 1:
+        with Pool(num_workers, initializer=_init_alignment_worker, initargs=(tokenizer,)) as pool:
+            yield from pool.imap(_align_in_worker, zip(source_codes, node_spans), chunksize=chunksize)
+        return
+
     nlp = create_tokenizer(tokenizer)
 
     for code, spans in zip(source_codes, node_spans):
@@ -1,11 +1,13 @@
 import ast
 import logging
+from array import array
 from copy import copy
 from enum import Enum
 from itertools import chain
 from pprint import pprint
 from time import time_ns
 from collections.abc import Iterable
+import numpy as np
 import pandas as pd
 # import os
 from SourceCodeTools.code.IdentifierPool import IdentifierPool
@@ -316,21 +318,93 @@ class PythonSharedNodes:
         return False
 
 
-class GNode:
+class SourceBuffer:
+    """
+    Source code encoded as UTF-8 together with the table of byte offsets for the beginning of every line. Positions
+    reported by `ast` (line numbers and byte offsets within a line) are converted into ranges of this buffer, and
+    only requested ranges are decoded.
+    """
+    def __init__(self, source):
+        """
+        :param source: source code
+        """
+        self.buffer = source.encode("utf8")
+        newlines = np.flatnonzero(np.frombuffer(self.buffer, dtype=np.uint8) == ord("\n"))
+        # same as `get_cum_lens(source, as_bytes=True)`, the last entry accounts for the missing trailing newline
+        self.line_offsets = [0] + (newlines + 1).tolist() + [len(self.buffer) + 1]
+
+    def get_range(self, start_line, end_line, start_col, end_col):
+        """
+        Convert ast positions into a byte range of the buffer.
+        :param start_line: line number, starting from 1
+        :param end_line: end line number, starting from 1
+        :param start_col: byte offset of the start within the first line
+        :param end_col: byte offset of the end within the last line
+        :return: tuple (start, end)
+        """
+        return self.line_offsets[start_line - 1] + start_col, self.line_offsets[end_line - 1] + end_col
+
+    def get_string(self, start, end, strip=False):
+        """
+        Decode a range of the buffer.
+        :param strip: strip every line and concatenate lines without line breaks
+        """
+        section = self.buffer[start: end].decode("utf8")
+        if strip:
+            section = "".join(line.strip() for line in section.split("\n"))
+        return section.rstrip()
+
+
+class NodeString:
+    """
+    Source string of an AST node stored as a byte range of a shared SourceBuffer. The string is decoded only when
+    converted with `str`, usually right before nodes are written. Use `materialize_node_strings` for columns.
+    """
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return self.source.get_string(self.start, self.end)
+
+    def __repr__(self):
+        return f"NodeString({self.start}, {self.end})"
+
+
+def materialize_node_strings(strings):
+    """
+    Replace instances of NodeString with decoded strings.
+    :param strings: iterable with node strings, may contain None
+    :return: list of strings
+    """
+    return [str(string) if isinstance(string, NodeString) else string for string in strings]
+
+
+class NodeBase:
+    """
+    Base class for nodes of AST graph. Defines no attributes, so that subclasses can use `__slots__`.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return self.name == other.name and self.type == other.type
+
+    def __hash__(self):
+        return (self.name, self.type).__hash__()
+
+
+class GNode(NodeBase):
     def __init__(self, **kwargs):
         self.string = None
         for k, v in kwargs.items():
             setattr(self, k, v)
 
-    def __eq__(self, other):
-        return self.name == other.name and self.type == other.type
-
     def __repr__(self):
         return self.__dict__.__repr__()
 
-    def __hash__(self):
-        return (self.name, self.type).__hash__()
-
     def setprop(self, key, value):
         setattr(self, key, value)
 
@@ -350,10 +424,132 @@ class GEdge:
         return self.__dict__[item]
 
 
+class CompactNode(NodeBase):
+    """
+    Node created by AstGraphGenerator in compact mode. Stores only sequential id, name, type and the scope node.
+    """
+    __slots__ = ("id", "name", "type", "scope")
+
+    def __init__(self, id, name, type, scope=None):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.scope = scope
+
+    def __repr__(self):
+        return f"CompactNode(id={self.id}, name={self.name}, type={self.type})"
+
+
+class AstGraphBuffers:
+    """
+    Buffers for nodes and edges created by AstGraphGenerator in compact mode. Every node and edge is stored as a
+    fixed-width record of integers in a flat array, which is converted into columns without copying. Node and edge
+    types are interned and stored as integer codes, missing values are stored as -1.
+    """
+    position_fields = ["line", "end_line", "col_offset", "end_col_offset"]
+    var_position_fields = ["var_line", "var_end_line", "var_col_offset", "var_end_col_offset"]
+
+    node_fields = ["type", "scope"] + position_fields
+    edge_fields = ["src", "dst", "type", "scope"] + position_fields + var_position_fields
+
+    no_positions = (-1, -1, -1, -1)
+
+    def __init__(self):
+        self.types = []
+        self.type_codes = {}
+
+        self.shared_nodes = {}
+        self.node_names = []
+        self.nodes = array("q")
+        self.edges = array("q")
+
+    def get_type_code(self, type_):
+        code = self.type_codes.get(type_, None)
+        if code is None:
+            code = self.type_codes[type_] = len(self.types)
+            self.types.append(type_)
+        return code
+
+    def add_node(self, name, type, scope=None, positions=None, shared=False):
+        """
+        Add node to buffers.
+        :param name: node name
+        :param type: node type
+        :param scope: scope node
+        :param positions: tuple (lineno, end_lineno, col_offset, end_col_offset) used for restoring node string
+        :param shared: whether to reuse existing node with the same name and type
+        :return: CompactNode
+        """
+        if shared:
+            node = self.shared_nodes.get((name, type), None)
+            if node is not None:
+                return node
+
+        node = CompactNode(len(self.node_names), name, type, scope)
+        self.node_names.append(name)
+        self.nodes.extend(
+            (self.get_type_code(type), scope.id if scope is not None else -1) + (positions or self.no_positions)
+        )
+
+        if shared:
+            self.shared_nodes[(name, type)] = node
+        return node
+
+    def add_edge(self, src, dst, type, scope=None, positions=None, var_positions=None):
+        self.edges.extend(
+            (src.id, dst.id, self.get_type_code(type), scope.id if scope is not None else -1) +
+            (positions or self.no_positions) + (var_positions or self.no_positions)
+        )
+
+    @staticmethod
+    def _as_columns(buffer, fields):
+        records = np.frombuffer(buffer, dtype=np.int64).reshape(-1, len(fields))
+        return {field: records[:, ind] for ind, field in enumerate(fields)}
+
+    def _categorical(self, codes):
+        return pd.Categorical.from_codes(codes.astype(np.int32), categories=self.types)
+
+    @staticmethod
+    def _nullable(values, dtype):
+        return pd.arrays.IntegerArray(values.astype(dtype), values == -1)
+
+    def get_edge_columns(self):
+        records = self._as_columns(self.edges, self.edge_fields)
+        columns = {
+            "src": records["src"].copy(),
+            "dst": records["dst"].copy(),
+            "type": self._categorical(records["type"]),
+            "scope": self._nullable(records["scope"], np.int64),
+        }
+        for field in self.position_fields + self.var_position_fields:
+            columns[field] = self._nullable(records[field], np.int32)
+        return columns
+
+    def get_node_positions(self):
+        records = self._as_columns(self.nodes, self.node_fields)
+        return zip(*(records[field].tolist() for field in self.position_fields))
+
+    def get_node_columns(self):
+        records = self._as_columns(self.nodes, self.node_fields)
+        return {
+            "id": np.arange(len(self.node_names)),
+            "name": self.node_names,
+            "type": self._categorical(records["type"]),
+            "scope": self._nullable(records["scope"], np.int64),
+        }
+
+
 class AstGraphGenerator(object):
 
-    def __init__(self, source, add_reverse_edges=True):
+    def __init__(self, source, add_reverse_edges=True, compact=False):
+        """
+        :param source: source code
+        :param add_reverse_edges: whether to add reverse edges
+        :param compact: when True, nodes get sequential ids and edges are stored in column buffers, see
+            AstGraphBuffers. Edges and nodes are returned as columnar tables by `get_edges` and `get_nodes`.
+        """
         self.source = source.split("\n")  # lines of the source code
+        self._source_buffer = SourceBuffer(source)
         self.root = ast.parse(source)
         self.current_condition = []
         self.condition_status = []
@@ -362,36 +558,34 @@ class AstGraphGenerator(object):
 
         self._identifier_pool = IdentifierPool()
 
+        self._compact = compact
+        if compact:
+            self._buffers = AstGraphBuffers()
+            # a single identifier makes names unique among files, sequential ids make them unique within file
+            self._file_identifier = self._identifier_pool.get_new_identifier()
+
+    def make_node(self, name, type, scope=None):
+        """
+        Create node that is not a part of AST, e.g. mention or type annotation.
+        """
+        if self._compact:
+            return self._buffers.add_node(name, type, scope=scope, shared=True)
+        if scope is not None:
+            return GNode(name=name, type=type, scope=copy(scope))
+        return GNode(name=name, type=type)
+
     def get_source_from_ast_range(self, node, strip=True):
-        start_line = node.lineno
-        end_line = node.end_lineno
-        start_col = node.col_offset
-        end_col = node.end_col_offset
-
-        source = ""
-        num_lines = end_line - start_line + 1
-        if start_line == end_line:
-            section = self.source[start_line - 1].encode("utf8")[start_col:end_col].decode(
-                "utf8")
-            source += section.strip() if strip else section + "\n"
-        else:
-            for ind, lineno in enumerate(range(start_line - 1, end_line)):
-                if ind == 0:
-                    section = self.source[lineno].encode("utf8")[start_col:].decode(
-                        "utf8")
-                    source += section.strip() if strip else section + "\n"
-                elif ind == num_lines - 1:
-                    section = self.source[lineno].encode("utf8")[:end_col].decode(
-                        "utf8")
-                    source += section.strip() if strip else section + "\n"
-                else:
-                    section = self.source[lineno]
-                    source += section.strip() if strip else section + "\n"
+        return self.get_source_from_range(node.lineno, node.end_lineno, node.col_offset, node.end_col_offset, strip)
 
-        return source.rstrip()
+    def get_source_from_range(self, start_line, end_line, start_col, end_col, strip=True):
+        start, end = self._source_buffer.get_range(start_line, end_line, start_col, end_col)
+        return self._source_buffer.get_string(start, end, strip=strip)
 
     def get_name(self, *, node=None, name=None, type=None, add_random_identifier=False):
 
+        if self._compact:
+            return self._get_compact_name(node=node, name=name, type=type, add_random_identifier=add_random_identifier)
+
         random_identifier = self._identifier_pool.get_new_identifier()
 
         if node is not None:
@@ -402,9 +596,11 @@ class AstGraphGenerator(object):
                 name = f"{name}_{random_identifier}"
 
         if hasattr(node, "lineno"):
-            node_string = self.get_source_from_ast_range(node, strip=False)
-            # if "\n" in node_string:
-            #     node_string = None
+            # keep only the range in the source, nested nodes would otherwise copy the same source many times
+            node_string = NodeString(
+                self._source_buffer,
+                *self._source_buffer.get_range(node.lineno, node.end_lineno, node.col_offset, node.end_col_offset)
+            )
         else:
             node_string = None
 
@@ -414,6 +610,22 @@ class AstGraphGenerator(object):
             return GNode(name=name, type=type, string=node_string)
         # return (node.__class__.__name__ + "_" + str(hex(int(time_ns()))), node.__class__.__name__)
 
+    def _get_compact_name(self, *, node=None, name=None, type=None, add_random_identifier=False):
+        node_id = len(self._buffers.node_names)
+        if node is not None:
+            type = node.__class__.__name__
+            name = f"{type}_{self._file_identifier}_{node_id}"
+        elif add_random_identifier:
+            name = f"{name}_{self._file_identifier}_{node_id}"
+
+        if hasattr(node, "lineno"):
+            positions = (node.lineno, node.end_lineno, node.col_offset, node.end_col_offset)
+        else:
+            positions = None
+
+        scope = self.scope[-1] if len(self.scope) > 0 else None
+        return self._buffers.add_node(name, type, scope=scope, positions=positions)
+
     def get_edges(self, as_dataframe=True):
         edges = []
         for f_def_node in ast.iter_child_nodes(self.root):
@@ -421,11 +633,39 @@ class AstGraphGenerator(object):
                 edges.extend(self.parse(f_def_node))
                 break  # to avoid going through nested definitions
 
+        if self._compact:
+            return self.get_compact_edges(as_dataframe)
+
         if not as_dataframe:
             return edges
         df = pd.DataFrame(edges)
         return df.astype({col: "Int32" for col in df.columns if col not in {"src", "dst", "type"}})
 
+    def get_compact_edges(self, as_dataframe=True):
+        """
+        Return edges collected in compact mode.
+        :param as_dataframe: return DataFrame, otherwise return dictionary with columns
+        :return: table with columns src, dst, type, scope, and edge positions. Nodes are referenced by their
+            sequential ids, see `get_nodes`
+        """
+        columns = self._buffers.get_edge_columns()
+        return pd.DataFrame(columns) if as_dataframe else columns
+
+    def get_nodes(self, as_dataframe=True):
+        """
+        Return nodes collected in compact mode. Node strings are restored from stored positions only here.
+        :param as_dataframe: return DataFrame, otherwise return dictionary with columns
+        :return: table with columns id, name, type, scope, string
+        """
+        assert self._compact, "Nodes are collected only in compact mode"
+        columns = self._buffers.get_node_columns()
+        source = self._source_buffer
+        columns["string"] = [
+            source.get_string(*source.get_range(*positions)) if positions[0] != -1 else None
+            for positions in self._buffers.get_node_positions()
+        ]
+        return pd.DataFrame(columns) if as_dataframe else columns
+
     def parse(self, node):
         n_type = type(node).__name__
         if n_type in PythonNodeEdgeDefinitions.ast_node_type_edges:
@@ -459,6 +699,10 @@ class AstGraphGenerator(object):
             self, edges, src, dst, type, scope=None,
             position_node=None, var_position_node=None
     ):
+        if self._compact:
+            self._add_compact_edge(src, dst, type, scope, position_node, var_position_node)
+            return
+
         edges.append({
             "src": src, "dst": dst, "type": type, "scope": scope,
         })
@@ -493,6 +737,21 @@ class AstGraphGenerator(object):
                 "src": dst, "dst": src, "type": reverse_type, "scope": scope
             })
 
+    def _add_compact_edge(self, src, dst, type, scope, position_node, var_position_node):
+        def get_positions(node):
+            if node is not None and hasattr(node, "lineno"):
+                return node.lineno - 1, node.end_lineno - 1, node.col_offset, node.end_col_offset
+            return None
+
+        self._buffers.add_edge(
+            src, dst, type, scope, positions=get_positions(position_node),
+            var_positions=get_positions(var_position_node)
+        )
+
+        reverse_type = PythonNodeEdgeDefinitions.reverse_edge_exceptions.get(type, type + "_rev")
+        if self._add_reverse_edges is True and reverse_type is not None:
+            self._buffers.add_edge(dst, src, reverse_type, scope)
+
     def parse_body(self, nodes):
         edges = []
         last_node = None
@@ -519,7 +778,7 @@ class AstGraphGenerator(object):
         if isinstance(cond_name, str):
             cond_name = [cond_name]
             cond_stat = [cond_stat]
-        elif isinstance(cond_name, GNode):
+        elif isinstance(cond_name, NodeBase):
             cond_name = [cond_name]
             cond_stat = [cond_stat]
 
@@ -534,8 +793,8 @@ class AstGraphGenerator(object):
             self.condition_status.pop(-1)
 
     def parse_as_mention(self, name):
-        mention_name = GNode(name=name + "@" + self.scope[-1].name, type="mention", scope=copy(self.scope[-1]))
-        name = GNode(name=name, type="Name")
+        mention_name = self.make_node(name=name + "@" + self.scope[-1].name, type="mention", scope=self.scope[-1])
+        name = self.make_node(name=name, type="Name")
         # mention_name = (name + "@" + self.scope[-1], "mention")
 
         # edge from name to mention in a function
@@ -550,7 +809,7 @@ class AstGraphGenerator(object):
             # fall here when parsing attributes, they are given as strings; should attributes be parsed into subwords?
             if "@" in node:
                 parts = node.split("@")
-                node = GNode(name=parts[0], type=parts[1])
+                node = self.make_node(name=parts[0], type=parts[1])
             else:
                 # node = GNode(name=node, type="Name")
                 node = ast.Name(node)
@@ -558,19 +817,19 @@ class AstGraphGenerator(object):
                 edges.extend(edges_)
             iter_ = node
         elif isinstance(node, int) or node is None:
-            iter_ = GNode(name=str(node), type="ast_Literal")
+            iter_ = self.make_node(name=str(node), type="ast_Literal")
             # iter_ = str(node)
-        elif isinstance(node, GNode):
+        elif isinstance(node, NodeBase):
             iter_ = node
         else:
             iter_e = self.parse(node)
             if type(iter_e) == str:
                 iter_ = iter_e
-            elif isinstance(iter_e, GNode):
+            elif isinstance(iter_e, NodeBase):
                 iter_ = iter_e
             elif type(iter_e) == tuple:
                 ext_edges, name = iter_e
-                assert isinstance(name, GNode)
+                assert isinstance(name, NodeBase)
                 edges.extend(ext_edges)
                 iter_ = name
             else:
@@ -667,8 +926,7 @@ class AstGraphGenerator(object):
             # https://stackoverflow.com/questions/46458470/should-you-put-quotes-around-type-annotations-in-python
             # https://www.python.org/dev/peps/pep-0484/#forward-references
             annotation_string = self.get_source_from_ast_range(node.returns)
-            annotation = GNode(name=annotation_string,
-                               type="type_annotation")
+            annotation = self.make_node(name=annotation_string, type="type_annotation")
             self.add_edge(
                 edges, src=annotation, dst=f_name, type="returned_by", scope=self.scope[-1],
                 position_node=node.returns
@@ -735,9 +993,8 @@ class AstGraphGenerator(object):
             # https://stackoverflow.com/questions/46458470/should-you-put-quotes-around-type-annotations-in-python
             # https://www.python.org/dev/peps/pep-0484/#forward-references
             annotation_string = self.get_source_from_ast_range(node.annotation)
-            annotation = GNode(name=annotation_string,
-                               type="type_annotation")
-            mention_name = GNode(name=node.arg + "@" + self.scope[-1].name, type="mention", scope=copy(self.scope[-1]))
+            annotation = self.make_node(name=annotation_string, type="type_annotation")
+            mention_name = self.make_node(name=node.arg + "@" + self.scope[-1].name, type="mention", scope=self.scope[-1])
             self.add_edge(
                 edges, src=annotation, dst=mention_name, type="annotation_for", scope=self.scope[-1],
                 position_node=node.annotation, var_position_node=node
@@ -759,11 +1016,10 @@ class AstGraphGenerator(object):
         # https://stackoverflow.com/questions/46458470/should-you-put-quotes-around-type-annotations-in-python
         # https://www.python.org/dev/peps/pep-0484/#forward-references
         annotation_string = self.get_source_from_ast_range(node.annotation)
-        annotation = GNode(name=annotation_string,
-                           type="type_annotation")
+        annotation = self.make_node(name=annotation_string, type="type_annotation")
         edges, name = self.generic_parse(node, ["target", "value"])
         try:
-            mention_name = GNode(name=node.target.id + "@" + self.scope[-1].name, type="mention", scope=copy(self.scope[-1]))
+            mention_name = self.make_node(name=node.target.id + "@" + self.scope[-1].name, type="mention", scope=self.scope[-1])
         except Exception as e:
             mention_name = name
 
@@ -809,7 +1065,7 @@ class AstGraphGenerator(object):
         if type(node) == ast.Name:
             return self.parse_as_mention(str(node.id))
         elif type(node) == ast.NameConstant:
-            return GNode(name=str(node.value), type="NameConstant")
+            return self.make_node(name=str(node.value), type="NameConstant")
 
     def parse_Attribute(self, node):
         if node.attr is not None:
@@ -820,14 +1076,14 @@ class AstGraphGenerator(object):
     def parse_Constant(self, node):
         # TODO
         # decide whether this name should be unique or not
-        name = GNode(name="Constant_", type="Constant")
+        name = self.make_node(name="Constant_", type="Constant")
         # name = "Constant_"
         # if node.kind is not None:
         #     name += ""
         return name
 
     def parse_op_name(self, node):
-        return GNode(name=node.__class__.__name__, type="Op")
+        return self.make_node(name=node.__class__.__name__, type="Op")
         # return node.__class__.__name__
 
     def parse_Num(self, node):
@@ -907,7 +1163,7 @@ class AstGraphGenerator(object):
         ctrlflow_name = self.get_name(name="ctrl_flow", type="CtlFlowInstance", add_random_identifier=True)
         self.add_edge(
             edges,
-            src=GNode(name=node.__class__.__name__, type="CtlFlow"), dst=ctrlflow_name,
+            src=self.make_node(name=node.__class__.__name__, type="CtlFlow"), dst=ctrlflow_name,
             type="control_flow", scope=self.scope[-1]
         )
 
@@ -920,7 +1176,7 @@ class AstGraphGenerator(object):
         return self.generic_parse(node, ["keys", "values"], ensure_iterables=True)
 
     def parse_JoinedStr(self, node):
-        joinedstr_name = GNode(name="JoinedStr_", type="JoinedStr")
+        joinedstr_name = self.make_node(name="JoinedStr_", type="JoinedStr")
         return [], joinedstr_name
         # return self.generic_parse(node, [])
         # return self.generic_parse(node, ["values"])
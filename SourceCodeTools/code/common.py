@@ -2,10 +2,11 @@ import hashlib
 import os
 import sqlite3
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from SourceCodeTools.code.data.file_utils import unpersist
+from SourceCodeTools.code.data.file_utils import unpersist, likely_format
 
 
 class SQLTable:
@@ -33,11 +34,125 @@ def compute_long_id(obj):
     return hashlib.md5(repr(obj).encode('utf-8')).hexdigest()
 
 
+# keys for siphash used by `pd.util.hash_pandas_object`, should never change because ids are stored on disk
+node_hash_key = "0123456789123456"
+node_check_hash_key = "6543219876543210"
+
+
+def hash_node_repr(nodes, hash_key=node_hash_key):
+    """
+    Vectorized 64-bit identity of nodes computed from serialized name and type.
+    :param nodes: DataFrame with columns `serialized_name` and `type`
+    :param hash_key: key for siphash
+    :return: numpy array of int64
+    """
+    node_repr = pd.DataFrame({
+        "serialized_name": np.asarray(nodes["serialized_name"], dtype=object),
+        "type": np.asarray(nodes["type"], dtype=object),
+    })
+    hashes = pd.util.hash_pandas_object(node_repr, index=False, hash_key=hash_key)
+    return hashes.to_numpy().view(np.int64)
+
+
+def find_hash_collisions(hashes, check_hashes):
+    """
+    Find hashes that were computed for different objects. Check hashes are computed for the same objects with a
+    different key, equal hashes with different check hashes indicate a collision.
+    :param hashes: array of hashes
+    :param check_hashes: array of check hashes
+    :return: array of colliding hashes
+    """
+    pairs = pd.DataFrame({"hash": hashes, "check": check_hashes}).drop_duplicates()
+    return pairs.loc[pairs["hash"].duplicated(), "hash"].unique()
+
+
+class IdMapper:
+    """
+    Vectorized mapping of ids. Keys are stored in pandas hash index and whole columns are looked up at once. Keys that
+    are not found are mapped to missing values, integer results are returned as nullable integers.
+    """
+    def __init__(self, keys, values):
+        """
+        :param keys: unique keys
+        :param values: values for every key
+        """
+        self._index = pd.Index(keys)
+        self._values = np.asarray(values)
+        assert len(self._index) == len(self._values), "Keys and values should have the same length"
+
+    @classmethod
+    def from_dict(cls, mapping):
+        if isinstance(mapping, IdMapper):
+            return mapping
+        return cls(list(mapping.keys()), list(mapping.values()))
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def values(self):
+        return self._values
+
+    def positions(self, column):
+        """
+        :param column: Series with ids
+        :return: positions of ids in the key array, -1 for missing ids
+        """
+        missing = column.isna().to_numpy()
+
+        if pd.api.types.is_numeric_dtype(self._index.dtype):
+            if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) == "integer":
+                column = column.astype("Int64")
+            if pd.api.types.is_extension_array_dtype(column.dtype) and pd.api.types.is_numeric_dtype(column.dtype):
+                query = column.to_numpy(dtype=column.dtype.numpy_dtype, na_value=0)
+            else:
+                query = column.to_numpy()
+        else:
+            query = column.astype(object).where(~missing, None).to_numpy()
+
+        positions = self._index.get_indexer(query)
+        if missing.any():
+            positions[missing] = -1
+        return positions
+
+    def map(self, column):
+        """
+        Map ids to new values.
+        :param column: Series with ids
+        :return: Series with mapped values, has the same index as input
+        """
+        if not isinstance(column, pd.Series):
+            column = pd.Series(column)
+
+        positions = self.positions(column)
+        not_found = positions == -1
+        taken = self._values[np.where(not_found, 0, positions)] if len(self._values) > 0 \
+            else np.zeros(len(positions), dtype=self._values.dtype)
+
+        if pd.api.types.is_integer_dtype(taken.dtype) or pd.api.types.is_bool_dtype(taken.dtype):
+            if pd.api.types.is_bool_dtype(taken.dtype):
+                mapped = pd.arrays.BooleanArray(taken, not_found)
+            else:
+                mapped = pd.arrays.IntegerArray(taken.astype(np.int64), not_found)
+        elif pd.api.types.is_float_dtype(taken.dtype):
+            mapped = np.where(not_found, np.nan, taken)
+        else:
+            mapped = taken.astype(object)
+            mapped[not_found] = pd.NA
+
+        return pd.Series(mapped, index=column.index, name=column.name)
+
+
 def map_id_columns(df, column_names, mapper):
     df = df.copy()
+    mapper = IdMapper.from_dict(mapper)
     for col in column_names:
         if col in df.columns:
-            df[col] = df[col].apply(lambda x: mapper.get(x, pd.NA))
+            df[col] = mapper.map(df[col])
     return df
 
 
@@ -72,20 +187,21 @@ def map_columns(input_table, id_map, columns, columns_special=None):
 def grow_with_chunks(chunks, additional_dtypes):
     dtypes = {}
 
-    table = None
+    tables = []
 
     for chunk in chunks:
         for col, type_ in additional_dtypes.items():
             if col in chunk.columns:
                 dtypes[col] = type_
 
-        chunk = chunk.astype(dtypes)
+        tables.append(chunk.astype(dtypes))
 
-        if table is None:
-            table = chunk
-        else:
-            table = pd.concat([table, chunk], copy=False)
-    return table
+    if len(tables) == 0:
+        return None
+
+    # concatenate once, categories of different chunks are unified afterwards
+    table = pd.concat(tables, copy=False)
+    return table.astype(dtypes, copy=False)
 
 
 def return_chunks(chunks, additional_dtypes):
@@ -100,42 +216,65 @@ def return_chunks(chunks, additional_dtypes):
         yield chunk
 
 
-def read_nodes(node_path, as_chunks=False):
-    dtypes = {
-        "id": "int32",
-        "serialized_name": "string",
-    }
-
-    nodes_chunks = unpersist(node_path, dtype=dtypes, chunksize=100000)
-
-    additional_dtypes = {
-        'type': 'category',
-        "mentioned_in": "Int32",
-        "string": "string"
-    }
+def select_columns(chunks, columns):
+    for chunk in chunks:
+        yield chunk[[col for col in chunk.columns if col in columns]]
+
+
+def read_graph_table(path, dtypes, additional_dtypes, as_chunks=False, columns=None):
+    """
+    Read table with nodes or edges. Tables in columnar format are read without splitting into chunks and only
+    requested columns are loaded from disk.
+    :param path: path to the table
+    :param dtypes: types that are applied during reading
+    :param additional_dtypes: types that are applied after reading
+    :param as_chunks: return generator of chunks instead of a table
+    :param columns: optional list of columns to read
+    """
+    if likely_format(path) == "columnar":
+        if as_chunks is False:
+            table = unpersist(path, columns=columns)
+            all_dtypes = {**dtypes, **additional_dtypes}
+            return table.astype({col: type_ for col, type_ in all_dtypes.items() if col in table.columns}, copy=False)
+        chunks = unpersist(path, dtype=dtypes, chunksize=100000, columns=columns)
+    else:
+        chunks = unpersist(path, dtype=dtypes, chunksize=100000)
+        if columns is not None:
+            chunks = select_columns(chunks, set(columns))
 
     if as_chunks is False:
-        return grow_with_chunks(nodes_chunks, additional_dtypes)
+        return grow_with_chunks(chunks, additional_dtypes)
     else:
-        return return_chunks(nodes_chunks, additional_dtypes)
+        return return_chunks(chunks, additional_dtypes)
 
 
-def read_edges(edge_path, as_chunks=False):
-    dtypes = {
-        "id": "int32",
-        "source_node_id": "int32",
-        "target_node_id": "int32",
-    }
+node_dtypes = {
+    "id": "int32",
+    "serialized_name": "string",
+}
 
-    edge_chunks = unpersist(edge_path, dtype=dtypes, chunksize=100000)
+node_additional_dtypes = {
+    'type': 'category',
+    "mentioned_in": "Int32",
+    "string": "string"
+}
 
-    additional_types = {
-        "type": 'category',
-        "mentioned_in": "Int32",
-        "file_id": "Int32"
-    }
+edge_dtypes = {
+    "id": "int32",
+    "source_node_id": "int32",
+    "target_node_id": "int32",
+}
 
-    if as_chunks:
-        return return_chunks(edge_chunks, additional_types)
-    else:
-        return grow_with_chunks(edge_chunks, additional_types)
+edge_additional_dtypes = {
+    "type": 'category',
+    "mentioned_in": "Int32",
+    "file_id": "Int32"
+}
+
+
+def read_nodes(node_path, as_chunks=False, columns=None):
+    return read_graph_table(node_path, node_dtypes, node_additional_dtypes, as_chunks=as_chunks, columns=columns)
+
+
+def read_edges(edge_path, as_chunks=False, columns=None):
+    return read_graph_table(edge_path, edge_dtypes, edge_additional_dtypes, as_chunks=as_chunks, columns=columns)
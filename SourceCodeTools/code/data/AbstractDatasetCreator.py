@@ -1,19 +1,25 @@
+import hashlib
+import json
 import logging
 import os
 import shelve
 import shutil
 import tempfile
 from abc import abstractmethod
-from collections import defaultdict
 from copy import copy
 from functools import partial
 from os.path import join
 
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
 from SourceCodeTools.code.annotator_utils import map_offsets
-from SourceCodeTools.code.common import map_columns, read_edges, read_nodes
-from SourceCodeTools.code.data.file_utils import get_random_name, unpersist, persist, unpersist_if_present
+from SourceCodeTools.code.common import map_columns, read_edges, read_nodes, IdMapper, node_dtypes, node_additional_dtypes, \
+    edge_dtypes, edge_additional_dtypes
+from SourceCodeTools.code.data.file_utils import get_random_name, unpersist, persist, unpersist_if_present, \
+    likely_format, remove_persisted, update_fingerprint
+from SourceCodeTools.code.data.parallel_edges import remove_parallel_edges_with_chunks, find_edges_present_in
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_types import special_mapping
 
 
@@ -49,13 +55,29 @@ class AbstractDatasetCreator:
 
     type_annotation_edge_types = []
 
+    # merged graph tables that are stored in columnar format when `columnar=True`
+    columnar_outputs = {
+        "common_nodes.json": ("common_nodes.columns", {**node_dtypes, **node_additional_dtypes}),
+        "common_edges.json": ("common_edges.columns", {**edge_dtypes, **edge_additional_dtypes}),
+    }
+
     environments = None
+    # files that should exist in environment after extraction, extraction can be skipped in incremental mode only
+    # when all of them are present
+    extraction_outputs = []
+    fingerprint_filename = "extraction_fingerprint"
+    merge_state_filename = "merged_environments.json"
+    # directory inside of output directory where new environments are merged and post-processed before appending
+    staging_dirname = "incremental_staging"
     edge_priority = dict()
+    # number of spill files used for removing parallel edges, memory usage is proportional to
+    # number_of_edges / parallel_edges_partitions
+    parallel_edges_partitions = 64
 
     def __init__(
             self, path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False
+            recompute_l2g=False, columnar=False, incremental=False
     ):
         """
         :param path: path to source code dataset
@@ -73,6 +95,11 @@ class AbstractDatasetCreator:
         :param remove_type_annotations: when True, removes all type annotations from the graph and stores then
             in a file called `type_annotations.bz2`
         :param recompute_l2g: when True, run merging operation again, without extrcting AST nodes and edges second time
+        :param columnar: when True, merged nodes and edges are stored in columnar format (`common_nodes.columns`,
+            `common_edges.columns`) instead of json
+        :param incremental: when True, skip extraction for environments whose inputs did not change since the last
+            run, keep previously assigned global ids, and append new environments to existing merged outputs when
+            possible
         """
         self.indexed_path = path
         self.lang = lang
@@ -85,6 +112,10 @@ class AbstractDatasetCreator:
         self.track_offsets = track_offsets
         self.remove_type_annotations = remove_type_annotations
         self.recompute_l2g = recompute_l2g
+        self.columnar = columnar
+        self.incremental = incremental
+        self.compact_mappings = {}
+        self.fingerprints = {}
 
         self.path = path
         self._prepare_environments()
@@ -108,48 +139,17 @@ class AbstractDatasetCreator:
         shutil.rmtree(self.tmp_dir)
         # os.remove(self.local2global_cache_filename) # TODO nofile on linux, need to check
 
+    @staticmethod
+    def get_global_edge_types():
+        return set(special_mapping.keys()) | set(special_mapping.values())
+
     def handle_parallel_edges(self, edges_path):
         logging.info("Handle parallel edges")
-        last_id = 0
-
-        global_edge_types = set(special_mapping.keys()) | set(special_mapping.values())
-
-        existing_global_edges = set()
-
-        temp_edges = join(os.path.dirname(edges_path), "temp_" + os.path.basename(edges_path))
-
-        for ind, edges in enumerate(read_edges(edges_path, as_chunks=True)):
-            edges["id"] = range(last_id, len(edges) + last_id)
-
-            edge_bank = defaultdict(list)
-            ids_to_remove = set()
-            for id_, type_, src, dst in edges[["id", "type", "source_node_id", "target_node_id"]].values:
-                if type_ in global_edge_types:
-                    global_edge = (type_, src, dst)
-                    if global_edge not in existing_global_edges:
-                        existing_global_edges.add(global_edge)
-                    else:
-                        ids_to_remove.add(id_)
-                else:
-                    edge_bank[(src, dst)].append((id_, type_))
-
-            for key, parallel_edges in edge_bank.items():
-                if len(parallel_edges) > 1:
-                    parallel_edges = sorted(parallel_edges, key=lambda x: self.edge_priority.get(x[1], 3))
-                    ids_to_remove.update(pe[0] for pe in parallel_edges[1:])
-
-            edges = edges[
-                edges["id"].apply(lambda id_: id_ not in ids_to_remove)
-            ]
 
-            edges["id"] = range(last_id, len(edges) + last_id)
-            last_id = len(edges) + last_id
-
-            kwargs = self.get_writing_mode(temp_edges.endswith("csv"), first_written=ind != 0)
-            persist(edges, temp_edges, **kwargs)
-
-        os.remove(edges_path)
-        os.rename(temp_edges, edges_path)
+        remove_parallel_edges_with_chunks(
+            edges_path, global_edge_types=self.get_global_edge_types(), edge_priority=self.edge_priority,
+            kwarg_fn=self.get_writing_mode, num_partitions=self.parallel_edges_partitions
+        )
 
     def post_pruning(self, nodes_path, edges_path):
         logging.info("Post pruning")
@@ -165,6 +165,8 @@ class AbstractDatasetCreator:
 
         temp_edges = join(os.path.dirname(edges_path), "temp_" + os.path.basename(edges_path))
 
+        # edges are renumbered after pruning, so that ids of edges appended in incremental mode continue the sequence
+        last_id = 0
         for ind, edges in enumerate(read_edges(edges_path, as_chunks=True)):
             edges = edges[
                 edges["type"].apply(lambda type_: type_ not in self.restricted_edges)
@@ -172,32 +174,162 @@ class AbstractDatasetCreator:
 
             edges = edges[
                 edges["target_node_id"].apply(lambda type_: type_ not in restricted_nodes)
-            ]
+            ].copy()
+
+            edges["id"] = range(last_id, len(edges) + last_id)
+            last_id = len(edges) + last_id
 
             kwargs = self.get_writing_mode(temp_edges.endswith("csv"), first_written=ind != 0)
             persist(edges, temp_edges, **kwargs)
 
-        os.remove(edges_path)
+        remove_persisted(edges_path)
         os.rename(temp_edges, edges_path)
 
     def compact_mapping_for_l2g(self, global_nodes, filename):
-        if len(global_nodes) > 0:
-            self.update_l2g_file(
-                mapping=self.create_compact_mapping(global_nodes), filename=filename
-            )
+        """
+        Assign dense ids to global nodes. Local to global mappings of environments keep 64-bit global ids, the
+        mapping to dense ids is stored once and applied when local to global mappings are read for merging.
+        :param global_nodes: GlobalIdIndex with global ids of all environments
+        :param filename: name of local to global mapping file
+        """
+        previous = self.get_compact_mapping(filename) if self.incremental else None
+        mapping = self.create_compact_mapping(global_nodes, previous=previous)
+        self.compact_mappings[filename] = mapping
+        persist(
+            pd.DataFrame({"global_id": mapping.index.to_numpy(), "compact_id": mapping.values}),
+            self.get_compact_mapping_path(filename)
+        )
 
     @staticmethod
-    def create_compact_mapping(node_ids):
-        return dict(zip(node_ids, range(len(node_ids))))
-
-    def update_l2g_file(self, mapping, filename):
-        for env_path in tqdm(self.environments, desc=f"Fixing {filename}"):
-            filepath = os.path.join(env_path, filename)
-            if not os.path.isfile(filepath):
-                continue
-            l2g = unpersist(filepath)
-            l2g["global_id"] = l2g["global_id"].apply(lambda id_: mapping.get(id_, None))
-            persist(l2g, filepath)
+    def create_compact_mapping(global_nodes, previous=None):
+        return global_nodes.create_compact_mapping(previous=previous)
+
+    def get_compact_mapping_path(self, filename):
+        if len(self.environments) == 0:
+            return None
+        return join(os.path.dirname(self.environments[0]), "compact_" + filename)
+
+    def get_compact_mapping(self, filename):
+        if filename not in self.compact_mappings:
+            path = self.get_compact_mapping_path(filename)
+            mapping = unpersist_if_present(path) if path is not None else None
+            if mapping is not None:
+                mapping = IdMapper(mapping["global_id"], mapping["compact_id"])
+            self.compact_mappings[filename] = mapping
+        return self.compact_mappings[filename]
+
+    def get_environment_inputs(self, env_path):
+        """
+        :param env_path: path to environment
+        :return: list of input files of the environment that are used for computing its fingerprint
+        """
+        return []
+
+    def get_extraction_flags(self):
+        """
+        :return: dictionary with parameters that affect extraction results
+        """
+        if self.bpe_tokenizer is not None and os.path.exists(self.bpe_tokenizer):
+            tokenizer = update_fingerprint(hashlib.md5(), self.bpe_tokenizer).hexdigest()
+        else:
+            tokenizer = self.bpe_tokenizer
+        return {
+            "creator": self.__class__.__name__,
+            "lang": self.lang,
+            "bpe_tokenizer": tokenizer,
+            "create_subword_instances": self.create_subword_instances,
+            "connect_subwords": self.connect_subwords,
+            "track_offsets": self.track_offsets,
+        }
+
+    def get_fingerprint(self, env_path):
+        """
+        Compute fingerprint of environment inputs and extraction flags.
+        """
+        if env_path not in self.fingerprints:
+            fingerprint = hashlib.md5(json.dumps(self.get_extraction_flags(), sort_keys=True).encode("utf-8"))
+            for input_path in self.get_environment_inputs(env_path):
+                fingerprint.update(os.path.basename(input_path).encode("utf-8"))
+                update_fingerprint(fingerprint, input_path)
+            self.fingerprints[env_path] = fingerprint.hexdigest()
+        return self.fingerprints[env_path]
+
+    def read_stored_fingerprint(self, env_path):
+        fingerprint_path = join(env_path, self.fingerprint_filename)
+        if not os.path.isfile(fingerprint_path):
+            return None
+        with open(fingerprint_path, "r") as fingerprint_file:
+            return fingerprint_file.read().strip()
+
+    def is_extracted(self, env_path):
+        """
+        Check whether extraction can be skipped for environment in incremental mode.
+        """
+        if not self.incremental or self.recompute_l2g:
+            return False
+        if not all(os.path.isfile(join(env_path, filename)) for filename in self.extraction_outputs):
+            return False
+        return self.read_stored_fingerprint(env_path) == self.get_fingerprint(env_path)
+
+    def invalidate_fingerprint(self, env_path):
+        fingerprint_path = join(env_path, self.fingerprint_filename)
+        if os.path.isfile(fingerprint_path):
+            os.remove(fingerprint_path)
+
+    def write_fingerprint(self, env_path):
+        if self.incremental:
+            with open(join(env_path, self.fingerprint_filename), "w") as fingerprint_file:
+                fingerprint_file.write(self.get_fingerprint(env_path))
+
+    def get_merge_flags(self, local2global_filename):
+        return {
+            "local2global": local2global_filename,
+            "only_with_annotations": self.only_with_annotations,
+            "columnar": self.columnar,
+        }
+
+    def get_environments_for_merging(self, local2global_filename, output_dir):
+        """
+        Decide which environments should be merged. In incremental mode, when all previously merged environments
+        are unchanged, only new environments are merged into existing outputs.
+        :param local2global_filename: name of local to global mapping file
+        :param output_dir: directory with merged outputs
+        :return: tuple of environments to merge and flag that indicates appending to existing outputs
+        """
+        state_path = join(output_dir, self.merge_state_filename)
+        nodes_path = self.get_output_path(output_dir, "common_nodes.json")
+
+        if not self.incremental or self.remove_type_annotations or \
+                not os.path.isfile(state_path) or not os.path.exists(nodes_path):
+            return self.environments, False
+
+        with open(state_path, "r") as state_file:
+            state = json.load(state_file)
+
+        if state["flags"] != self.get_merge_flags(local2global_filename):
+            return self.environments, False
+
+        current = {os.path.basename(env_path): self.read_stored_fingerprint(env_path) for env_path in self.environments}
+        if any(current.get(name) != fingerprint for name, fingerprint in state["environments"].items()):
+            return self.environments, False
+
+        new_environments = [
+            env_path for env_path in self.environments if os.path.basename(env_path) not in state["environments"]
+        ]
+        logging.info(f"Appending {len(new_environments)} new environments to existing outputs")
+        return new_environments, True
+
+    def write_merge_state(self, local2global_filename, output_dir):
+        if not self.incremental:
+            return
+        state = {
+            "flags": self.get_merge_flags(local2global_filename),
+            "environments": {
+                os.path.basename(env_path): self.read_stored_fingerprint(env_path) for env_path in self.environments
+            }
+        }
+        with open(join(output_dir, self.merge_state_filename), "w") as state_file:
+            json.dump(state, state_file, indent=4)
 
     def get_local2global(self, path):
         if path in self.local2global_cache:
@@ -207,7 +339,10 @@ class AbstractDatasetCreator:
             if local2global_df is None:
                 return None
             else:
-                local2global = dict(zip(local2global_df['id'], local2global_df['global_id']))
+                compact_mapping = self.get_compact_mapping(os.path.basename(path))
+                if compact_mapping is not None:
+                    local2global_df["global_id"] = compact_mapping.map(local2global_df["global_id"])
+                local2global = dict(zip(local2global_df['id'].tolist(), local2global_df['global_id'].tolist()))
                 self.local2global_cache[path] = local2global
                 return local2global
 
@@ -272,20 +407,27 @@ class AbstractDatasetCreator:
 
     def create_global_file(
             self, local_file, local2global_file, columns, output_path, message, ensure_unique_with=None,
-            columns_special=None
+            columns_special=None, environments=None, append=False
     ):
-        assert output_path.endswith("json") or output_path.endswith("csv")
+        output_format = likely_format(output_path)
+        assert output_format in {"json", "csv", "columnar"}
+
+        if environments is None:
+            environments = self.environments
+
+        first_written = append and os.path.exists(output_path)
 
         if ensure_unique_with is not None:
             unique_values = set()
+            if first_written:
+                for existing in read_nodes(output_path, as_chunks=True, columns=ensure_unique_with):
+                    unique_values.update(zip(*(existing[col_name] for col_name in ensure_unique_with)))
         else:
             unique_values = None
 
-        first_written = False
-
         for ind, env_path in tqdm(
-                enumerate(self.environments), desc=message, leave=True,
-                dynamic_ncols=True, total=len(self.environments)
+                enumerate(environments), desc=message, leave=True,
+                dynamic_ncols=True, total=len(environments)
         ):
             mapped_local = self.read_mapped_local(
                 env_path, local_file, local2global_file, columns, columns_special=columns_special
@@ -301,6 +443,8 @@ class AbstractDatasetCreator:
                     unique_values.update(unique_verify)
 
                 kwargs = self.get_writing_mode(output_path.endswith("csv"), first_written)
+                if output_format == "columnar":
+                    kwargs["dtype"] = self.get_columnar_dtypes(output_path)
 
                 persist(mapped_local, output_path, **kwargs)
                 first_written = True
@@ -346,34 +490,171 @@ class AbstractDatasetCreator:
             kwargs = self.get_writing_mode(temp_nodes.endswith("csv"), first_written=ind != 0)
             persist(nodes, temp_nodes, **kwargs)
 
-        os.remove(nodes_path)
+        remove_persisted(nodes_path)
         os.rename(temp_nodes, nodes_path)
 
-    def join_files(self, files, local2global_filename, output_dir):
+    def get_output_path(self, output_dir, filename):
+        if self.columnar and filename in self.columnar_outputs:
+            filename, _ = self.columnar_outputs[filename]
+        return join(output_dir, filename)
+
+    def get_columnar_dtypes(self, output_path):
+        for filename, dtypes in self.columnar_outputs.values():
+            if os.path.basename(output_path) == filename:
+                return dtypes
+        return None
+
+    def join_files(self, files, local2global_filename, output_dir, environments=None, append=False):
         for file in files:
             params = copy(self.merging_specification[file])
-            params["output_path"] = join(output_dir, params.pop("output_path"))
-            self.create_global_file(file, local2global_filename, message=f"Merging {file}", **params)
+            params["output_path"] = self.get_output_path(output_dir, params.pop("output_path"))
+            self.create_global_file(
+                file, local2global_filename, message=f"Merging {file}", environments=environments, append=append,
+                **params
+            )
 
-    def merge_graph_without_ast(self, output_path):
-        self.join_files(self.files_for_merging, "local2global.bz2", output_path)
+    def append_staged_nodes(self, staged_nodes_path, nodes_path, ensure_unique_with, active_nodes):
+        """
+        Append nodes to existing nodes, skipping nodes that are already present.
+        :param active_nodes: set of ids of nodes that are used by appended edges, other nodes are not appended
+        """
+        logging.info("Append nodes")
 
-        get_path = partial(join, output_path)
+        unique_values = set()
+        for existing in read_nodes(nodes_path, as_chunks=True, columns=ensure_unique_with):
+            unique_values.update(zip(*(existing[col_name] for col_name in ensure_unique_with)))
+
+        for nodes in read_nodes(staged_nodes_path, as_chunks=True):
+            nodes = nodes[
+                nodes['id'].apply(lambda id_: id_ in active_nodes)
+            ]
+            nodes = nodes.loc[
+                map(lambda x: x not in unique_values, zip(*(nodes[col_name] for col_name in ensure_unique_with)))
+            ]
+
+            kwargs = self.get_writing_mode(nodes_path.endswith("csv"), first_written=True)
+            if likely_format(nodes_path) == "columnar":
+                kwargs["dtype"] = self.get_columnar_dtypes(nodes_path)
+            persist(nodes, nodes_path, **kwargs)
+
+    def append_staged_edges(self, staged_edges_path, edges_path):
+        """
+        Append edges to existing edges, skipping edges that are duplicate of or parallel to existing edges. Appended
+        edges get ids after the largest existing id.
+        :return: set of ids of nodes that are used by appended edges
+        """
+        logging.info("Append edges")
+
+        present, next_id = find_edges_present_in(staged_edges_path, edges_path, self.get_global_edge_types())
+
+        active_nodes = set()
+        position = 0
+        for edges in read_edges(staged_edges_path, as_chunks=True):
+            chunk_size = len(edges)
+            edges = edges[~present[position: position + chunk_size]].copy()
+            position += chunk_size
+
+            edges["id"] = range(next_id, len(edges) + next_id)
+            next_id = len(edges) + next_id
+
+            active_nodes.update(edges['source_node_id'])
+            active_nodes.update(edges['target_node_id'])
+
+            kwargs = self.get_writing_mode(edges_path.endswith("csv"), first_written=True)
+            if likely_format(edges_path) == "columnar":
+                kwargs["dtype"] = self.get_columnar_dtypes(edges_path)
+            persist(edges, edges_path, **kwargs)
+
+        return active_nodes
+
+    def merge_graph(self, files, local2global_filename, output_path, post_process):
+        """
+        Merge environments into a graph. When new environments can be appended to existing outputs in incremental
+        mode, their nodes and edges are merged and post-processed in a staging directory first, and only then
+        appended, so that existing nodes and edges are not processed again. Edges that are parallel to existing
+        edges are not appended, existing edges are preferred regardless of the priority of edge types.
+        :param files: local files to merge
+        :param local2global_filename: name of local to global mapping file
+        :param output_path: directory with merged outputs
+        :param post_process: function that receives paths to nodes and edges and processes them in place
+        """
+        environments, append = self.get_environments_for_merging(local2global_filename, output_path)
+
+        nodes_path = self.get_output_path(output_path, "common_nodes.json")
+        edges_path = self.get_output_path(output_path, "common_edges.json")
+
+        if not append:
+            self.join_files(files, local2global_filename, output_path, environments=environments)
+            post_process(nodes_path, edges_path)
+            return
+
+        graph_outputs = {"common_nodes.json", "common_edges.json"}
+        graph_files = [file for file in files if self.merging_specification[file]["output_path"] in graph_outputs]
+        other_files = [file for file in files if file not in graph_files]
+
+        self.join_files(other_files, local2global_filename, output_path, environments=environments, append=True)
+
+        staging_path = join(output_path, self.staging_dirname)
+        if os.path.isdir(staging_path):
+            shutil.rmtree(staging_path)
+        os.mkdir(staging_path)
+
+        self.join_files(graph_files, local2global_filename, staging_path, environments=environments)
+
+        staged_nodes_path = self.get_output_path(staging_path, "common_nodes.json")
+        staged_edges_path = self.get_output_path(staging_path, "common_edges.json")
+
+        if os.path.exists(staged_nodes_path) and os.path.exists(staged_edges_path):
+            post_process(staged_nodes_path, staged_edges_path)
+
+            ensure_unique_with = next(
+                self.merging_specification[file]["ensure_unique_with"] for file in graph_files
+                if self.merging_specification[file]["output_path"] == "common_nodes.json"
+            )
+            # edges are appended first, nodes that are used only by edges parallel to existing edges are not appended
+            active_nodes = self.append_staged_edges(staged_edges_path, edges_path)
+            self.append_staged_nodes(staged_nodes_path, nodes_path, ensure_unique_with, active_nodes)
+
+        shutil.rmtree(staging_path)
+
+    def post_process_graph_without_ast(self, nodes_path, edges_path):
+        self.filter_orphaned_nodes(
+            nodes_path,
+            edges_path,
+        )
+        self.handle_parallel_edges(edges_path)
+
+    def post_process_graph_with_ast(self, nodes_path, edges_path):
+        if self.remove_type_annotations:
+            self.filter_type_edges(nodes_path, edges_path)
+
+        self.handle_parallel_edges(edges_path)
 
-        nodes_path = get_path("common_nodes.json")
-        edges_path = get_path("common_edges.json")
+        self.post_pruning(nodes_path, edges_path)
 
         self.filter_orphaned_nodes(
             nodes_path,
             edges_path,
         )
+
+    def merge_graph_without_ast(self, output_path):
+        self.merge_graph(
+            self.files_for_merging, "local2global.bz2", output_path, self.post_process_graph_without_ast
+        )
+
+        get_path = partial(join, output_path)
+
+        nodes_path = self.get_output_path(output_path, "common_nodes.json")
+        edges_path = self.get_output_path(output_path, "common_edges.json")
+
+        # node names are counted over the whole graph
         node_names = self.extract_node_names(
             nodes_path, min_count=2
         )
         if node_names is not None:
             persist(node_names, get_path("node_names.json"))
 
-        self.handle_parallel_edges(edges_path)
+        self.write_merge_state("local2global.bz2", output_path)
 
         if self.visualize:
             self.visualize_func(
@@ -384,31 +665,25 @@ class AbstractDatasetCreator:
 
     def merge_graph_with_ast(self, output_path):
 
-        self.join_files(self.files_for_merging_with_ast, "local2global_with_ast.bz2", output_path)
+        self.merge_graph(
+            self.files_for_merging_with_ast, "local2global_with_ast.bz2", output_path, self.post_process_graph_with_ast
+        )
 
         get_path = partial(join, output_path)
 
-        nodes_path = get_path("common_nodes.json")
-        edges_path = get_path("common_edges.json")
-
-        if self.remove_type_annotations:
-            self.filter_type_edges(nodes_path, edges_path)
-
-        self.handle_parallel_edges(edges_path)
+        nodes_path = self.get_output_path(output_path, "common_nodes.json")
+        edges_path = self.get_output_path(output_path, "common_edges.json")
 
-        self.post_pruning(nodes_path, edges_path)
-
-        self.filter_orphaned_nodes(
-            nodes_path,
-            edges_path,
-        )
         # persist(global_nodes, get_path("common_nodes.json"))
+        # node names are counted over the whole graph
         node_names = self.extract_node_names(
             nodes_path, min_count=2
         )
         if node_names is not None:
             persist(node_names, get_path("node_names.json"))
 
+        self.write_merge_state("local2global_with_ast.bz2", output_path)
+
         if self.visualize:
             self.visualize_func(
                 read_nodes(nodes_path),
@@ -3,6 +3,7 @@ import logging
 import os.path
 import shutil
 import sys
+from multiprocessing import Pool
 from os.path import join
 
 import numpy as np
@@ -12,15 +13,15 @@ from tqdm import tqdm
 
 from SourceCodeTools.cli_arguments import AstDatasetCreatorArguments
 from SourceCodeTools.code.ast import has_valid_syntax
-from SourceCodeTools.code.common import read_nodes, read_edges
+from SourceCodeTools.code.common import read_nodes, read_edges, IdMapper
 from SourceCodeTools.code.data.AbstractDatasetCreator import AbstractDatasetCreator
 from SourceCodeTools.code.data.ast_graph.extract_node_names import extract_node_names
 from SourceCodeTools.code.data.ast_graph.filter_type_edges import filter_type_edges, filter_type_edges_with_chunks
 from SourceCodeTools.code.data.file_utils import persist, unpersist, unpersist_if_present
 from SourceCodeTools.code.data.ast_graph.draw_graph import visualize
-from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes
-from SourceCodeTools.code.annotator_utils import adjust_offsets2, map_offsets, to_offsets, get_cum_lens
-from SourceCodeTools.code.data.ast_graph.local2global import get_local2global
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes, materialize_node_strings
+from SourceCodeTools.code.annotator_utils import adjust_offsets2, map_offsets, to_offsets
+from SourceCodeTools.code.data.ast_graph.local2global import get_local2global, GlobalIdIndex
 from SourceCodeTools.nlp.string_tools import get_byte_to_char_map
 
 
@@ -176,6 +177,10 @@ class NodeIdResolver:
             if node_repr in self.node_ids:
                 node_id = self.node_ids[node_repr]
                 node.setprop("id", node_id)
+                # resolve scope even for known nodes, this way the order of new nodes does not depend on
+                # the nodes seen in other files and per-file resolution gives the same result as a shared resolver
+                if hasattr(node, "scope"):
+                    self.resolve_node_id(node.scope)
             else:
                 new_id = self.get_node_id(node_repr)
                 self.node_ids[node_repr] = new_id
@@ -183,18 +188,17 @@ class NodeIdResolver:
                 if not PythonSharedNodes.is_shared(node) and not node.name == "unresolved_name":
                     assert "0x" in node.name
 
-                self.new_nodes.append(
-                    {
-                        "id": new_id,
-                        "type": node.type,
-                        "serialized_name": node.name,
-                        "mentioned_in": pd.NA,
-                        "string": node.string
-                    }
-                )
+                new_node = {
+                    "id": new_id,
+                    "type": node.type,
+                    "serialized_name": node.name,
+                    "mentioned_in": pd.NA,
+                    "string": node.string
+                }
+                self.new_nodes.append(new_node)
                 if hasattr(node, "scope"):
                     self.resolve_node_id(node.scope)
-                    self.new_nodes[-1]["mentioned_in"] = node.scope.id
+                    new_node["mentioned_in"] = node.scope.id
                 node.setprop("id", new_id)
         return node
 
@@ -214,6 +218,8 @@ class NodeIdResolver:
         new_nodes = new_nodes[
             ['id', 'type', 'serialized_name', 'mentioned_in', 'string']
         ].astype({"mentioned_in": "string", "id": "string"})
+        # node strings are kept as ranges of the source until this point
+        new_nodes["string"] = materialize_node_strings(new_nodes["string"])
 
         return new_nodes
 
@@ -251,7 +257,7 @@ class AstProcessor(AstGraphGenerator):
             df = df.astype({col: "Int32" for col in df.columns if col not in {"src", "dst", "type"}})
 
             body = "\n".join(self.source)
-            cum_lens = get_cum_lens(body, as_bytes=True)
+            cum_lens = self._source_buffer.line_offsets
             byte2char = get_byte_to_char_map(body)
 
             def format_offsets(edges: pd.DataFrame):
@@ -281,7 +287,7 @@ class AstProcessor(AstGraphGenerator):
             return df
         else:
             body = "\n".join(self.source)
-            cum_lens = get_cum_lens(body, as_bytes=True)
+            cum_lens = self._source_buffer.line_offsets
             byte2char = get_byte_to_char_map(body)
 
             def format_offsets(edge):
@@ -352,14 +358,14 @@ def process_code_without_index(source_code, node_resolver, mention_tokenizer, tr
     try:
         ast_processor = AstProcessor(source_code)
     except:
-        return None, None, None
+        return None, None
     try: # TODO recursion error does not appear consistently. The issue is probably with library versions...
         edges = ast_processor.get_edges(as_dataframe=False)
     except RecursionError:
-        return None, None, None
+        return None, None
 
     if len(edges) == 0:
-        return None, None, None
+        return None, None
 
     # tokenize names, replace nodes with their ids
     edges = standardize_new_edges(edges, node_resolver, mention_tokenizer)
@@ -397,62 +403,148 @@ def process_code_without_index(source_code, node_resolver, mention_tokenizer, tr
     return edges, ast_offsets
 
 
+def process_module(package, source_code_id, source_code, node_resolver, mention_tokenizer, track_offsets=False):
+    """
+    Build graph for a single module.
+    :param package: name of the package
+    :param source_code_id: id of the module
+    :param source_code: source code of the module
+    :param node_resolver: helper class that tracks node ids, new nodes are added to `node_resolver.new_nodes`
+    :param mention_tokenizer: helper class that performs tokenization of relevant nodes
+    :param track_offsets: whether to return offsets
+    :return: list of edges and list of offsets, None if the module cannot be processed
+    """
+    source_code_ = source_code.lstrip()
+    initial_strip = source_code[:len(source_code) - len(source_code_)]
+
+    if not has_valid_syntax(source_code):
+        return None, None
+
+    edges, ast_offsets = process_code_without_index(
+        source_code, node_resolver, mention_tokenizer, track_offsets=track_offsets
+    )
+
+    if ast_offsets is not None:
+        adjust_offsets2(ast_offsets, len(initial_strip))
+
+    if edges is None:
+        return None, None
+
+    # afterprocessing
+
+    for edge in edges:
+        edge["file_id"] = source_code_id
+
+    # finish afterprocessing
+
+    offsets = []
+
+    def format_offsets(ast_offsets, target):
+        """
+        Format offset as a record and add to the common storage for offsets
+        :param ast_offsets:
+        :param target: List where all other offsets are stored.
+        :return: Nothing
+        """
+        if ast_offsets is not None:
+            for offset in ast_offsets:
+                target.append({
+                    "file_id": source_code_id,
+                    "start": offset[0],
+                    "end": offset[1],
+                    "node_id": offset[2],
+                    "mentioned_in": offset[3],
+                    "string": source_code[offset[0]: offset[1]],
+                    "package": package
+                })
+
+    format_offsets(ast_offsets, target=offsets)
+
+    return edges, offsets
+
+
+_worker_mention_tokenizer = None
+_worker_track_offsets = False
+
+
+def _init_extraction_worker(bpe_tokenizer_path, create_subword_instances, connect_subwords, track_offsets):
+    global _worker_mention_tokenizer, _worker_track_offsets
+    _worker_mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
+    _worker_track_offsets = track_offsets
+
+
+def _process_module_in_worker(module):
+    """
+    Process module with a node resolver local to this module. Node ids are computed from node names and types,
+    therefore, the ids are consistent between workers.
+    :return: edges, offsets, and nodes created for this module
+    """
+    package, source_code_id, source_code = module
+    node_resolver = NodeIdResolver()
+    edges, offsets = process_module(
+        package, source_code_id, source_code, node_resolver, _worker_mention_tokenizer,
+        track_offsets=_worker_track_offsets
+    )
+    return edges, offsets, node_resolver.new_nodes
+
+
+def process_modules_in_parallel(
+        source_codes, node_resolver, bpe_tokenizer_path, create_subword_instances, connect_subwords,
+        track_offsets=False, num_workers=2
+):
+    """
+    Process modules with a pool of workers. Results are merged in the order of input modules. A node that appears
+    in several modules is kept only once, at the position where it was created for the first time. This gives
+    the same nodes, edges, and offsets as processing modules one by one with a shared resolver.
+    :return: Generator of edges and offsets for every module. New nodes are stashed in `node_resolver`
+    """
+    seen_nodes = set(node_resolver.node_ids.values())
+
+    with Pool(
+            num_workers, initializer=_init_extraction_worker,
+            initargs=(bpe_tokenizer_path, create_subword_instances, connect_subwords, track_offsets)
+    ) as pool:
+        for edges, offsets, new_nodes in pool.imap(_process_module_in_worker, source_codes, chunksize=16):
+            for node in new_nodes:
+                if node["id"] not in seen_nodes:
+                    seen_nodes.add(node["id"])
+                    node_resolver.new_nodes.append(node)
+            node_resolver.stash_new_nodes()
+            yield edges, offsets
+
+
 def build_ast_only_graph(
-        source_codes, bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False
+        source_codes, bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False,
+        num_workers=1
 ):
     node_resolver = NodeIdResolver()
-    mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
     all_ast_edges = []
     all_offsets = []
 
-    for package, source_code_id, source_code in tqdm(source_codes, desc="Processing modules"):
-        source_code_ = source_code.lstrip()
-        initial_strip = source_code[:len(source_code) - len(source_code_)]
-
-        if not has_valid_syntax(source_code):
-            continue
-
-        edges, ast_offsets = process_code_without_index(
-            source_code, node_resolver, mention_tokenizer, track_offsets=track_offsets
+    if num_workers > 1:
+        processed_modules = process_modules_in_parallel(
+            source_codes, node_resolver, bpe_tokenizer_path, create_subword_instances, connect_subwords,
+            track_offsets=track_offsets, num_workers=num_workers
         )
+    else:
+        mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
 
-        if ast_offsets is not None:
-            adjust_offsets2(ast_offsets, len(initial_strip))
+        def process_sequentially():
+            for package, source_code_id, source_code in source_codes:
+                yield process_module(
+                    package, source_code_id, source_code, node_resolver, mention_tokenizer,
+                    track_offsets=track_offsets
+                )
+                node_resolver.stash_new_nodes()
 
+        processed_modules = process_sequentially()
+
+    for edges, offsets in tqdm(processed_modules, desc="Processing modules"):
         if edges is None:
             continue
 
-        # afterprocessing
-
-        for edge in edges:
-            edge["file_id"] = source_code_id
-
-        # finish afterprocessing
-
         all_ast_edges.extend(edges)
-
-        def format_offsets(ast_offsets, target):
-            """
-            Format offset as a record and add to the common storage for offsets
-            :param ast_offsets:
-            :param target: List where all other offsets are stored.
-            :return: Nothing
-            """
-            if ast_offsets is not None:
-                for offset in ast_offsets:
-                    target.append({
-                        "file_id": source_code_id,
-                        "start": offset[0],
-                        "end": offset[1],
-                        "node_id": offset[2],
-                        "mentioned_in": offset[3],
-                        "string": source_code[offset[0]: offset[1]],
-                        "package": package
-                    })
-
-        format_offsets(ast_offsets, target=all_offsets)
-
-        node_resolver.stash_new_nodes()
+        all_offsets.extend(offsets)
 
     all_ast_nodes = node_resolver.new_nodes_for_write(from_stashed=True)
 
@@ -479,14 +571,14 @@ def build_ast_only_graph(
     else:
         all_offsets = None
 
-    node2id = dict(zip(all_ast_nodes["id"], range(len(all_ast_nodes))))
+    node2id = IdMapper(all_ast_nodes["id"], np.arange(len(all_ast_nodes)))
 
     def map_columns_to_int(table, dense_columns, sparse_columns):
         types = {column: "int64" for column in dense_columns}
         types.update({column: "Int64" for column in sparse_columns})
 
         for column, dtype in types.items():
-            table[column] = table[column].apply(node2id.get).astype(dtype)
+            table[column] = node2id.map(table[column]).astype(dtype)
 
     map_columns_to_int(all_ast_nodes, dense_columns=["id"], sparse_columns=["mentioned_in"])
     map_columns_to_int(
@@ -494,7 +586,8 @@ def build_ast_only_graph(
         dense_columns=["source_node_id", "target_node_id"],
         sparse_columns=["mentioned_in"]
     )
-    map_columns_to_int(all_offsets, dense_columns=["node_id"], sparse_columns=["mentioned_in"])
+    if all_offsets is not None:
+        map_columns_to_int(all_offsets, dense_columns=["node_id"], sparse_columns=["mentioned_in"])
 
     return all_ast_nodes, all_ast_edges, all_offsets
 
@@ -528,6 +621,7 @@ def build_ast_graph_from_modules():
     parser.add_argument("--bpe_tokenizer", type=str, help="Path to sentencepiece model. When provided, names will be subtokenized.")
     parser.add_argument("--visualize", action="store_true", help="Visualize graph. Do not use on large graphs.")
     parser.add_argument("--create_test_data", action="store_true", help="Visualize graph. Do not use on large graphs.")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of processes for extracting graphs.")
     args = parser.parse_args()
 
     if args.create_test_data:
@@ -541,7 +635,8 @@ def build_ast_graph_from_modules():
 
     nodes, edges, offsets = build_ast_only_graph(
         zip(source_code["package"], source_code["id"], source_code["filecontent"]), args.bpe_tokenizer,
-        create_subword_instances=False, connect_subwords=False, lang="py", track_offsets=True
+        create_subword_instances=False, connect_subwords=False, lang="py", track_offsets=True,
+        num_workers=args.num_workers
     )
 
     print(f"Writing output to {output_dir}")
@@ -606,43 +701,105 @@ class AstDatasetCreator(AbstractDatasetCreator):
 
     type_annotation_edge_types = ['annotation_for', 'returned_by']
 
+    extraction_outputs = ["nodes_with_ast.bz2", "edges_with_ast.bz2", "local2global_with_ast.bz2"]
+
     def __init__(
             self, path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False, chunksize=10000, keep_frac=1.0, seed=None
+            recompute_l2g=False, chunksize=10000, keep_frac=1.0, seed=None, columnar=False, num_workers=1,
+            incremental=False
     ):
         self.chunksize = chunksize
         self.keep_frac = keep_frac
         self.seed = seed
+        self.num_workers = num_workers
         super().__init__(
             path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
-            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g
+            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g, columnar, incremental
         )
 
     def __del__(self):
         # TODO use /tmp and add flag for overriding temp folder location
-        if hasattr(self, "temp_path") and os.path.isdir(self.temp_path):
+        # chunk environments are kept in incremental mode, they are reused during the next run
+        if hasattr(self, "temp_path") and os.path.isdir(self.temp_path) and not self.incremental:
             shutil.rmtree(self.temp_path)
         # pass
 
-    def _prepare_environments(self):
+    def get_environments_location(self):
         dataset_location = os.path.dirname(self.path)
-        temp_path = os.path.join(dataset_location, "temp_graph_builder")
-        self.temp_path = temp_path
-        if os.path.isdir(temp_path):
-            raise FileExistsError(f"Directory exists: {temp_path}")
-        os.mkdir(temp_path)
+        if self.incremental:
+            dataset_name = os.path.splitext(os.path.basename(self.path))[0]
+            return os.path.join(dataset_location, f"{dataset_name}_graph_builder")
+        return os.path.join(dataset_location, "temp_graph_builder")
 
-        rnd_state = np.random.RandomState(self.seed)
+    @staticmethod
+    def get_package_environment_name(package):
+        """
+        Name of environment is computed from the name of package, so that a package is found in the same environment
+        during the next run regardless of its position in the dataset.
+        """
+        return f"package_{hashlib.md5(str(package).encode('utf-8')).hexdigest()}"
 
-        for ind, chunk in enumerate(pd.read_csv(self.path, chunksize=self.chunksize)):
+    def get_source_code_path(self, env_path):
+        # in incremental mode, source code of a package is written in parts as it is found in the dataset
+        return join(env_path, "source_code.csv" if self.incremental else "source_code.bz2")
+
+    def sample_chunk(self, chunk, rnd_state):
+        # files keep the order of the dataset when all of them are used
+        if self.keep_frac < 1.0:
             chunk = chunk.sample(frac=self.keep_frac, random_state=rnd_state)
+        return chunk
+
+    def _prepare_chunk_environments(self, temp_path, rnd_state):
+        for ind, chunk in enumerate(pd.read_csv(self.path, chunksize=self.chunksize)):
+            chunk = self.sample_chunk(chunk, rnd_state)
             chunk_path = os.path.join(temp_path, f"chunk_{ind}")
             os.mkdir(chunk_path)
-            persist(chunk, os.path.join(chunk_path, "source_code.bz2"))
+            persist(chunk, self.get_source_code_path(chunk_path))
+            self.environments.append(chunk_path)
+
+    def _prepare_package_environments(self, temp_path, rnd_state):
+        for chunk in pd.read_csv(self.path, chunksize=self.chunksize):
+            chunk = self.sample_chunk(chunk, rnd_state)
+            for package, package_source_code in chunk.groupby("package", sort=False, dropna=False):
+                env_path = os.path.join(temp_path, self.get_package_environment_name(package))
+                first_written = env_path in self.environments
+                if not first_written:
+                    os.makedirs(env_path, exist_ok=True)
+                    self.environments.append(env_path)
+                kwargs = self.get_writing_mode(is_csv=True, first_written=first_written)
+                persist(package_source_code, self.get_source_code_path(env_path), **kwargs)
+
+        # remove environments of packages that were removed since the last run
+        for dir in os.listdir(temp_path):
+            path = os.path.join(temp_path, dir)
+            if os.path.isdir(path) and dir.startswith("package_") and path not in self.environments:
+                shutil.rmtree(path)
+
+    def _prepare_environments(self):
+        temp_path = self.get_environments_location()
+        self.temp_path = temp_path
+        if self.incremental:
+            if not os.path.isdir(temp_path):
+                os.mkdir(temp_path)
+        else:
+            if os.path.isdir(temp_path):
+                raise FileExistsError(f"Directory exists: {temp_path}")
+            os.mkdir(temp_path)
+
+        rnd_state = np.random.RandomState(self.seed)
+
+        # environments follow the order of the dataset
+        self.environments = []
+        if self.incremental:
+            # every package gets its own environment, so that changed or added packages do not affect environments
+            # of other packages
+            self._prepare_package_environments(temp_path, rnd_state)
+        else:
+            self._prepare_chunk_environments(temp_path, rnd_state)
 
-        paths = (os.path.join(temp_path, dir) for dir in os.listdir(temp_path))
-        self.environments = sorted(list(filter(lambda path: os.path.isdir(path), paths)), key=lambda x: x.lower())
+    def get_environment_inputs(self, env_path):
+        return [self.get_source_code_path(env_path)]
 
     @staticmethod
     def extract_node_names(nodes_path, min_count):
@@ -654,19 +811,28 @@ class AstDatasetCreator(AbstractDatasetCreator):
         filter_type_edges_with_chunks(nodes_path, edges_path, kwarg_fn=self.get_writing_mode)
 
     def do_extraction(self):
-        global_nodes_with_ast = set()
+        global_nodes_with_ast = GlobalIdIndex()
 
         for env_path in self.environments:
             logging.info(f"Found {os.path.basename(env_path)}")
 
+            if self.is_extracted(env_path):
+                logging.info("Environment is not changed, skipping extraction")
+                get_local2global(
+                    global_nodes=global_nodes_with_ast, local_nodes=unpersist(join(env_path, "nodes_with_ast.bz2"))
+                )
+                continue
+
+            self.invalidate_fingerprint(env_path)
+
             if not self.recompute_l2g:
 
-                source_code = unpersist(join(env_path, "source_code.bz2"))
+                source_code = unpersist(self.get_source_code_path(env_path))
 
                 nodes_with_ast, edges_with_ast, offsets = build_ast_only_graph(
                     zip(source_code["package"], source_code["id"], source_code["filecontent"]), self.bpe_tokenizer,
                     create_subword_instances=self.create_subword_instances, connect_subwords=self.connect_subwords,
-                    lang=self.lang, track_offsets=self.track_offsets
+                    lang=self.lang, track_offsets=self.track_offsets, num_workers=self.num_workers
                 )
 
             else:
@@ -681,8 +847,6 @@ class AstDatasetCreator(AbstractDatasetCreator):
                 global_nodes=global_nodes_with_ast, local_nodes=nodes_with_ast
             )
 
-            global_nodes_with_ast.update(local2global_with_ast["global_id"])
-
             self.write_type_annotation_flag(edges_with_ast, env_path)
 
             self.write_local(
@@ -692,6 +856,8 @@ class AstDatasetCreator(AbstractDatasetCreator):
                 filecontent_with_package=source_code,
             )
 
+            self.write_fingerprint(env_path)
+
         self.compact_mapping_for_l2g(global_nodes_with_ast, "local2global_with_ast.bz2")
 
     def create_output_dirs(self, output_path):
@@ -731,6 +897,7 @@ if __name__ == "__main__":
     dataset = AstDatasetCreator(
         args.source_code, args.language, args.bpe_tokenizer, args.create_subword_instances,
         args.connect_subwords, args.only_with_annotations, args.do_extraction, args.visualize, args.track_offsets,
-        args.remove_type_annotations, args.recompute_l2g, args.chunksize, args.keep_frac, args.seed
+        args.remove_type_annotations, args.recompute_l2g, args.chunksize, args.keep_frac, args.seed,
+        columnar=args.columnar, num_workers=args.num_workers, incremental=args.incremental
     )
     dataset.merge(args.output_directory)
\ No newline at end of file
@@ -2,7 +2,7 @@ import os
 from os.path import join
 
 from SourceCodeTools.code.common import read_nodes, read_edges
-from SourceCodeTools.code.data.file_utils import persist
+from SourceCodeTools.code.data.file_utils import persist, remove_persisted
 
 
 def filter_type_edges(nodes, edges, keep_proportion=0.0):
@@ -72,5 +72,5 @@ def filter_type_edges_with_chunks(nodes_path, edges_path, kwarg_fn):
         kwargs = kwarg_fn(temp_edges.endswith("csv"), first_written=ind != 0)
         persist(no_annotations, temp_edges, **kwargs)
 
-    os.remove(edges_path)
+    remove_persisted(edges_path)
     os.rename(temp_edges, edges_path)
\ No newline at end of file
@@ -1,38 +1,106 @@
 import sys
 
-from SourceCodeTools.code.common import compute_long_id, create_node_repr
+import numpy as np
+
+from SourceCodeTools.code.common import IdMapper, hash_node_repr, node_check_hash_key, find_hash_collisions
 from SourceCodeTools.code.data.file_utils import *
 
 
+class GlobalIdIndex:
+    """
+    Collects global ids of nodes from all environments and assigns dense ids to them in a single pass. Together with
+    every global id, a check hash computed with a different key is stored and used to detect hash collisions.
+    """
+    def __init__(self, consolidate_every=64):
+        """
+        :param consolidate_every: number of added chunks after which duplicates are removed from collected ids
+        """
+        self._global_ids = []
+        self._check_hashes = []
+        self._consolidate_every = consolidate_every
+
+    def add(self, global_ids, check_hashes):
+        self._global_ids.append(np.asarray(global_ids, dtype=np.int64))
+        self._check_hashes.append(np.asarray(check_hashes, dtype=np.int64))
+        if len(self._global_ids) >= self._consolidate_every:
+            self._consolidate()
+
+    def _consolidate(self):
+        if len(self._global_ids) == 0:
+            return
+        pairs = pd.DataFrame({
+            "global_id": np.concatenate(self._global_ids), "check": np.concatenate(self._check_hashes)
+        }).drop_duplicates()
+        self._global_ids = [pairs["global_id"].to_numpy()]
+        self._check_hashes = [pairs["check"].to_numpy()]
+
+    def __len__(self):
+        self._consolidate()
+        return sum(len(ids) for ids in self._global_ids)
+
+    def create_compact_mapping(self, previous=None):
+        """
+        Assign dense ids in the order in which nodes were first added.
+        :param previous: optional IdMapper with previously assigned dense ids. Nodes that are present in it keep their
+            dense ids, new nodes get ids after the largest existing one.
+        :return: IdMapper from global ids to dense ids
+        """
+        self._consolidate()
+        if len(self._global_ids) == 0:
+            return IdMapper(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+
+        global_ids = self._global_ids[0]
+        check_collisions(global_ids, self._check_hashes[0])
+
+        if previous is None or len(previous) == 0:
+            return IdMapper(global_ids, np.arange(len(global_ids)))
+
+        compact_ids = previous.map(pd.Series(global_ids))
+        is_new = compact_ids.isna().to_numpy()
+        compact_ids = compact_ids.to_numpy(dtype=np.int64, na_value=0)
+        next_id = int(previous.values.max()) + 1
+        compact_ids[is_new] = np.arange(next_id, next_id + is_new.sum())
+        return IdMapper(global_ids, compact_ids)
+
+
+def check_collisions(global_ids, check_hashes):
+    collisions = find_hash_collisions(global_ids, check_hashes)
+    if len(collisions) > 0:
+        raise ValueError(f"Hash collision detected for global node ids: {collisions[:10].tolist()}")
+
+
+def compute_global_ids(local_nodes):
+    """
+    Compute 64-bit global ids for nodes. Nodes with the same serialized name and type have the same global id in all
+    environments.
+    :param local_nodes: DataFrame with nodes
+    :return: tuple of int64 arrays with global ids and check hashes
+    """
+    global_ids = hash_node_repr(local_nodes)
+    check_hashes = hash_node_repr(local_nodes, hash_key=node_check_hash_key)
+    check_collisions(global_ids, check_hashes)
+    return global_ids, check_hashes
+
+
 def create_local_to_global_id_map(local_nodes, global_nodes):
-    # local_nodes = local_nodes.copy()
-    # global_nodes = global_nodes.copy()
-    #
-    # global_nodes['node_repr'] = create_node_repr(global_nodes)
-    # local_nodes['node_repr'] = create_node_repr(local_nodes)
-    #
-    # rev_id_map = dict(zip(
-    #     global_nodes['node_repr'].tolist(), global_nodes['id'].tolist()
-    # ))
-    # id_map = dict(zip(
-    #     local_nodes["id"].tolist(), map(
-    #         lambda x: rev_id_map[x], local_nodes["node_repr"].tolist()
-    #     )
-    # ))
-    id_map = dict(zip(
-        local_nodes["id"], map(compute_long_id, create_node_repr(local_nodes))
-    ))
+    global_ids, _ = compute_global_ids(local_nodes)
+    id_map = dict(zip(local_nodes["id"].tolist(), global_ids.tolist()))
 
     return id_map
 
 
 def get_local2global(global_nodes, local_nodes) -> pd.DataFrame:
-    local_nodes = local_nodes.copy()
-    id_map = create_local_to_global_id_map(local_nodes=local_nodes, global_nodes=global_nodes)
+    """
+    :param global_nodes: GlobalIdIndex where global ids of local nodes are collected, can be None
+    :param local_nodes: DataFrame with nodes
+    :return: DataFrame with columns `id` and `global_id`
+    """
+    global_ids, check_hashes = compute_global_ids(local_nodes)
 
-    local_nodes['global_id'] = local_nodes['id'].apply(lambda x: id_map.get(x, None))
+    if isinstance(global_nodes, GlobalIdIndex):
+        global_nodes.add(global_ids, check_hashes)
 
-    return local_nodes[['id', 'global_id']]
+    return pd.DataFrame({"id": local_nodes["id"].to_numpy(), "global_id": global_ids}, index=local_nodes.index)
 
 
 if __name__ == "__main__":
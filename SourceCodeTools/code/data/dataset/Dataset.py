@@ -1,16 +1,20 @@
 # from collections import Counter
 # from itertools import chain
 from collections import Counter
+from copy import copy
 from typing import List, Optional
 
+import json
 import pandas
 import numpy
 import pickle
 
-from os.path import join
+from os.path import join, isfile
 
+from SourceCodeTools.code.data.dataset.dataset_cache import DatasetCache
+from SourceCodeTools.code.data.dataset.SubgraphMapping import SubgraphMapping
 from SourceCodeTools.code.data.dataset.SubwordMasker import SubwordMasker, NodeNameMasker, NodeClfMasker
-from SourceCodeTools.code.data.dataset.reader import load_data
+from SourceCodeTools.code.data.dataset.reader import load_data, get_graph_paths
 from SourceCodeTools.code.data.file_utils import *
 from SourceCodeTools.code.ast.python_ast import PythonSharedNodes
 from SourceCodeTools.nlp.embed.bpe import make_tokenizer, load_bpe_model
@@ -96,8 +100,7 @@ class SourceGraphDataset:
 
         self.use_ns_groups = use_ns_groups
 
-        nodes_path = join(data_path, "common_nodes.json.bz2")
-        edges_path = join(data_path, "common_edges.json.bz2")
+        nodes_path, edges_path = get_graph_paths(data_path)
 
         self.nodes, self.edges = load_data(nodes_path, edges_path)
 
@@ -252,39 +255,59 @@ class SourceGraphDataset:
     def _add_typed_ids(self):
         nodes = self.nodes.copy()
 
-        typed_id_map = {}
-
         # node_types = dict(zip(self.node_types['int_type'], self.node_types['str_type']))
 
-        for type_ in nodes['type'].unique():
-            type_mask = nodes['type'] == type_
-            id_map = compact_property(nodes.loc[type_mask, 'id'])
-            nodes.loc[type_mask, 'typed_id'] = nodes.loc[type_mask, 'id'].apply(lambda old_id: id_map[old_id])
-            typed_id_map[type_] = id_map
+        # typed ids enumerate sorted node ids within every type
+        nodes['typed_id'] = nodes.groupby('type', observed=True, sort=False)['id'].rank(method="dense") - 1
 
         assert any(pandas.isna(nodes['typed_id'])) is False
 
         nodes = nodes.astype({"typed_id": "int"})
 
-        self.nodes, self.typed_id_map = nodes, typed_id_map
+        self.nodes, self.typed_id_map = nodes, self._create_typed_id_map(nodes)
         # return nodes, typed_id_map
 
+    @staticmethod
+    def _create_typed_id_map(nodes):
+        """
+        Create mapping from original node ids to typed ids for every node type.
+        """
+        typed_id_map = {}
+        ids = nodes['id'].values
+        typed_ids = nodes['typed_id'].values
+        for type_, positions in nodes.groupby('type', observed=True, sort=False).indices.items():
+            typed_id_map[type_] = dict(zip(ids[positions], typed_ids[positions]))
+        return typed_id_map
+
     # def add_compact_labels(self):
     #     nodes = self.nodes.copy()
     #     label_map = compact_property(nodes['label'])
     #     nodes['compact_label'] = nodes['label'].apply(lambda old_id: label_map[old_id])
     #     return nodes, label_map
 
+    @staticmethod
+    def _get_node_positions(nodes, node_ids):
+        """
+        Find positions of nodes in the node table.
+        :param nodes: node table
+        :param node_ids: array of node ids
+        :return: array with positions of nodes
+        """
+        positions = pandas.Index(nodes['id'].values).get_indexer(node_ids)
+        if (positions == -1).any():
+            raise KeyError(f"Nodes are not found: {numpy.asarray(node_ids)[positions == -1][:10].tolist()}")
+        return positions
+
     @staticmethod
     def _add_node_types_to_edges(nodes, edges):
 
         # nodes = self.nodes
         # edges = self.edges.copy()
 
-        node_type_map = dict(zip(nodes['id'].values, nodes['type']))
+        node_types = nodes['type'].values
 
-        edges['src_type'] = edges['src'].apply(lambda src_id: node_type_map[src_id])
-        edges['dst_type'] = edges['dst'].apply(lambda dst_id: node_type_map[dst_id])
+        edges['src_type'] = node_types.take(SourceGraphDataset._get_node_positions(nodes, edges['src'].values))
+        edges['dst_type'] = node_types.take(SourceGraphDataset._get_node_positions(nodes, edges['dst'].values))
         edges = edges.astype({'src_type': 'category', 'dst_type': 'category'})
 
         return edges
@@ -362,26 +385,22 @@ class SourceGraphDataset:
         self.edges = self.edges.append(to_reverse[["src", "dst", "type"]])
 
     def _update_global_id(self):
-        orig_id = []
-        graph_id = []
+        # global ids enumerate nodes of every type after the nodes of previous types
+        type_offsets = {}
         prev_offset = 0
 
-        typed_node_id_maps = self.typed_id_map
-
         for type in self.g.ntypes:
-            from_id, to_id = zip(*typed_node_id_maps[type].items())
-            orig_id.extend(from_id)
-            graph_id.extend([t + prev_offset for t in to_id])
+            type_offsets[type] = prev_offset
             prev_offset += self.g.number_of_nodes(type)
 
-        global_map = dict(zip(orig_id, graph_id))
-
-        self.nodes['global_graph_id'] = self.nodes['id'].apply(lambda old_id: global_map[old_id])
+        offsets = self.nodes['type'].astype(object).map(type_offsets)
+        assert any(pandas.isna(offsets)) is False
+        self.nodes['global_graph_id'] = self.nodes['typed_id'].values + offsets.values.astype("int64")
         import torch
         for ntype in self.g.ntypes:
-            self.g.nodes[ntype].data['global_graph_id'] = torch.LongTensor(
-                list(map(lambda x: global_map[x], self.g.nodes[ntype].data['original_id'].tolist()))
-            )
+            # node data is ordered by typed ids
+            self.g.nodes[ntype].data['global_graph_id'] = \
+                self.g.nodes[ntype].data['typed_id'] + type_offsets[ntype]
 
         self.node_id_to_global_id = dict(zip(self.nodes["id"], self.nodes["global_graph_id"]))
 
@@ -391,13 +410,13 @@ class SourceGraphDataset:
         typed_node_counts = dict()
 
         unique_types = self.nodes['type'].unique()
+        counts = self.nodes['type'].value_counts()
 
         # node_types = dict(zip(self.node_types['int_type'], self.node_types['str_type']))
 
         for type_id, type in enumerate(unique_types):
-            nodes_of_type = len(self.nodes.query(f"type == '{type}'"))
             # typed_node_counts[node_types[type]] = nodes_of_type
-            typed_node_counts[type] = nodes_of_type
+            typed_node_counts[type] = int(counts[type])
 
         return typed_node_counts
 
@@ -407,7 +426,9 @@ class SourceGraphDataset:
         edges = self.edges.copy()
         edges = self._add_node_types_to_edges(nodes, edges)
 
-        typed_node_id = dict(zip(nodes['id'], nodes['typed_id']))
+        typed_node_id = nodes['typed_id'].values
+        src_typed_id = typed_node_id[self._get_node_positions(nodes, edges['src'].values)]
+        dst_typed_id = typed_node_id[self._get_node_positions(nodes, edges['dst'].values)]
 
         possible_edge_signatures = edges[['src_type', 'type', 'dst_type']].drop_duplicates(
             ['src_type', 'type', 'dst_type']
@@ -428,36 +449,36 @@ class SourceGraphDataset:
         #     else:
         #         typed_subgraphs[subgraph_signature] = {node_mapper(src), node_mapper(dst)}
 
-        for ind, row in possible_edge_signatures.iterrows():  #
+        import dgl, torch
+
+        # positions of edges for every signature are found in a single pass over edges
+        signature_positions = edges.groupby(['src_type', 'type', 'dst_type'], observed=True, sort=False).indices
+
+        for src_type, type, dst_type in possible_edge_signatures.values:
             # subgraph_signature = (node_types[row['src_type']], edge_types[row['type']], node_types[row['dst_type']])
-            subgraph_signature = (row['src_type'], row['type'], row['dst_type'])
+            subgraph_signature = (src_type, type, dst_type)
 
-            subset = edges.query(
-                f"src_type == '{row['src_type']}' and type == '{row['type']}' and dst_type == '{row['dst_type']}'"
-            )
+            positions = signature_positions[subgraph_signature]
 
-            typed_subgraphs[subgraph_signature] = list(
-                zip(
-                    subset['src'].map(lambda old_id: typed_node_id[old_id]),
-                    subset['dst'].map(lambda old_id: typed_node_id[old_id])
-                )
+            typed_subgraphs[subgraph_signature] = (
+                torch.from_numpy(src_typed_id[positions].astype("int64")),
+                torch.from_numpy(dst_typed_id[positions].astype("int64"))
             )
 
         logging.info(
             f"Unique triplet types in the graph: {len(typed_subgraphs.keys())}"
         )
 
-        import dgl, torch
         self.g = dgl.heterograph(typed_subgraphs, self.typed_node_counts)
 
         # node_types = dict(zip(self.node_types['str_type'], self.node_types['int_type']))
 
+        type_positions = self.nodes.groupby('type', observed=True, sort=False).indices
+
         for ntype in self.g.ntypes:
             # int_type = node_types[ntype]
 
-            node_data = self.nodes.query(
-                f"type == '{ntype}'"
-            )[[
+            node_data = self.nodes.iloc[type_positions[ntype]][[
                 'typed_id', 'train_mask', 'test_mask', 'val_mask', 'id' # 'compact_label',
             ]].sort_values('typed_id')
 
@@ -804,10 +825,11 @@ class SourceGraphDataset:
 
     def load_global_edges_prediction(self):
 
-        nodes_path = join(self.data_path, "common_nodes.json.bz2")
-        edges_path = join(self.data_path, "common_edges.json.bz2")
+        nodes_path, edges_path = get_graph_paths(self.data_path)
 
-        _, edges = load_data(nodes_path, edges_path)
+        _, edges = load_data(
+            nodes_path, edges_path, node_columns=["id"], edge_columns=["type", "source_node_id", "target_node_id"]
+        )
 
         global_edges = self.get_global_edges()
         global_edges = global_edges - {"defines", "defined_in"}  # these edges are already in AST?
@@ -827,10 +849,11 @@ class SourceGraphDataset:
 
     def load_edge_prediction(self):
 
-        nodes_path = join(self.data_path, "common_nodes.json.bz2")
-        edges_path = join(self.data_path, "common_edges.json.bz2")
+        nodes_path, edges_path = get_graph_paths(self.data_path)
 
-        _, edges = load_data(nodes_path, edges_path)
+        _, edges = load_data(
+            nodes_path, edges_path, node_columns=["id"], edge_columns=["type", "source_node_id", "target_node_id"]
+        )
 
         edges.rename(
             {
@@ -1007,31 +1030,18 @@ class SourceGraphDataset:
     def subgraph_mapping(self):
         assert self.subgraph_id_column is not None, "`subgraph_id_column` was not provided"
 
-        id2type = dict(zip(self.nodes["id"], self.nodes["type"]))
-
-        subgraph_mapping = dict()
-
-        def add_item(subgraph_dict, node_id):
-            type_ = id2type[node_id]
-
-            if type_ not in subgraph_dict:
-                subgraph_dict[type_] = set()
-
-            subgraph_dict[type_].add(self.typed_id_map[type_][node_id])
-
-        for src, dst, subgraph_id in self.edges[["src", "dst", self.subgraph_id_column]].values:
-            if subgraph_id not in subgraph_mapping:
-                subgraph_mapping[subgraph_id] = dict()
-
-            subgraph_dict = subgraph_mapping[subgraph_id]
-            add_item(subgraph_dict, src)
-            add_item(subgraph_dict, dst)
-
-        for subgraph_id, subgraph_dict in subgraph_mapping.items():
-            for type_ in subgraph_dict:
-                subgraph_dict[type_] = list(subgraph_dict[type_])
+        if getattr(self, "_subgraph_mapping", None) is None:
+            edges = self.edges[["src", "dst", self.subgraph_id_column]].dropna(axis=0)
+            node_positions = self._get_node_positions(
+                self.nodes, numpy.concatenate([edges["src"].values, edges["dst"].values])
+            )
+            self._subgraph_mapping = SubgraphMapping(
+                subgraph_ids=numpy.concatenate([edges[self.subgraph_id_column].values] * 2),
+                node_types=self.nodes["type"].astype(object).values[node_positions],
+                typed_ids=self.nodes["typed_id"].values[node_positions]
+            )
 
-        return subgraph_mapping
+        return self._subgraph_mapping
 
     @classmethod
     def load(cls, path, args):
@@ -1043,9 +1053,36 @@ class SourceGraphDataset:
 
 
 def read_or_create_gnn_dataset(args, model_base, force_new=False, restore_state=False):
+    """
+    Create dataset or load its saved state. When `dataset_cache_dir` is given in `args`, preprocessed dataset is
+    shared between experiments through DatasetCache, and the model directory only stores the reference to the cache
+    entry. Otherwise, the dataset is pickled into the model directory.
+    """
+    args = copy(args)
+    dataset_cache_dir = args.pop("dataset_cache_dir", None)
+    cache_reference_path = join(model_base, "dataset_cache.json")
+
     if restore_state and not force_new:
         # i'm not happy with this behaviour that differs based on the flag status
-        dataset = SourceGraphDataset.load(join(model_base, "dataset.pkl"), args)
+        if isfile(cache_reference_path):
+            reference = json.load(open(cache_reference_path))
+            dataset = DatasetCache(reference["dataset_cache_dir"]).load(reference["key"], args)
+        else:
+            dataset = SourceGraphDataset.load(join(model_base, "dataset.pkl"), args)
+    elif dataset_cache_dir is not None:
+        cache = DatasetCache(dataset_cache_dir)
+        key = cache.get_key(args)
+        if key in cache and not force_new:
+            if args.get("random_seed", None) is None:
+                logging.info("Reusing cached dataset, splits are the same as in the cached dataset")
+            dataset = cache.load(key, args)
+        else:
+            dataset = SourceGraphDataset(**args)
+            cache.save(key, dataset)
+
+        # save reference to the dataset for recovery
+        with open(cache_reference_path, "w") as reference:
+            reference.write(json.dumps(cache.get_reference(key), indent=4))
     else:
         dataset = SourceGraphDataset(**args)
 
@@ -0,0 +1,112 @@
+import numpy as np
+
+
+class SubgraphMapping:
+    """
+    Mapping from subgraph ids to typed ids of their nodes, stored in CSR format. For every node type, typed ids of
+    nodes of all subgraphs are concatenated, and `indptr` points to the range of every subgraph. Nodes of every
+    subgraph are unique and sorted.
+    """
+    def __init__(self, subgraph_ids, node_types, typed_ids):
+        """
+        :param subgraph_ids: array with subgraph id for every occurrence of a node in a subgraph, occurrences can repeat
+        :param node_types: array with node type for every occurrence
+        :param typed_ids: array with typed node id for every occurrence
+        """
+        subgraph_ids = np.asarray(subgraph_ids)
+        node_types = np.asarray(node_types)
+        typed_ids = np.asarray(typed_ids, dtype=np.int64)
+
+        self.subgraph_ids = np.unique(subgraph_ids)
+        positions = np.searchsorted(self.subgraph_ids, subgraph_ids)
+        num_subgraphs = len(self.subgraph_ids)
+
+        self.indptr = {}
+        self.indices = {}
+        for node_type in np.unique(node_types):
+            of_type = node_types == node_type
+            num_nodes = int(typed_ids[of_type].max()) + 1
+            # pairs of subgraph position and node are packed into a single integer, sorting them groups nodes by
+            # subgraph
+            pairs = np.unique(positions[of_type] * num_nodes + typed_ids[of_type])
+            counts = np.bincount(pairs // num_nodes, minlength=num_subgraphs)
+            self.indptr[node_type] = np.concatenate([[0], np.cumsum(counts)])
+            self.indices[node_type] = pairs % num_nodes
+
+    @classmethod
+    def from_dict(cls, mapping):
+        """
+        Create mapping from dictionary {subgraph_id: {node_type: list of typed ids}}.
+        """
+        subgraph_ids = []
+        node_types = []
+        typed_ids = []
+        for subgraph_id, subgraph in mapping.items():
+            for node_type, nodes in subgraph.items():
+                subgraph_ids.extend([subgraph_id] * len(nodes))
+                node_types.extend([node_type] * len(nodes))
+                typed_ids.extend(nodes)
+        return cls(subgraph_ids, node_types, typed_ids)
+
+    def get_positions(self, subgraph_ids):
+        subgraph_ids = np.asarray(subgraph_ids)
+        positions = np.minimum(np.searchsorted(self.subgraph_ids, subgraph_ids), len(self.subgraph_ids) - 1)
+        is_missing = self.subgraph_ids[positions] != subgraph_ids
+        if is_missing.any():
+            raise KeyError(f"Unknown subgraphs: {subgraph_ids[is_missing][:10].tolist()}")
+        return positions
+
+    def __getitem__(self, subgraph_id):
+        position = self.get_positions([subgraph_id])[0]
+        subgraph = {}
+        for node_type, indptr in self.indptr.items():
+            if indptr[position + 1] > indptr[position]:
+                subgraph[node_type] = self.indices[node_type][indptr[position]: indptr[position + 1]].tolist()
+        return subgraph
+
+    def __contains__(self, subgraph_id):
+        position = np.searchsorted(self.subgraph_ids, subgraph_id)
+        return position < len(self.subgraph_ids) and self.subgraph_ids[position] == subgraph_id
+
+    def __len__(self):
+        return len(self.subgraph_ids)
+
+    def keys(self):
+        return self.subgraph_ids.tolist()
+
+    def get_batch(self, subgraph_ids, node_types):
+        """
+        Collect nodes of several subgraphs.
+        :param subgraph_ids: ids of subgraphs in the batch
+        :param node_types: order of node types for enumerating nodes of the batch
+        :return: dictionary with sorted unique typed ids of batch nodes for every type, row and column indices of
+            the membership matrix, where rows are subgraphs and columns are batch nodes of all types enumerated in the
+            order of `node_types`, and the number of columns
+        """
+        positions = self.get_positions(subgraph_ids)
+        node_ids = {}
+        rows = []
+        columns = []
+        offset = 0
+        for node_type in node_types:
+            if node_type not in self.indptr:
+                continue
+            indptr = self.indptr[node_type]
+            starts = indptr[positions]
+            lengths = indptr[positions + 1] - starts
+            total = lengths.sum()
+            if total == 0:
+                continue
+            # positions of nodes of all subgraphs in `indices`
+            range_starts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            nodes = self.indices[node_type][range_starts + np.arange(total)]
+            unique, inverse = np.unique(nodes, return_inverse=True)
+
+            node_ids[node_type] = unique
+            rows.append(np.repeat(np.arange(len(positions)), lengths))
+            columns.append(inverse + offset)
+            offset += len(unique)
+
+        if len(rows) == 0:
+            return node_ids, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), offset
+        return node_ids, np.concatenate(rows), np.concatenate(columns), offset
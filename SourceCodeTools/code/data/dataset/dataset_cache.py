@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from os.path import join, isfile, isdir, abspath
+
+import numpy
+import pandas
+
+from SourceCodeTools.code.data.dataset.reader import get_graph_paths
+
+
+def _save_column(values, path):
+    """
+    Store a column of a table. Numerical columns are stored as numpy arrays that can be memory mapped, categorical
+    columns are stored as codes and categories, other columns are pickled.
+    :return: storage kind of the column
+    """
+    if isinstance(values.dtype, pandas.CategoricalDtype):
+        numpy.save(path + ".npy", values.cat.codes.values)
+        pickle.dump((values.cat.categories, values.cat.ordered), open(path + ".pkl", "wb"))
+        return "category"
+    if isinstance(values.dtype, numpy.dtype) and values.dtype.kind in "biufM":
+        numpy.save(path + ".npy", values.values)
+        return "numpy"
+    pickle.dump(values, open(path + ".pkl", "wb"))
+    return "pickle"
+
+
+def _load_column(path, kind, mmap_mode):
+    if kind == "category":
+        codes = numpy.load(path + ".npy", mmap_mode=mmap_mode)
+        categories, ordered = pickle.load(open(path + ".pkl", "rb"))
+        return pandas.Categorical.from_codes(codes, categories=categories, ordered=ordered)
+    if kind == "numpy":
+        return numpy.load(path + ".npy", mmap_mode=mmap_mode)
+    return pickle.load(open(path + ".pkl", "rb")).values
+
+
+def save_table(table, path):
+    """
+    Store table column by column.
+    :param table: pandas table
+    :param path: directory for the table
+    """
+    os.makedirs(path, exist_ok=True)
+    columns = []
+    for position, column in enumerate(table.columns):
+        kind = _save_column(table[column], join(path, f"column_{position}"))
+        columns.append((column, kind))
+    index_kind = _save_column(pandas.Series(table.index), join(path, "index"))
+    pickle.dump({"columns": columns, "index": (table.index.name, index_kind)}, open(join(path, "table.pkl"), "wb"))
+
+
+def load_table(path, mmap_mode="r"):
+    """
+    Load table stored with `save_table`. Numerical columns are read from memory mapped files.
+    :param path: directory with the table
+    :param mmap_mode: mode for memory mapping, None to read columns into memory
+    :return: pandas table
+    """
+    meta = pickle.load(open(join(path, "table.pkl"), "rb"))
+    index_name, index_kind = meta["index"]
+    index = pandas.Index(_load_column(join(path, "index"), index_kind, mmap_mode), name=index_name)
+    return pandas.DataFrame({
+        column: _load_column(join(path, f"column_{position}"), kind, mmap_mode)
+        for position, (column, kind) in enumerate(meta["columns"])
+    }, index=index, columns=[column for column, _ in meta["columns"]])
+
+
+class DatasetCache:
+    """
+    On-disk cache of preprocessed SourceGraphDataset shared between experiments. Entries are addressed by the hash of
+    the content of graph files and the arguments of the dataset. The graph is stored in DGL binary format, node and
+    edge tables are stored column by column. Mappings between ids are restored from node table when the dataset is
+    loaded.
+    """
+    version = 1
+    excluded_args = {"data_path", "tokenizer_path"}  # do not affect preprocessing, updated on loading
+    restored_fields = {"nodes", "edges", "g", "typed_id_map", "node_id_to_global_id"}
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: directory for cached datasets
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.digests_path = join(cache_dir, "file_digests.json")
+
+    def _file_digest(self, path):
+        """
+        Compute hash of file content. Hashes are remembered for file size and modification time, so that large
+        files are read only once.
+        """
+        path = abspath(path)
+        stat = os.stat(path)
+        digests = json.load(open(self.digests_path)) if isfile(self.digests_path) else {}
+
+        record = digests.get(path, None)
+        if record is not None and record["size"] == stat.st_size and record["mtime"] == stat.st_mtime_ns:
+            return record["digest"]
+
+        logging.info(f"Computing hash of {path}")
+        digest = hashlib.sha256()
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                digest.update(chunk)
+
+        digests[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "digest": digest.hexdigest()}
+        json.dump(digests, open(self.digests_path, "w"), indent=4)
+        return digests[path]["digest"]
+
+    def get_key(self, args):
+        """
+        Compute cache key for dataset arguments.
+        :param args: dictionary with arguments of SourceGraphDataset
+        :return: cache key
+        """
+        files = [self._file_digest(path) for path in get_graph_paths(args["data_path"])]
+        key_args = {}
+        for name, value in args.items():
+            if name in self.excluded_args:
+                continue
+            if isinstance(value, str) and isfile(value):
+                value = self._file_digest(value)
+            key_args[name] = value
+
+        key = json.dumps({"version": self.version, "files": files, "args": key_args}, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+    def _entry_path(self, key):
+        return join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return isfile(join(self._entry_path(key), "state.pkl"))
+
+    def save(self, key, dataset):
+        import dgl
+
+        path = self._entry_path(key)
+        tmp_path = path + f".tmp{os.getpid()}"
+        if isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        dgl.save_graphs(join(tmp_path, "graph.bin"), [dataset.g])
+        save_table(dataset.nodes, join(tmp_path, "nodes"))
+        save_table(dataset.edges, join(tmp_path, "edges"))
+        state = {field: value for field, value in dataset.__dict__.items() if field not in self.restored_fields}
+        # state is written last and marks complete entry
+        pickle.dump(state, open(join(tmp_path, "state.pkl"), "wb"))
+
+        if key in self:
+            shutil.rmtree(tmp_path)
+        else:
+            os.rename(tmp_path, path)
+        logging.info(f"Dataset is cached in {path}")
+
+    def load(self, key, args, mmap_mode="r"):
+        """
+        Load cached dataset.
+        :param key: cache key
+        :param args: dictionary with arguments of SourceGraphDataset, used to update paths
+        :param mmap_mode: mode for memory mapping of numerical columns of tables
+        :return: SourceGraphDataset
+        """
+        import dgl
+        from SourceCodeTools.code.data.dataset.Dataset import SourceGraphDataset
+
+        path = self._entry_path(key)
+        logging.info(f"Loading dataset from cache {path}")
+
+        dataset = SourceGraphDataset.__new__(SourceGraphDataset)
+        dataset.__dict__.update(pickle.load(open(join(path, "state.pkl"), "rb")))
+        dataset.data_path = args["data_path"]
+        if dataset.tokenizer_path is not None:
+            dataset.tokenizer_path = args["tokenizer_path"]
+
+        graphs, _ = dgl.load_graphs(join(path, "graph.bin"))
+        dataset.g = graphs[0]
+        dataset.nodes = load_table(join(path, "nodes"), mmap_mode=mmap_mode)
+        dataset.edges = load_table(join(path, "edges"), mmap_mode=mmap_mode)
+        dataset.typed_id_map = SourceGraphDataset._create_typed_id_map(dataset.nodes)
+        dataset.node_id_to_global_id = dict(zip(dataset.nodes["id"], dataset.nodes["global_graph_id"]))
+        return dataset
+
+    def get_reference(self, key):
+        return {"dataset_cache_dir": abspath(self.cache_dir), "key": key}
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from SourceCodeTools.code.common import read_nodes, read_edges
@@ -5,9 +6,22 @@ from SourceCodeTools.code.data.file_utils import unpersist
 from SourceCodeTools.code.annotator_utils import source_code_graph_alignment
 
 
-def load_data(node_path, edge_path, rename_columns=True):
-    nodes = read_nodes(node_path)
-    edges = read_edges(edge_path)
+def get_graph_paths(dataset_directory):
+    """
+    Find files with nodes and edges of the merged graph. Columnar format is preferred when available.
+    :param dataset_directory: directory with the dataset
+    :return: paths to nodes and edges
+    """
+    nodes_path = os.path.join(dataset_directory, "common_nodes.columns")
+    edges_path = os.path.join(dataset_directory, "common_edges.columns")
+    if os.path.isdir(nodes_path) and os.path.isdir(edges_path):
+        return nodes_path, edges_path
+    return os.path.join(dataset_directory, "common_nodes.json.bz2"), os.path.join(dataset_directory, "common_edges.json.bz2")
+
+
+def load_data(node_path, edge_path, rename_columns=True, node_columns=None, edge_columns=None):
+    nodes = read_nodes(node_path, columns=node_columns)
+    edges = read_edges(edge_path, columns=edge_columns)
 
     if rename_columns:
         nodes = nodes.rename(mapper={
@@ -29,7 +43,7 @@ def load_graph(dataset_directory, rename_columns=True):
     return load_data(nodes, edges, rename_columns=rename_columns)
 
 
-def load_aligned_source_code(dataset_directory, tokenizer="codebert"):
+def load_aligned_source_code(dataset_directory, tokenizer="codebert", num_workers=1):
     dataset_path = Path(dataset_directory)
 
     files = unpersist(dataset_path.joinpath("common_filecontent.bz2")).rename({"id": "file_id"}, axis=1)
@@ -52,7 +66,7 @@ def load_aligned_source_code(dataset_directory, tokenizer="codebert"):
             source_codes.append(val)
             offsets.append([])
 
-    return source_code_graph_alignment(source_codes, offsets, tokenizer=tokenizer)
+    return source_code_graph_alignment(source_codes, offsets, tokenizer=tokenizer, num_workers=num_workers)
 
 
 if __name__ == "__main__":
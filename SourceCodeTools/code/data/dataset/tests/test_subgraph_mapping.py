@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+
+node_types = ["function", "name", "arg"]
+
+
+def random_occurrences(rnd, num_occurrences):
+    subgraph_ids = rnd.choice([3, 7, 8, 15, 42, 100], size=num_occurrences)
+    types = rnd.choice(node_types, size=num_occurrences)
+    # node type "arg" appears only in some subgraphs
+    types[(types == "arg") & (subgraph_ids > 10)] = "name"
+    typed_ids = rnd.randint(0, 30, size=num_occurrences)
+    return subgraph_ids, types, typed_ids
+
+
+def baseline_subgraph_mapping(subgraph_ids, types, typed_ids):
+    """
+    Dictionary of sets that was built from the edge table before the CSR index.
+    """
+    subgraph_mapping = dict()
+    for subgraph_id, type_, typed_id in zip(subgraph_ids.tolist(), types.tolist(), typed_ids.tolist()):
+        subgraph_mapping.setdefault(subgraph_id, dict()).setdefault(type_, set()).add(typed_id)
+    return subgraph_mapping
+
+
+def baseline_batch(subgraph_mapping, batch_ids):
+    """
+    Nodes and membership matrix of a batch as they were computed by SubgraphLoader before the CSR index.
+    """
+    node_ids = dict()
+    for id_ in batch_ids:
+        for type_, nodes in subgraph_mapping[id_].items():
+            node_ids.setdefault(type_, set()).update(nodes)
+    node_ids = {type_: sorted(nodes) for type_, nodes in node_ids.items()}
+
+    coincidence_matrix = []
+    for id_ in batch_ids:
+        coincidence_matrix.append([])
+        for type_ in node_types:
+            subgraph_nodes = subgraph_mapping[id_].get(type_, set())
+            for node_id in node_ids.get(type_, []):
+                coincidence_matrix[-1].append(node_id in subgraph_nodes)
+    return node_ids, np.array(coincidence_matrix, dtype=np.bool_)
+
+
+def test_subgraph_mapping_matches_dict_of_sets():
+    from SourceCodeTools.code.data.dataset.SubgraphMapping import SubgraphMapping
+
+    rnd = np.random.RandomState(0)
+    occurrences = random_occurrences(rnd, 500)
+    baseline = baseline_subgraph_mapping(*occurrences)
+    mapping = SubgraphMapping(*occurrences)
+
+    assert len(mapping) == len(baseline)
+    assert sorted(mapping.keys()) == sorted(baseline.keys())
+    for subgraph_id, subgraph in baseline.items():
+        assert subgraph_id in mapping
+        assert mapping[subgraph_id] == {type_: sorted(nodes) for type_, nodes in subgraph.items()}
+
+    from_dict = SubgraphMapping.from_dict(baseline)
+    for subgraph_id in baseline:
+        assert from_dict[subgraph_id] == mapping[subgraph_id]
+
+
+def test_get_batch_matches_dict_of_sets():
+    from SourceCodeTools.code.data.dataset.SubgraphMapping import SubgraphMapping
+
+    rnd = np.random.RandomState(1)
+    occurrences = random_occurrences(rnd, 500)
+    baseline = baseline_subgraph_mapping(*occurrences)
+    mapping = SubgraphMapping(*occurrences)
+
+    for batch_ids in [[3], [42, 7], [100, 15, 8, 3], list(baseline.keys())]:
+        node_ids, rows, columns, num_nodes = mapping.get_batch(batch_ids, node_types)
+        expected_node_ids, expected_matrix = baseline_batch(baseline, batch_ids)
+
+        assert node_ids.keys() == expected_node_ids.keys()
+        for type_ in expected_node_ids:
+            assert node_ids[type_].tolist() == expected_node_ids[type_]
+
+        matrix = np.zeros((len(batch_ids), num_nodes), dtype=np.bool_)
+        matrix[rows, columns] = True
+        assert (matrix == expected_matrix).all()
+
+
+def test_missing_subgraphs():
+    from SourceCodeTools.code.data.dataset.SubgraphMapping import SubgraphMapping
+
+    rnd = np.random.RandomState(2)
+    mapping = SubgraphMapping(*random_occurrences(rnd, 100))
+
+    for missing_id in [0, 5, 1000]:
+        assert missing_id not in mapping
+        with pytest.raises(KeyError):
+            mapping[missing_id]
+        with pytest.raises(KeyError):
+            mapping.get_batch([3, missing_id], node_types)
@@ -1,6 +1,8 @@
 import bz2
 import json
 import logging
+import pickle
+import shutil
 import tempfile
 from csv import QUOTE_NONNUMERIC
 from pathlib import Path
@@ -115,6 +117,240 @@ def read_json(path, **kwargs):
         # return pd.read_json(path, orient="records", lines=True, **kwargs)
 
 
+def _columnar_kind(column):
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category", None
+    if pd.api.types.is_extension_array_dtype(dtype):
+        if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            return "nullable", str(dtype)
+        if pd.api.types.is_string_dtype(dtype):
+            return "string", None
+        return "object", None
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_numeric_dtype(dtype):
+        return "numeric", str(dtype)
+
+    inferred = pd.api.types.infer_dtype(column, skipna=True)
+    if inferred == "empty":
+        return "missing", None
+    elif inferred == "string":
+        return "string", None
+    elif inferred == "integer":
+        return "nullable", "Int64"
+    elif inferred == "boolean":
+        return "nullable", "boolean"
+    elif inferred in {"floating", "mixed-integer-float"}:
+        return "numeric", "float64"
+    return "object", None
+
+
+def _nullable_numpy_dtype(dtype):
+    return "bool" if dtype == "boolean" else dtype.lower()
+
+
+def _nullable_pandas_dtype(dtype):
+    if dtype == "bool":
+        return "boolean"
+    elif dtype.startswith("uint"):
+        return "UInt" + dtype[4:]
+    return dtype.capitalize()
+
+
+def _append_column(path, prefix, spec, column):
+    """
+    Append values of a single column to the column files. Columns are stored as raw little-endian arrays so that
+    they can be appended without rewriting and memory-mapped when reading.
+    :param path: directory of the columnar table
+    :param prefix: file prefix for this column
+    :param spec: column description from the manifest, updated in place
+    :param column: pandas Series with new values
+    """
+    def append(suffix, array):
+        with open(os.path.join(path, prefix + suffix), "ab") as sink:
+            sink.write(np.ascontiguousarray(array).tobytes())
+
+    kind = spec["kind"]
+    missing = column.isna().to_numpy()
+
+    if kind == "numeric":
+        append(".values", column.to_numpy(dtype=spec["dtype"]))
+    elif kind == "nullable":
+        values = column.astype(spec["dtype"]).to_numpy(
+            dtype=_nullable_numpy_dtype(spec["dtype"]), na_value=0
+        )
+        append(".values", values)
+        append(".mask", missing)
+    elif kind == "category":
+        categories = spec["categories"]
+        known = set(categories)
+        categories.extend(cat for cat in column.dropna().astype(str).unique() if cat not in known)
+        codes = pd.Categorical(column.astype("string"), categories=categories).codes
+        append(".values", codes.astype("int32"))
+    elif kind == "string":
+        encoded = [b"" if is_missing else str(value).encode("utf-8") for value, is_missing in zip(column, missing)]
+        ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))) + spec["data_size"]
+        spec["data_size"] = int(ends[-1]) if len(ends) > 0 else spec["data_size"]
+        append(".values", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        append(".offsets", ends)
+        append(".mask", missing)
+    elif kind == "object":
+        with open(os.path.join(path, prefix + ".values"), "ab") as sink:
+            pickle.dump(column.tolist(), sink)
+    else:
+        raise ValueError(f"Unknown column kind: {kind}")
+
+
+def _fill_missing_column(path, prefix, spec, num_rows):
+    """
+    Convert a column that had only missing values so far into a column of a concrete kind.
+    """
+    spec.setdefault("categories", [])
+    spec.setdefault("data_size", 0)
+    if num_rows > 0:
+        if spec["kind"] == "category":
+            filler = pd.Series(pd.Categorical([None] * num_rows))
+        elif spec["kind"] == "numeric":
+            filler = pd.Series(np.full(num_rows, np.nan))
+        else:
+            filler = pd.Series([None] * num_rows, dtype=object)
+        _append_column(path, prefix, spec, filler)
+
+
+def write_columnar(df, path, mode=None, dtype=None):
+    """
+    Store table as a directory with one binary file per column and a json manifest. Categorical columns are stored as
+    dictionary codes, nullable columns have an additional mask, strings are stored as a utf-8 buffer with offsets.
+    :param df: table to store
+    :param path: path to the directory
+    :param mode: when "a", append rows to an existing table
+    :param dtype: optional dictionary of column types that are enforced before writing
+    """
+    if dtype is not None:
+        df = df.astype({col: type_ for col, type_ in dtype.items() if col in df.columns})
+
+    manifest_path = os.path.join(path, "manifest.json")
+
+    if mode == "a" and os.path.isfile(manifest_path):
+        manifest = read_mapping_from_json(manifest_path)
+        columns = [spec["name"] for spec in manifest["columns"]]
+        if set(columns) != set(df.columns):
+            raise ValueError(f"Columns do not match the existing table: {list(df.columns)} != {columns}")
+    else:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.mkdir(path)
+        manifest = {"num_rows": 0, "columns": []}
+        for ind, name in enumerate(df.columns):
+            kind, col_dtype = _columnar_kind(df[name])
+            manifest["columns"].append({
+                "name": name, "prefix": f"col_{ind}", "kind": kind, "dtype": col_dtype,
+                "categories": [], "data_size": 0
+            })
+
+    for spec in manifest["columns"]:
+        column = df[spec["name"]]
+        if spec["kind"] == "missing":
+            kind, col_dtype = _columnar_kind(column)
+            if kind == "missing":
+                continue
+            if kind == "numeric" and not col_dtype.startswith("float") and manifest["num_rows"] > 0:
+                # previous rows are missing, need a mask to represent them
+                kind, col_dtype = "nullable", _nullable_pandas_dtype(col_dtype)
+            spec["kind"], spec["dtype"] = kind, col_dtype
+            _fill_missing_column(path, spec["prefix"], spec, manifest["num_rows"])
+        _append_column(path, spec["prefix"], spec, column)
+
+    manifest["num_rows"] += len(df)
+    write_mapping_to_json(manifest, manifest_path)
+
+
+def _read_column(path, spec, num_rows, start, stop, use_mmap):
+    def load(suffix, dtype, offset=0, count=num_rows):
+        file_path = os.path.join(path, spec["prefix"] + suffix)
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        if use_mmap:
+            return np.memmap(file_path, dtype=dtype, mode="r", shape=(count,))
+        return np.fromfile(file_path, dtype=dtype, count=count)
+
+    kind = spec["kind"]
+
+    if kind == "missing":
+        return pd.Series([None] * (stop - start), dtype=object)
+    elif kind == "numeric":
+        return pd.Series(load(".values", spec["dtype"])[start: stop])
+    elif kind == "nullable":
+        values = np.asarray(load(".values", _nullable_numpy_dtype(spec["dtype"]))[start: stop])
+        mask = np.asarray(load(".mask", "bool")[start: stop])
+        if spec["dtype"] == "boolean":
+            return pd.Series(pd.arrays.BooleanArray(values, mask))
+        return pd.Series(pd.arrays.IntegerArray(values, mask))
+    elif kind == "category":
+        codes = np.asarray(load(".values", "int32")[start: stop])
+        return pd.Series(pd.Categorical.from_codes(codes, categories=spec["categories"]))
+    elif kind == "string":
+        ends = np.asarray(load(".offsets", "int64")[start: stop])
+        begin = int(load(".offsets", "int64")[start - 1]) if start > 0 else 0
+        starts = np.concatenate([[begin], ends[:-1]]) if len(ends) > 0 else ends
+        mask = load(".mask", "bool")[start: stop]
+        data = load(".values", "uint8", count=spec["data_size"])
+        raw = bytes(data[begin: int(ends[-1])]) if len(ends) > 0 else b""
+        values = [
+            None if is_missing else raw[s - begin: e - begin].decode("utf-8")
+            for s, e, is_missing in zip(starts, ends, mask)
+        ]
+        return pd.Series(values, dtype="string")
+    elif kind == "object":
+        values = []
+        with open(os.path.join(path, spec["prefix"] + ".values"), "rb") as source:
+            while len(values) < stop:
+                values.extend(pickle.load(source))
+        return pd.Series(values[start: stop], dtype=object)
+    else:
+        raise ValueError(f"Unknown column kind: {kind}")
+
+
+def read_columnar_with_generator(path, chunksize, **kwargs):
+    num_rows = read_mapping_from_json(os.path.join(path, "manifest.json"))["num_rows"]
+    for start in range(0, num_rows, chunksize):
+        yield read_columnar(path, start=start, stop=min(start + chunksize, num_rows), **kwargs)
+
+
+def read_columnar(path, columns=None, dtype=None, start=0, stop=None, use_mmap=True, **kwargs):
+    """
+    Read table stored with `write_columnar`.
+    :param path: path to the directory
+    :param columns: optional list of columns to read, other columns are not touched
+    :param dtype: optional dictionary of column types
+    :param start: first row to read
+    :param stop: last row to read (exclusive)
+    :param use_mmap: memory map column files instead of reading them into memory
+    :param kwargs: when `chunksize` is provided, return generator of chunks
+    :return: DataFrame
+    """
+    if "chunksize" in kwargs:
+        return read_columnar_with_generator(
+            path, kwargs.pop("chunksize"), columns=columns, dtype=dtype, use_mmap=use_mmap
+        )
+
+    manifest = read_mapping_from_json(os.path.join(path, "manifest.json"))
+    num_rows = manifest["num_rows"]
+    stop = num_rows if stop is None else min(stop, num_rows)
+
+    specs = manifest["columns"]
+    if columns is not None:
+        specs = [spec for spec in specs if spec["name"] in set(columns)]
+
+    table = pd.DataFrame({
+        spec["name"]: _read_column(path, spec, num_rows, start, stop, use_mmap) for spec in specs
+    })
+    table.index = pd.RangeIndex(start, start + len(table))
+
+    if dtype is not None:
+        table = table.astype({col: type_ for col, type_ in dtype.items() if col in table.columns}, copy=False)
+    return table
+
+
 def read_source_location(base_path):
     source_location_path = os.path.join(base_path, filenames["source_location"])
 
@@ -217,7 +453,9 @@ def likely_format(path):
 
     extensions = "." + ".".join(name_parts[1:])
 
-    if ".csv" in extensions or ".tsv" in extensions:
+    if extensions.endswith(".columns"):
+        ext = "columnar"
+    elif ".csv" in extensions or ".tsv" in extensions:
         ext = "csv"
     elif ".json" in extensions:
         ext = "json"
@@ -226,7 +464,7 @@ def likely_format(path):
     elif ".parquet" in extensions:
         ext = "parquet"
     else:
-        raise NotImplementedError("supported extensions: csv, bz2, pkl, parquet, json", extensions)
+        raise NotImplementedError("supported extensions: csv, bz2, pkl, parquet, json, columns", extensions)
 
     return ext
 
@@ -244,6 +482,8 @@ def persist(df: pd.DataFrame, path: Union[str, Path, bytes], **kwargs):
         write_parquet(df, path, **kwargs)
     elif format == "json":
         write_json(df, path, **kwargs)
+    elif format == "columnar":
+        write_columnar(df, path, **kwargs)
 
 
 def unpersist(path: Union[str, Path, bytes], **kwargs) -> pd.DataFrame:
@@ -259,13 +499,15 @@ def unpersist(path: Union[str, Path, bytes], **kwargs) -> pd.DataFrame:
         data = read_parquet(path, **kwargs)
     elif format == "json":
         data = read_json(path, **kwargs)
+    elif format == "columnar":
+        data = read_columnar(path, **kwargs)
     else:
         data = None
     return data
 
 
 def unpersist_if_present(path, **kwargs):
-    if os.path.isfile(path):
+    if os.path.isfile(path) or os.path.isfile(os.path.join(path, "manifest.json")):
         return unpersist(path, **kwargs)
     else:
         return None
@@ -283,6 +525,38 @@ def unpersist_or_exit(path, exit_message=None, **kwargs):
         return data
 
 
+def remove_persisted(path):
+    """
+    Remove table stored with `persist`. Columnar tables are stored as directories.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def update_fingerprint(fingerprint, path, block_size=1 << 20):
+    """
+    Update hash object with the content of a file or a directory. Files are read in blocks, directories are
+    traversed in sorted order.
+    :param fingerprint: hash object from `hashlib`
+    :param path: path to file or directory, missing paths are hashed as absent
+    :param block_size: size of blocks for reading
+    :return: updated hash object
+    """
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            fingerprint.update(name.encode("utf-8"))
+            update_fingerprint(fingerprint, os.path.join(path, name), block_size)
+    elif os.path.isfile(path):
+        with open(path, "rb") as source:
+            for block in iter(lambda: source.read(block_size), b""):
+                fingerprint.update(block)
+    else:
+        fingerprint.update(b"<missing>")
+    return fingerprint
+
+
 def get_random_name(length=10):
     char_ranges = [chr(i) for i in range(ord("a"), ord("a")+26)] + \
                   [chr(i) for i in range(ord("A"), ord("A")+26)] + \
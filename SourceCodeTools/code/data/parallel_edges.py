@@ -0,0 +1,194 @@
+import os
+import tempfile
+from os.path import join
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from SourceCodeTools.code.common import read_edges
+from SourceCodeTools.code.data.file_utils import persist, remove_persisted
+
+# record that is written to spill files for every edge, `type` is -1 for edges that are not global
+spill_dtype = np.dtype([("position", np.int64), ("key", np.int64), ("type", np.int32), ("priority", np.int32)])
+
+
+def pack_edge_keys(src, dst):
+    """
+    Pack pairs of 32-bit node ids into int64 keys.
+    """
+    return (src.astype(np.int64) << 32) | dst.astype(np.int64).astype(np.uint32)
+
+
+def get_partitions(keys, num_partitions):
+    # multiplicative hashing, keys of parallel edges always get into the same partition
+    return ((keys.view(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)) % np.uint64(num_partitions)
+
+
+def get_global_type_codes(global_edge_types):
+    return {type_: code for code, type_ in enumerate(sorted(global_edge_types))}
+
+
+def get_edge_keys(edges, global_type_codes):
+    """
+    :param edges: DataFrame with edges
+    :param global_type_codes: dictionary with codes of global edge types
+    :return: packed keys of edges and codes of edge types, the code is -1 for edges that are not global
+    """
+    keys = pack_edge_keys(edges["source_node_id"].to_numpy(), edges["target_node_id"].to_numpy())
+    types = edges["type"].astype(object).map(global_type_codes).fillna(-1).to_numpy(dtype=np.int32)
+    return keys, types
+
+
+def spill_edge_keys(edges_path, spill_dir, num_partitions, global_edge_types, edge_priority, default_priority=3):
+    """
+    Read edges in chunks and write packed keys of edges to spill files, partitioned by hash of source and
+    destination.
+    :param edges_path: path to edges
+    :param spill_dir: directory for spill files
+    :param num_partitions: number of spill files
+    :param global_edge_types: edge types for which only exact duplicates are removed
+    :param edge_priority: dictionary with priority of edge types, edges with lower values are preferred
+    :param default_priority: priority for edge types not present in `edge_priority`
+    :return: number of edges
+    """
+    global_type_codes = get_global_type_codes(global_edge_types)
+    spill_files = [open(join(spill_dir, f"part_{partition}"), "wb") for partition in range(num_partitions)]
+
+    num_edges = 0
+    try:
+        for edges in read_edges(edges_path, as_chunks=True, columns=["type", "source_node_id", "target_node_id"]):
+            records = np.empty(len(edges), dtype=spill_dtype)
+            records["position"] = np.arange(num_edges, num_edges + len(edges))
+            records["key"], records["type"] = get_edge_keys(edges, global_type_codes)
+            records["priority"] = edges["type"].astype(object).map(edge_priority).fillna(
+                default_priority
+            ).to_numpy(dtype=np.int32)
+
+            partitions = get_partitions(records["key"], num_partitions)
+            for partition in np.unique(partitions):
+                records[partitions == partition].tofile(spill_files[partition])
+
+            num_edges += len(edges)
+    finally:
+        for spill_file in spill_files:
+            spill_file.close()
+
+    return num_edges
+
+
+def find_removed_positions(records):
+    """
+    Find edges that should be removed. For global edges only exact duplicates are removed. For other edges only one
+    edge between a pair of nodes is kept: the one with the lowest priority value, and the earliest one among these.
+    :param records: array with `spill_dtype`
+    :return: positions of removed edges
+    """
+    removed = []
+
+    global_edges = records[records["type"] >= 0]
+    order = np.lexsort((global_edges["position"], global_edges["type"], global_edges["key"]))
+    global_edges = global_edges[order]
+    duplicate = (global_edges["key"][1:] == global_edges["key"][:-1]) & \
+                (global_edges["type"][1:] == global_edges["type"][:-1])
+    removed.append(global_edges["position"][1:][duplicate])
+
+    parallel_edges = records[records["type"] < 0]
+    order = np.lexsort((parallel_edges["position"], parallel_edges["priority"], parallel_edges["key"]))
+    parallel_edges = parallel_edges[order]
+    duplicate = parallel_edges["key"][1:] == parallel_edges["key"][:-1]
+    removed.append(parallel_edges["position"][1:][duplicate])
+
+    return np.concatenate(removed)
+
+
+def remove_parallel_edges_with_chunks(
+        edges_path, global_edge_types, edge_priority, kwarg_fn, num_partitions=64, spill_location=None
+):
+    """
+    Remove duplicate and parallel edges from the whole graph. Keys of edges are spilled to disk partitioned by hash,
+    and every partition is processed separately, so that memory usage is bounded by the size of a partition. Edges
+    are renumbered after removal and keep their original order.
+    :param edges_path: path to edges
+    :param global_edge_types: edge types for which only exact duplicates are removed
+    :param edge_priority: dictionary with priority of edge types used to decide which of parallel edges is kept
+    :param kwarg_fn: function that returns arguments for writing in append mode
+    :param num_partitions: number of spill files
+    :param spill_location: directory for spill files, the directory of edges is used by default
+    """
+    if spill_location is None:
+        spill_location = os.path.dirname(edges_path)
+
+    temp_edges = join(os.path.dirname(edges_path), "temp_" + os.path.basename(edges_path))
+
+    with tempfile.TemporaryDirectory(dir=spill_location) as spill_dir:
+        num_edges = spill_edge_keys(edges_path, spill_dir, num_partitions, global_edge_types, edge_priority)
+        if num_edges == 0:
+            return
+
+        removed = np.memmap(join(spill_dir, "removed"), dtype=np.bool_, mode="w+", shape=(num_edges,))
+
+        for partition in tqdm(range(num_partitions), desc="Finding parallel edges", leave=False):
+            partition_path = join(spill_dir, f"part_{partition}")
+            records = np.fromfile(partition_path, dtype=spill_dtype)
+            os.remove(partition_path)
+            if len(records) > 0:
+                removed[find_removed_positions(records)] = True
+
+        last_id = 0
+        position = 0
+        for ind, edges in enumerate(read_edges(edges_path, as_chunks=True)):
+            chunk_size = len(edges)
+            edges = edges[~removed[position: position + chunk_size]].copy()
+            position += chunk_size
+
+            edges["id"] = range(last_id, len(edges) + last_id)
+            last_id = len(edges) + last_id
+
+            kwargs = kwarg_fn(temp_edges.endswith("csv"), first_written=ind != 0)
+            persist(edges, temp_edges, **kwargs)
+
+        del removed
+
+    remove_persisted(edges_path)
+    os.rename(temp_edges, edges_path)
+
+
+def find_edges_present_in(edges_path, existing_edges_path, global_edge_types):
+    """
+    Find edges that would be removed as duplicate or parallel edges if they were appended to existing edges. Edges
+    that are already present are always preferred, regardless of the priority of edge types. Only keys of edges from
+    `edges_path` are kept in memory, existing edges are read in chunks.
+    :param edges_path: path to edges that should be appended
+    :param existing_edges_path: path to existing edges
+    :param global_edge_types: edge types for which only exact duplicates are removed
+    :return: boolean array with one value per edge from `edges_path` that is True for edges that are already present,
+        and the next free edge id in existing edges
+    """
+    global_type_codes = get_global_type_codes(global_edge_types)
+
+    keys, types = [], []
+    for edges in read_edges(edges_path, as_chunks=True, columns=["type", "source_node_id", "target_node_id"]):
+        chunk_keys, chunk_types = get_edge_keys(edges, global_type_codes)
+        keys.append(chunk_keys)
+        types.append(chunk_types)
+
+    # edges that are not global are parallel to any edge between the same nodes, type code -1 makes them match
+    # regardless of the type, global edges match only when the type is the same
+    new_edges = pd.MultiIndex.from_arrays([
+        np.concatenate(types) if len(types) > 0 else np.array([], dtype=np.int32),
+        np.concatenate(keys) if len(keys) > 0 else np.array([], dtype=np.int64)
+    ])
+    present = np.zeros(len(new_edges), dtype=np.bool_)
+
+    next_id = 0
+    for edges in read_edges(
+            existing_edges_path, as_chunks=True, columns=["id", "type", "source_node_id", "target_node_id"]
+    ):
+        if len(edges) == 0:
+            continue
+        chunk_keys, chunk_types = get_edge_keys(edges, global_type_codes)
+        present |= new_edges.isin(pd.MultiIndex.from_arrays([chunk_types, chunk_keys]))
+        next_id = max(next_id, int(edges["id"].max()) + 1)
+
+    return present, next_id
@@ -7,10 +7,10 @@ from SourceCodeTools.code.annotator_utils import map_offsets
 from SourceCodeTools.code.common import read_nodes
 from SourceCodeTools.code.data.AbstractDatasetCreator import AbstractDatasetCreator
 from SourceCodeTools.code.data.ast_graph.filter_type_edges import filter_type_edges_with_chunks
-from SourceCodeTools.code.data.file_utils import filenames, unpersist_if_present, read_element_component
+from SourceCodeTools.code.data.file_utils import filenames, unpersist, unpersist_if_present, read_element_component
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_filter_type_edges import filter_type_edges
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_merge_graphs import get_global_node_info, merge_global_with_local
-from SourceCodeTools.code.data.sourcetrail.sourcetrail_node_local2global import get_local2global
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_node_local2global import get_local2global, GlobalIdIndex
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_node_name_merge import merge_names
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_decode_edge_types import decode_edge_types
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_filter_ambiguous_edges import filter_ambiguous_edges
@@ -82,17 +82,21 @@ class DatasetCreator(AbstractDatasetCreator):
 
     type_annotation_edge_types = ['annotation_for', 'returned_by']
 
+    extraction_outputs = ["nodes.bz2", "nodes_with_ast.bz2", "local2global.bz2", "local2global_with_ast.bz2"]
+    sourcetrail_inputs = ["nodes_csv", "edges_csv", "source_location", "occurrence", "filecontent", "element_component"]
+
     def __init__(
             self, path, lang,
             bpe_tokenizer, create_subword_instances,
             connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False
+            recompute_l2g=False, columnar=False, incremental=False, num_workers=1
     ):
         super().__init__(
             path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
-            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g
+            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g, columnar, incremental
         )
+        self.num_workers = num_workers
 
         from SourceCodeTools.code.data.sourcetrail.common import UNRESOLVED_SYMBOL
         self.unsolved_symbol = UNRESOLVED_SYMBOL
@@ -128,6 +132,9 @@ class DatasetCreator(AbstractDatasetCreator):
     def get_csv_name(name, path):
         return os.path.join(path, filenames[name])
 
+    def get_environment_inputs(self, env_path):
+        return [self.get_csv_name(name, env_path) for name in self.sourcetrail_inputs]
+
     def filter_unsolved_symbols(self, nodes, edges):
         unsolved = set(nodes.query(f"serialized_name == '{self.unsolved_symbol}'")["id"].tolist())
         if len(unsolved) > 0:
@@ -180,8 +187,8 @@ class DatasetCreator(AbstractDatasetCreator):
         return global_nodes
 
     def do_extraction(self):
-        global_nodes = set()
-        global_nodes_with_ast = set()
+        global_nodes = GlobalIdIndex()
+        global_nodes_with_ast = GlobalIdIndex()
 
         for env_path in self.environments:
             logging.info(f"Found {os.path.basename(env_path)}")
@@ -190,6 +197,16 @@ class DatasetCreator(AbstractDatasetCreator):
                 logging.info("Package not indexed")
                 continue
 
+            if self.is_extracted(env_path):
+                logging.info("Package is not changed, skipping extraction")
+                get_local2global(global_nodes=global_nodes, local_nodes=unpersist(join(env_path, "nodes.bz2")))
+                get_local2global(
+                    global_nodes=global_nodes_with_ast, local_nodes=unpersist(join(env_path, "nodes_with_ast.bz2"))
+                )
+                continue
+
+            self.invalidate_fingerprint(env_path)
+
             if not self.recompute_l2g:
 
                 nodes, edges, source_location, occurrence, filecontent, element_component = \
@@ -203,7 +220,9 @@ class DatasetCreator(AbstractDatasetCreator):
 
                 nodes, edges = self.filter_unsolved_symbols(nodes, edges)
 
-                bodies = process_bodies(nodes, edges, source_location, occurrence, filecontent, self.lang)
+                bodies = process_bodies(
+                    nodes, edges, source_location, occurrence, filecontent, self.lang, num_workers=self.num_workers
+                )
                 call_seq = extract_call_seq(nodes, edges, source_location, occurrence)
 
                 edges = add_reverse_edges(edges)
@@ -246,9 +265,6 @@ class DatasetCreator(AbstractDatasetCreator):
                 global_nodes=global_nodes_with_ast, local_nodes=nodes_with_ast
             )
 
-            global_nodes.update(local2global["global_id"])
-            global_nodes_with_ast.update(local2global_with_ast["global_id"])
-
             self.write_type_annotation_flag(edges_with_ast, env_path)
 
             self.write_local(
@@ -258,6 +274,8 @@ class DatasetCreator(AbstractDatasetCreator):
                 name_mappings=name_mappings, filecontent_with_package=filecontent
             )
 
+            self.write_fingerprint(env_path)
+
         self.compact_mapping_for_l2g(global_nodes, "local2global.bz2")
         self.compact_mapping_for_l2g(global_nodes_with_ast, "local2global_with_ast.bz2")
 
@@ -300,6 +318,7 @@ if __name__ == "__main__":
     dataset = DatasetCreator(
         args.indexed_environments, args.language, args.bpe_tokenizer, args.create_subword_instances,
         args.connect_subwords, args.only_with_annotations, args.do_extraction, args.visualize, args.track_offsets,
-        args.remove_type_annotations, args.recompute_l2g
+        args.remove_type_annotations, args.recompute_l2g, columnar=args.columnar,
+        incremental=args.incremental, num_workers=args.num_workers
     )
     dataset.merge(args.output_directory)
@@ -7,14 +7,14 @@ DEFINITION_TYPE = 1
 UNRESOLVED_SYMBOL = "unsolved_symbol"
 
 
-def get_occurrence_groups(nodes, edges, source_location, occurrence):
+def get_occurrences(nodes, edges, source_location, occurrence):
     """
-    Group nodes based on file id. Return dataset that contains node ids and their offsets in the source code.
+    Join nodes and edges with their occurrences in the source code.
     :param nodes: dataframe with nodes
     :param edges: dataframe with edges
     :param source_location: dataframe with sources
     :param occurrence: dataframe with with offsets
-    :return: Result of group by file id
+    :return: dataframe with node ids and their offsets in the source code
     """
     edges = edges.rename(columns={'type': 'e_type'})
     edges = edges.query("id >= 0")  # filter reverse edges
@@ -29,10 +29,53 @@ def get_occurrence_groups(nodes, edges, source_location, occurrence):
 
     # join tables
     occurrences = occurrence.merge(source_location, on='source_location_id', )
-    nodes = node_edge.merge(occurrences, on='element_id')
-    occurrence_groups = nodes.groupby("file_node_id")
+    return node_edge.merge(occurrences, on='element_id')
+
+
+def get_occurrence_groups(nodes, edges, source_location, occurrence):
+    """
+    Group nodes based on file id. Return dataset that contains node ids and their offsets in the source code.
+    :param nodes: dataframe with nodes
+    :param edges: dataframe with edges
+    :param source_location: dataframe with sources
+    :param occurrence: dataframe with with offsets
+    :return: Result of group by file id
+    """
+    return get_occurrences(nodes, edges, source_location, occurrence).groupby("file_node_id")
+
+
+def get_occurrences_within_definitions(definitions, occurrences):
+    """
+    Find occurrences that are located within lines of definitions from the same file, i.e. with
+    `start_line >= definition.start_line and end_line <= definition.end_line`. All files are processed together:
+    occurrences are sorted by file and start line, and ranges of definitions are found with `searchsorted`.
+    :param definitions: dataframe with definitions, see `get_function_definitions`
+    :param occurrences: dataframe with occurrences
+    :return: tuple of arrays (definition_positions, occurrence_positions) with positional indices into
+        `definitions` and `occurrences`. Pairs are sorted by definition position, and occurrences of every
+        definition are in the order of `sort_occurrences`.
+    """
+    def file_line_keys(table, line_column):
+        # lines are stored in lower 32 bits, sorting keys sorts by file, then by line
+        return (table["file_node_id"].to_numpy(dtype=np.int64) << 32) | table[line_column].to_numpy(dtype=np.int64)
+
+    occurrence_keys = file_line_keys(occurrences, "start_line")
+    # same order as `sort_occurrences`, ties keep the original order
+    order = np.lexsort((
+        np.arange(len(occurrences)), -occurrences["end_column"].to_numpy(dtype=np.int64), occurrence_keys
+    ))
+    occurrence_keys = occurrence_keys[order]
+
+    lower = np.searchsorted(occurrence_keys, file_line_keys(definitions, "start_line"), side="left")
+    upper = np.searchsorted(occurrence_keys, file_line_keys(definitions, "end_line"), side="right")
+    counts = upper - lower
 
-    return occurrence_groups
+    definition_positions = np.repeat(np.arange(len(definitions)), counts)
+    occurrence_positions = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lower, counts)]
+
+    within = occurrences["end_line"].to_numpy(dtype=np.int64)[occurrence_positions] <= \
+        definitions["end_line"].to_numpy(dtype=np.int64)[definition_positions]
+    return definition_positions[within], occurrence_positions[within]
 
 
 def sort_occurrences(occurrences):
@@ -48,15 +91,3 @@ def get_occurrences_from_range(occurrences, start, end) -> pd.DataFrame:
     return occurrences.query(
         f"start_line >= {start} and end_line <= {end} and occ_type != {DEFINITION_TYPE} and start_line == end_line")
 
-
-def sql_get_function_definitions(occurrences):
-    return occurrences.query(
-        f"select * from {occurrences.table_name} where occ_type = {DEFINITION_TYPE} and (type = 'function' or type = 'class_method')")
-    # return occurrences.query(f"occ_type == {DEFINITION_TYPE} and (type == 4096 or type == 8192)")
-
-
-def sql_get_occurrences_from_range(occurrences, start, end) -> pd.DataFrame:
-    df = occurrences.query(
-        f"select * from {occurrences.table_name} where start_line >= {start} and end_line <= {end} and occ_type != {DEFINITION_TYPE} and start_line = end_line")
-    df = df.astype({"source_node_id": "Int32", "target_node_id": "Int32"})
-    return df
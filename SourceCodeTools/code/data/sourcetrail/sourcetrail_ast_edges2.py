@@ -9,10 +9,10 @@ from SourceCodeTools.code.ast import has_valid_syntax
 from SourceCodeTools.code.common import custom_tqdm
 from SourceCodeTools.code.data.sourcetrail.common import *
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges import NodeResolver, make_reverse_edge
-from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes, materialize_node_strings
 # from SourceCodeTools.code.python_ast_cf import AstGraphGenerator
 from SourceCodeTools.code.annotator_utils import adjust_offsets2
-from SourceCodeTools.code.annotator_utils import overlap as range_overlap
+from SourceCodeTools.code.annotator_utils import overlap as range_overlap, IntervalIndex
 from SourceCodeTools.code.annotator_utils import to_offsets, get_cum_lens
 from SourceCodeTools.nlp.string_tools import get_byte_to_char_map
 
@@ -497,7 +497,7 @@ class ReplacementNodeResolver(NodeResolver):
                 new_node.name = "unresolved_name"
 
         if node.string is not None:
-            string,_,_,_ = self.recover_original_string(node.string, replacement2srctrl)
+            string,_,_,_ = self.recover_original_string(str(node.string), replacement2srctrl)
             node.string = string
 
         if hasattr(node, "scope"):
@@ -561,6 +561,8 @@ class ReplacementNodeResolver(NodeResolver):
         new_nodes = new_nodes[
             ['id', 'type', 'serialized_name', 'mentioned_in', 'string']
         ].astype({"mentioned_in": "Int32"})
+        # node strings are kept as ranges of the source until this point
+        new_nodes["string"] = materialize_node_strings(new_nodes["string"])
 
         return new_nodes
 
@@ -587,43 +589,6 @@ class ReplacementNodeResolver(NodeResolver):
             node["mentioned_in"] = mapping.get(node["mentioned_in"], node["mentioned_in"])
 
 
-
-class OffsetIndex:
-    class IndexNode:
-        def __init__(self, data):
-            n_entries = len(data)
-            self.start = data["start"].min()
-            self.end = data["end"].max()
-            if n_entries > 1:
-                middle = n_entries // 2
-                self.left = self.__class__(data.iloc[:middle])
-                self.right = self.__class__(data.iloc[middle:])
-            elif n_entries == 1:
-                self.id = data["node_id"].iloc[0]
-                self.occ_type = data["occ_type"].iloc[0]
-            else:
-                raise Exception("Invalid state")
-
-        def get_overlapped(self, range, overlapped=None):
-            if overlapped is None:
-                overlapped = []
-            if (self.start - range[0]) * (self.end - range[1]) <= 0:
-                if hasattr(self, "id"):
-                    overlapped.append((self.start, self.end, self.id, self.occ_type))
-                else:
-                    self.right.get_overlapped(range, overlapped)
-                    self.left.get_overlapped(range, overlapped)
-            return overlapped
-
-    def __init__(self, data: pd.DataFrame):
-        # data = data[["start", "end", "node_id"]].sort_values(by=["start", "end"])
-        data = data.sort_values(by=["start", "end"])
-        self.index = self.IndexNode(data)
-
-    def get_overlap(self, range):
-        return self.index.get_overlapped(range)
-
-
 class AstProcessor(AstGraphGenerator):
     def get_edges(self, as_dataframe=True):
         edges = []
@@ -995,10 +960,15 @@ def process_code(source_file_content, offsets, node_resolver, mention_tokenizer,
             offsets = [[*offset, set()] for offset in ast_offsets]
             offsets = offsets + [[*offset, set()] for offset in global_offsets]
 
-            for def_ in definitions:
-                for offset_ in offsets:
-                    if range_overlap(def_, offset_):
-                        offset_[3].add(tuple(def_))
+            if len(definitions) == 0 or len(offsets) == 0:
+                return offsets
+
+            definition_index = IntervalIndex([def_[0] for def_ in definitions], [def_[1] for def_ in definitions])
+            offset_positions, definition_positions = definition_index.query(
+                [offset_[0] for offset_ in offsets], [offset_[1] for offset_ in offsets]
+            )
+            for offset_position, definition_position in zip(offset_positions.tolist(), definition_positions.tolist()):
+                offsets[offset_position][3].add(tuple(definitions[definition_position]))
 
             return offsets
 
@@ -1,4 +1,3 @@
-from SourceCodeTools.code.common import custom_tqdm, SQLTable
 from SourceCodeTools.code.data.sourcetrail.common import *
 
 import sys
@@ -16,46 +15,37 @@ def get_function_calls_from_range(occurrences, start, end):
     return occurrences.query(f"start_line >= {start} and end_line <= {end} and occ_type != {DEFINITION_TYPE} and e_type == 'calls'")
 
 
-def sql_get_function_calls_from_range(occurrences, start, end):
-    df = occurrences.query(f"select * from {occurrences.table_name} where start_line >= {start} and end_line <= {end} and occ_type != {DEFINITION_TYPE} and e_type = 'calls'")
-    df = df.astype({"source_node_id": "Int32", "target_node_id": "Int32"})
-    return df
+def get_function_calls_from_definitions(occurrences):
+    """
+    Find calls that occur within lines of function definitions for all files at once.
+    :param occurrences: dataframe with occurrences, see `get_occurrences`
+    :return: tuple of arrays (definition_ids, called_ids). For every definition, calls are sorted as in
+        `sort_occurrences`
+    """
+    function_definitions = get_function_definitions(occurrences).sort_values("file_node_id", kind="stable")
+    calls = occurrences.query(f"occ_type != {DEFINITION_TYPE} and e_type == 'calls'")
 
+    definition_positions, call_positions = get_occurrences_within_definitions(function_definitions, calls)
 
-def extract_call_seq(nodes, edges, source_location, occurrence):
-
-    occurrence_groups = get_occurrence_groups(nodes, edges, source_location, occurrence)
-
-    call_seq = []
-
-    for grp_ind, (file_id, occurrences) in custom_tqdm(
-            enumerate(occurrence_groups), message="Extracting call sequences", total=len(occurrence_groups)
-    ):
+    called = calls["target_node_id"].iloc[call_positions]
+    has_target = called.notna().to_numpy()
+    return definition_positions[has_target], called[has_target].to_numpy(dtype=np.int64)
 
-        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
 
-        function_definitions = sql_get_function_definitions(sql_occurrences)
-
-        if len(function_definitions):
-            for ind, f_def in function_definitions.iterrows():
-                local_occurrences = sql_get_function_calls_from_range(sql_occurrences, start=f_def.start_line, end=f_def.end_line)
-                local_occurrences = sort_occurrences(local_occurrences)
-
-                all_calls = get_function_calls(local_occurrences)
+def extract_call_seq(nodes, edges, source_location, occurrence):
 
-                for i in range(len(all_calls) - 1):
-                    call_seq.append({
-                        'src': all_calls[i],
-                        'dst': all_calls[i+1]
-                    })
+    occurrences = get_occurrences(nodes, edges, source_location, occurrence)
 
-        del sql_occurrences
+    definition_positions, all_calls = get_function_calls_from_definitions(occurrences)
 
-        # print(f"\r{grp_ind}/{len(occurrence_groups)}", end="")
-    # print(" " * 30, end="\r")
+    # consecutive calls from the same function
+    same_function = definition_positions[1:] == definition_positions[:-1]
 
-    if len(call_seq) > 0:
-        call_seq = pd.DataFrame(call_seq).astype({
+    if same_function.sum() > 0:
+        call_seq = pd.DataFrame({
+            'src': all_calls[:-1][same_function],
+            'dst': all_calls[1:][same_function]
+        }).astype({
             'src': 'int',
             'dst': 'int'
         })
@@ -1,14 +1,26 @@
 import ast
 import sys
+from collections import namedtuple
+from itertools import groupby
+from multiprocessing import Pool
 from typing import Tuple, List, Optional
 
 from SourceCodeTools.code.ast import has_valid_syntax
-from SourceCodeTools.code.common import custom_tqdm, SQLTable
+from SourceCodeTools.code.common import custom_tqdm
 from SourceCodeTools.code.data.sourcetrail.common import *
 from SourceCodeTools.code.annotator_utils import to_offsets
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
+# records are passed to worker processes, therefore, they need importable types
+FunctionDefinition = namedtuple(
+    "FunctionDefinition", ["element_id", "file_node_id", "start_line", "end_line", "start_column", "end_column"]
+)
+BodyOccurrence = namedtuple(
+    "BodyOccurrence",
+    ["element_id", "serialized_name", "target_node_id", "start_line", "end_line", "start_column", "end_column"]
+)
+
 
 def overlap(range: Tuple[int, int], ranges: List[Tuple[int, int]]) -> bool:
     for r in ranges:
@@ -100,7 +112,8 @@ def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
     """
     Extract the list
     :param body:
-    :param local_occurrences:
+    :param local_occurrences: occurrences within the body, sorted with `sort_occurrences`, as a list of named
+        tuples
     :param nodeid2name:
     :param f_id:
     :param f_start:
@@ -108,11 +121,9 @@ def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
     """
     body_lines = body.split("\n")
 
-    local_occurrences = sort_occurrences(local_occurrences)
-
     list_of_replacements = []
 
-    for occ_ind, occurrence in local_occurrences.iterrows():
+    for occurrence in local_occurrences:
         if occurrence.start_line == occurrence.end_line:
 
             curr_line = occurrence.start_line - 1 - f_start
@@ -146,7 +157,77 @@ def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
     }
 
 
-def process_bodies(nodes, edges, source_location, occurrence, file_content, lang):
+def process_file_bodies(file_content, file_id, function_definitions, nodeid2name):
+    """
+    Process bodies of all functions defined in a file.
+    :param file_content: dictionary that maps file ids to file contents
+    :param file_id: file id
+    :param function_definitions: list of tuples (definition, local_occurrences), where definition is a named
+        tuple and local occurrences are the occurrences within the definition, see `process_body`
+    :param nodeid2name: dictionary that maps sourcetrail node ids to names
+    :return: list of processed bodies
+    """
+    bodies = []
+    for f_def, local_occurrences in function_definitions:
+        # move to zero-index
+        f_start = f_def.start_line - 1
+        f_end = f_def.end_line - 1
+
+        body = get_function_body(file_content, file_id, f_start, f_end, f_def.start_column - 1, f_def.end_column)
+
+        if not has_valid_syntax(body):
+            continue
+
+        processed = process_body(body, local_occurrences, nodeid2name, f_def.element_id, f_start)
+
+        if processed is not None:
+            bodies.append(processed)
+    return bodies
+
+
+_worker_nodeid2name = None
+
+
+def _init_bodies_worker(nodeid2name):
+    global _worker_nodeid2name
+    _worker_nodeid2name = nodeid2name
+
+
+def _process_file_bodies_in_worker(file):
+    file_id, content, function_definitions = file
+    return process_file_bodies({file_id: content}, file_id, function_definitions, _worker_nodeid2name)
+
+
+def get_definitions_with_occurrences(occurrences):
+    """
+    Group function definitions by file and find occurrences within every definition. Occurrences of all files are
+    matched with definitions at once, see `get_occurrences_within_definitions`.
+    :param occurrences: dataframe with occurrences, see `get_occurrences`
+    :return: generator of tuples (file_id, function_definitions), see `process_file_bodies`
+    """
+    function_definitions = get_function_definitions(occurrences).sort_values("file_node_id", kind="stable")
+    body_occurrences = occurrences.query(f"occ_type != {DEFINITION_TYPE} and start_line == end_line")
+
+    definition_positions, occurrence_positions = get_occurrences_within_definitions(
+        function_definitions, body_occurrences
+    )
+    boundaries = np.searchsorted(definition_positions, np.arange(len(function_definitions) + 1)).tolist()
+    occurrence_positions = occurrence_positions.tolist()
+
+    def as_records(table, record_type):
+        return list(map(record_type._make, table[list(record_type._fields)].itertuples(index=False, name=None)))
+
+    body_occurrences = as_records(body_occurrences, BodyOccurrence)
+
+    definitions = list(enumerate(as_records(function_definitions, FunctionDefinition)))
+    for file_id, group in groupby(definitions, key=lambda definition: definition[1].file_node_id):
+        yield file_id, [
+            (f_def, [body_occurrences[ind] for ind in occurrence_positions[boundaries[pos]: boundaries[pos + 1]]])
+            for pos, f_def in group
+        ]
+
+
+def process_bodies(nodes, edges, source_location, occurrence, file_content, lang, num_workers=1):
     """
     :param nodes:
     :param edges:
@@ -154,11 +235,12 @@ def process_bodies(nodes, edges, source_location, occurrence, file_content, lang
     :param occurrence:
     :param file_content:
     :param lang:
+    :param num_workers: number of processes for processing bodies of different files
     :return: Dataframe with columns id, body, sourcetrail_node_offsets. Node offsets are not resolved from the
         global graph.
     """
 
-    occurrence_groups = get_occurrence_groups(nodes, edges, source_location, occurrence)
+    occurrences = get_occurrences(nodes, edges, source_location, occurrence)
 
     file_content = dict(zip(file_content["id"], file_content["content"]))
 
@@ -166,35 +248,21 @@ def process_bodies(nodes, edges, source_location, occurrence, file_content, lang
 
     nodeid2name = dict(zip(nodes['id'], nodes['serialized_name']))
 
-    for group_ind, (file_id, occurrences) in custom_tqdm(
-            enumerate(occurrence_groups), message="Processing function bodies", total=len(occurrence_groups)
-    ):
-        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
-
-        function_definitions = sql_get_function_definitions(sql_occurrences)
-
-        if len(function_definitions):
-            for ind, f_def in function_definitions.iterrows():
-                f_start = f_def.start_line
-                f_end = f_def.end_line
+    files = get_definitions_with_occurrences(occurrences)
+    num_files = occurrences["file_node_id"].nunique()
 
-                local_occurrences = sql_get_occurrences_from_range(sql_occurrences, start=f_start, end=f_end)
-
-                # move to zero-index
-                f_start -= 1
-                f_end -= 1
-
-                body = get_function_body(file_content, file_id, f_start, f_end, f_def.start_column-1, f_def.end_column)
-
-                if not has_valid_syntax(body):
-                    continue
-
-                processed = process_body(body, local_occurrences, nodeid2name, f_def.element_id, f_start)
-
-                if processed is not None:
-                    bodies.append(processed)
-
-        del sql_occurrences
+    if num_workers > 1:
+        with Pool(num_workers, initializer=_init_bodies_worker, initargs=(nodeid2name,)) as pool:
+            processed_files = pool.imap(
+                _process_file_bodies_in_worker,
+                ((file_id, file_content[file_id], function_definitions) for file_id, function_definitions in files),
+                chunksize=16
+            )
+            for file_bodies in custom_tqdm(processed_files, message="Processing function bodies", total=num_files):
+                bodies.extend(file_bodies)
+    else:
+        for file_id, function_definitions in custom_tqdm(files, message="Processing function bodies", total=num_files):
+            bodies.extend(process_file_bodies(file_content, file_id, function_definitions, nodeid2name))
 
     if len(bodies) > 0:
         bodies_processed = pd.DataFrame(bodies)
@@ -0,0 +1,149 @@
+import pandas as pd
+
+
+DEFINITION = 1
+REFERENCE = 0
+
+# file 30: `outer` on lines 1-10 with nested `inner` on lines 3-6, `method` on lines 12-15
+# file 40: `g` on lines 1-3, the same lines as in file 30
+nodes = pd.DataFrame.from_records([
+    (30, "file", "module_a"),
+    (40, "file", "module_b"),
+    (1, "function", "outer"),
+    (2, "function", "inner"),
+    (3, "class_method", "A.method"),
+    (4, "function", "g"),
+    *[(id_, "function", f"callee_{id_}") for id_ in range(5, 15)],
+    (15, "global_variable", "value"),
+], columns=["id", "type", "serialized_name"])
+
+# element id, file, start line, start column, end line, end column, occurrence type
+occurrence_records = [
+    (1, 30, 1, 1, 10, 20, DEFINITION),
+    (2, 30, 3, 5, 6, 20, DEFINITION),
+    (3, 30, 12, 5, 15, 20, DEFINITION),
+    (4, 40, 1, 1, 3, 20, DEFINITION),
+    (105, 30, 1, 20, 1, 25, REFERENCE),  # first line of `outer`
+    (106, 30, 3, 20, 3, 25, REFERENCE),  # first line of `inner`
+    (107, 30, 4, 9, 4, 15, REFERENCE),
+    (108, 30, 4, 20, 4, 30, REFERENCE),  # same line, sorted before the previous call
+    (109, 30, 6, 9, 6, 15, REFERENCE),  # last line of `inner`
+    (110, 30, 7, 5, 7, 10, REFERENCE),  # only in `outer`
+    (111, 30, 9, 5, 10, 10, REFERENCE),  # multiline, ends on the last line of `outer`
+    (112, 30, 10, 12, 11, 3, REFERENCE),  # ends after `outer`
+    (113, 30, 11, 1, 11, 10, REFERENCE),  # between definitions
+    (105, 30, 12, 9, 12, 15, REFERENCE),  # first line of `method`
+    (114, 30, 15, 9, 15, 15, REFERENCE),  # last line of `method`
+    (115, 30, 5, 9, 5, 15, REFERENCE),  # not a call
+    (106, 40, 1, 10, 1, 15, REFERENCE),
+    (107, 40, 3, 9, 3, 15, REFERENCE),
+    (108, 40, 4, 5, 4, 15, REFERENCE),  # after `g`
+]
+
+edges = pd.DataFrame.from_records([
+    (105, "calls", 1, 5),
+    (106, "calls", 2, 6),
+    (107, "calls", 2, 7),
+    (108, "calls", 2, 8),
+    (109, "calls", 2, 9),
+    (110, "calls", 1, 10),
+    (111, "calls", 1, 11),
+    (112, "calls", 1, 12),
+    (113, "calls", 1, 13),
+    (114, "calls", 3, 14),
+    (115, "uses", 2, 15),
+    (-105, "calls_rev", 5, 1),
+], columns=["id", "type", "source_node_id", "target_node_id"])
+
+
+def get_tables():
+    source_location = pd.DataFrame.from_records([
+        (ind, file_id, start_line, start_column, end_line, end_column, occ_type)
+        for ind, (_, file_id, start_line, start_column, end_line, end_column, occ_type)
+        in enumerate(occurrence_records)
+    ], columns=["id", "file_node_id", "start_line", "start_column", "end_line", "end_column", "type"])
+    occurrence = pd.DataFrame({
+        "element_id": [record[0] for record in occurrence_records], "source_location_id": source_location["id"]
+    })
+    return nodes.copy(), edges.copy(), source_location, occurrence
+
+
+def sql_get_function_definitions(occurrences):
+    return occurrences.query(
+        f"select * from {occurrences.table_name} where occ_type = {DEFINITION} and "
+        f"(type = 'function' or type = 'class_method')"
+    )
+
+
+def sql_get_occurrences_within_definitions(occurrences, condition):
+    """
+    Find occurrences within function definitions the way it was done before the interval join: one query for
+    every definition of every file.
+    :return: list of tuples (definition, occurrences) with occurrences sorted with `sort_occurrences`
+    """
+    from SourceCodeTools.code.common import SQLTable
+    from SourceCodeTools.code.data.sourcetrail.common import sort_occurrences
+
+    definitions = []
+    for file_id, file_occurrences in occurrences.groupby("file_node_id"):
+        sql_occurrences = SQLTable(file_occurrences, ":memory:", "occurrences")
+
+        for _, f_def in sql_get_function_definitions(sql_occurrences).iterrows():
+            local_occurrences = sql_occurrences.query(
+                f"select * from {sql_occurrences.table_name} where start_line >= {f_def.start_line} and "
+                f"end_line <= {f_def.end_line} and occ_type != {DEFINITION} and {condition}"
+            )
+            local_occurrences = local_occurrences.astype({"source_node_id": "Int32", "target_node_id": "Int32"})
+            definitions.append((f_def, sort_occurrences(local_occurrences)))
+
+        del sql_occurrences
+    return definitions
+
+
+def sql_extract_call_seq(nodes, edges, source_location, occurrence):
+    from SourceCodeTools.code.data.sourcetrail.common import get_occurrences
+
+    occurrences = get_occurrences(nodes, edges, source_location, occurrence)
+
+    call_seq = []
+    for _, local_occurrences in sql_get_occurrences_within_definitions(occurrences, "e_type = 'calls'"):
+        all_calls = local_occurrences["target_node_id"].dropna().tolist()
+        for i in range(len(all_calls) - 1):
+            call_seq.append({"src": all_calls[i], "dst": all_calls[i + 1]})
+    return pd.DataFrame(call_seq).astype({"src": "int", "dst": "int"})
+
+
+def test_occurrences_within_definitions_match_sql():
+    from SourceCodeTools.code.data.sourcetrail.common import get_occurrences, get_function_definitions, \
+        get_occurrences_within_definitions
+
+    occurrences = get_occurrences(*get_tables())
+    expected = [
+        (f_def.element_id, local_occurrences["source_location_id"].tolist())
+        for f_def, local_occurrences in sql_get_occurrences_within_definitions(occurrences, "start_line = end_line")
+    ]
+
+    definitions = get_function_definitions(occurrences).sort_values("file_node_id", kind="stable")
+    body_occurrences = occurrences.query(f"occ_type != {DEFINITION} and start_line == end_line")
+    definition_positions, occurrence_positions = get_occurrences_within_definitions(definitions, body_occurrences)
+
+    location_ids = body_occurrences["source_location_id"].to_numpy()
+    computed = [
+        (element_id, location_ids[occurrence_positions[definition_positions == ind]].tolist())
+        for ind, element_id in enumerate(definitions["element_id"])
+    ]
+
+    assert computed == expected
+    # nested definition and boundary lines
+    assert dict(computed)[2] == [5, 7, 6, 15, 8]
+    assert dict(computed)[1] == [4, 5, 7, 6, 15, 8, 9]
+
+
+def test_extract_call_seq_matches_sql():
+    from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import extract_call_seq
+
+    expected = sql_extract_call_seq(*get_tables())
+    computed = extract_call_seq(*get_tables())
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(computed.reset_index(drop=True), expected, check_dtype=False)
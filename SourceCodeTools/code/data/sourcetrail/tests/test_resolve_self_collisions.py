@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def baseline_resolve_self_collision(offsets):
+    from SourceCodeTools.code.annotator_utils import overlap
+
+    no_collisions = []
+    for offset_1 in offsets:
+        # keep first
+        if not any(map(lambda x: overlap(offset_1, x), no_collisions)):
+            no_collisions.append(offset_1)
+    return no_collisions
+
+
+def random_offsets(rnd, num_offsets):
+    starts = rnd.randint(0, 200, num_offsets)
+    lengths = rnd.randint(0, 30, num_offsets)
+    return [
+        (int(start), int(start + length), f"node_{ind}") for ind, (start, length) in enumerate(zip(starts, lengths))
+    ]
+
+
+def test_resolve_self_collision_matches_baseline():
+    from SourceCodeTools.code.annotator_utils import resolve_self_collision
+
+    rnd = np.random.RandomState(0)
+    for _ in range(200):
+        offsets = random_offsets(rnd, rnd.randint(0, 60))
+        assert resolve_self_collision(offsets) == baseline_resolve_self_collision(offsets)
+
+
+def test_resolve_self_collisions2_keeps_smallest():
+    from SourceCodeTools.code.annotator_utils import resolve_self_collisions2
+
+    # nested spans, the inner one is kept
+    assert resolve_self_collisions2([(0, 10, "outer"), (2, 4, "inner")]) == [(2, 4, "inner")]
+    assert resolve_self_collisions2([(2, 4, "inner"), (0, 10, "outer")]) == [(2, 4, "inner")]
+    # spans of equal size, the one that appears later is kept
+    assert resolve_self_collisions2([(0, 4, "first"), (2, 6, "second")]) == [(2, 6, "second")]
+    # spans that share a boundary position overlap
+    assert resolve_self_collisions2([(0, 5, "left"), (5, 7, "right")]) == [(5, 7, "right")]
+    # identical spans are kept once
+    assert resolve_self_collisions2([(1, 3, "a"), (1, 3, "a")]) == [(1, 3, "a")]
+
+
+def test_resolve_self_collisions2_keeps_input_order():
+    from SourceCodeTools.code.annotator_utils import resolve_self_collisions2
+
+    offsets = [(20, 25, "c"), (0, 3, "a"), (10, 12, "b")]
+    assert resolve_self_collisions2(offsets) == offsets
+
+
+def test_resolve_self_collisions2_cascading_eviction():
+    from SourceCodeTools.code.annotator_utils import resolve_self_collisions2
+
+    # "middle" conflicts with both other spans and is evicted by "left", the smallest one. "right" overlaps only
+    # with "middle", so it is kept.
+    offsets = [(5, 15, "middle"), (14, 40, "right"), (0, 6, "left")]
+    assert resolve_self_collisions2(offsets) == [(14, 40, "right"), (0, 6, "left")]
+
+
+def test_resolve_self_collisions2_returns_non_overlapping_spans():
+    from SourceCodeTools.code.annotator_utils import resolve_self_collisions2, overlap
+
+    rnd = np.random.RandomState(1)
+    for _ in range(200):
+        offsets = random_offsets(rnd, rnd.randint(0, 60))
+        resolved = resolve_self_collisions2(offsets)
+        for ind, offset_1 in enumerate(resolved):
+            for offset_2 in resolved[ind + 1:]:
+                assert not overlap(offset_1, offset_2)
+        # every removed span overlaps a kept span that is not larger
+        for offset in set(offsets) - set(resolved):
+            assert any(
+                overlap(offset, kept) and kept[1] - kept[0] <= offset[1] - offset[0] for kept in resolved
+            )
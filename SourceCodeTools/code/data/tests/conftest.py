@@ -0,0 +1,40 @@
+import hashlib
+import itertools
+
+import pytest
+
+
+class SeededIdentifierPool:
+    """
+    Identifiers derived from the source code, so that separate builds of the same file create the same nodes.
+    """
+    def __init__(self, seed, int_identifiers=False):
+        self._seed = seed
+        self._int_identifiers = int_identifiers
+        self._counter = itertools.count()
+
+    def get_new_identifier(self):
+        identifier = hashlib.md5(f"{self._seed}{next(self._counter)}".encode("utf-8")).hexdigest()
+        if self._int_identifiers:
+            return str(int(identifier, 16))[:19].rjust(19, "1")
+        return "0x" + identifier[:16]
+
+
+@pytest.fixture
+def deterministic_identifiers(monkeypatch):
+    from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator
+    from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges2 import OccurrenceReplacer
+
+    generator_init = AstGraphGenerator.__init__
+    replacer_init = OccurrenceReplacer.__init__
+
+    def init_generator(self, source, *args, **kwargs):
+        generator_init(self, source, *args, **kwargs)
+        self._identifier_pool = SeededIdentifierPool(source)
+
+    def init_replacer(self):
+        replacer_init(self)
+        self._identifier_pool = SeededIdentifierPool("replacer", int_identifiers=True)
+
+    monkeypatch.setattr(AstGraphGenerator, "__init__", init_generator)
+    monkeypatch.setattr(OccurrenceReplacer, "__init__", init_replacer)
@@ -0,0 +1,33 @@
+import pandas as pd
+
+
+source_codes = [
+    ("a", 0, "import os\n\n\ndef join(path: str) -> str:\n    return os.path.join(path, 'a')\n"),
+    ("a", 1, "class A:\n    def __init__(self, x):\n        self.x = x\n\n    def get(self):\n        return self.x\n"),
+    ("b", 2, "from a.module import join\n\nprint(join('b'))\nvalue = [i * 2 for i in range(10)]\n"),
+    ("b", 3, "def f(n):\n    total = 0\n    for i in range(n):\n        if i % 2:\n            total += i\n"
+             "    return total\n"),
+    ("c", 4, "try:\n   a = b\nexcept Exception as e:\n   a = c\nelse:\n   a = d\nfinally:\n   print(a)\n"),
+    ("c", 5, "def broken(:\n"),
+]
+
+
+def build(num_workers):
+    from SourceCodeTools.code.data.ast_graph.build_ast_graph import build_ast_only_graph
+    from SourceCodeTools.code.data.ast_graph.local2global import get_local2global, GlobalIdIndex
+
+    nodes, edges, offsets = build_ast_only_graph(
+        source_codes, None, create_subword_instances=False, connect_subwords=False, lang="py", track_offsets=True,
+        num_workers=num_workers
+    )
+    local2global = get_local2global(global_nodes=GlobalIdIndex(), local_nodes=nodes)
+    return nodes, edges, offsets, local2global
+
+
+def test_parallel_build_matches_serial(deterministic_identifiers):
+    serial = build(num_workers=1)
+    parallel = build(num_workers=2)
+
+    assert len(serial[0]) > 0 and len(serial[1]) > 0
+    for serial_table, parallel_table in zip(serial, parallel):
+        pd.testing.assert_frame_equal(serial_table, parallel_table)
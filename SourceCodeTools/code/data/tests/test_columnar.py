@@ -0,0 +1,115 @@
+import tempfile
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+
+def create_nodes(num_nodes, seed):
+    rnd = np.random.RandomState(seed)
+    names = ["a", "b.c", "ünïcödé", "with space", "", "x\"y"]
+    types = ["module", "class", "function", "Name", "arg"]
+    return pd.DataFrame({
+        "id": np.arange(num_nodes) + seed * num_nodes,
+        "type": [types[i] for i in rnd.randint(0, len(types), num_nodes)],
+        "serialized_name": [names[i] + str(j) for j, i in enumerate(rnd.randint(0, len(names), num_nodes))],
+        "mentioned_in": pd.array(
+            [None if rnd.rand() < 0.3 else int(rnd.randint(0, 100)) for _ in range(num_nodes)], dtype="Int32"
+        ),
+    })
+
+
+def create_edges(num_edges, seed):
+    rnd = np.random.RandomState(seed)
+    types = ["next", "prev", "defined_in", "arg"]
+    return pd.DataFrame({
+        "id": np.arange(num_edges) + seed * num_edges,
+        "type": [types[i] for i in rnd.randint(0, len(types), num_edges)],
+        "source_node_id": rnd.randint(0, 1000, num_edges),
+        "target_node_id": rnd.randint(0, 1000, num_edges),
+        "file_id": pd.array(
+            [None if rnd.rand() < 0.2 else int(rnd.randint(0, 10)) for _ in range(num_edges)], dtype="Int32"
+        ),
+        "mentioned_in": pd.array(
+            [None if rnd.rand() < 0.5 else int(rnd.randint(0, 100)) for _ in range(num_edges)], dtype="Int32"
+        ),
+    })
+
+
+def write_in_chunks(chunks, path):
+    from SourceCodeTools.code.data.file_utils import persist
+
+    for ind, chunk in enumerate(chunks):
+        persist(chunk, path, mode="a" if ind > 0 else None)
+
+
+def assert_same_tables(baseline, columnar):
+    baseline = baseline.reset_index(drop=True)
+    columnar = columnar.reset_index(drop=True)
+    assert list(baseline.columns) == list(columnar.columns)
+    for column in baseline.columns:
+        if isinstance(baseline[column].dtype, pd.CategoricalDtype):
+            # category order depends on the order of appearance in chunks
+            pd.testing.assert_series_equal(
+                baseline[column].astype("string"), columnar[column].astype("string"), check_names=False
+            )
+        else:
+            pd.testing.assert_series_equal(baseline[column], columnar[column], check_names=False)
+
+
+def test_columnar_nodes_match_json():
+    from SourceCodeTools.code.common import read_nodes
+
+    chunks = [create_nodes(500, seed) for seed in range(3)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_in_chunks(chunks, join(tmp_dir, "common_nodes.json"))
+        write_in_chunks(chunks, join(tmp_dir, "common_nodes.columns"))
+
+        baseline = read_nodes(join(tmp_dir, "common_nodes.json"))
+        columnar = read_nodes(join(tmp_dir, "common_nodes.columns"))
+        assert len(columnar) == sum(map(len, chunks))
+        assert_same_tables(baseline, columnar)
+
+        baseline_chunks = pd.concat(read_nodes(join(tmp_dir, "common_nodes.json"), as_chunks=True))
+        columnar_chunks = pd.concat(read_nodes(join(tmp_dir, "common_nodes.columns"), as_chunks=True))
+        assert_same_tables(baseline_chunks, columnar_chunks)
+
+
+def test_columnar_edges_match_json():
+    from SourceCodeTools.code.common import read_edges
+
+    chunks = [create_edges(700, seed) for seed in range(3)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_in_chunks(chunks, join(tmp_dir, "common_edges.json"))
+        write_in_chunks(chunks, join(tmp_dir, "common_edges.columns"))
+
+        baseline = read_edges(join(tmp_dir, "common_edges.json"))
+        columnar = read_edges(join(tmp_dir, "common_edges.columns"))
+        assert len(columnar) == sum(map(len, chunks))
+        assert_same_tables(baseline, columnar)
+
+        columns = ["id", "source_node_id", "target_node_id"]
+        selected = read_edges(join(tmp_dir, "common_edges.columns"), columns=columns)
+        assert_same_tables(baseline[columns], selected)
+
+
+def test_columnar_missing_values_become_known_later():
+    from SourceCodeTools.code.data.file_utils import read_columnar
+
+    chunks = [
+        pd.DataFrame({"id": [1, 2], "string": [None, None], "value": [None, None]}),
+        pd.DataFrame({"id": [3, 4], "string": ["x", None], "value": [5, None]}),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = join(tmp_dir, "table.columns")
+        write_in_chunks(chunks, path)
+        table = read_columnar(path)
+
+    assert table["id"].tolist() == [1, 2, 3, 4]
+    assert table["string"].isna().tolist() == [True, True, False, True]
+    assert table["string"][2] == "x"
+    assert table["value"].isna().tolist() == [True, True, False, True]
+    assert table["value"][2] == 5
@@ -0,0 +1,144 @@
+import os
+import shutil
+import sqlite3
+from os.path import join
+
+import pandas as pd
+
+
+example_environments = join(
+    os.path.dirname(__file__), "..", "..", "..", "..", "res", "python_testdata", "example_environment"
+)
+
+sourcetrail_tables = {
+    "nodes.csv": "node", "edges.csv": "edge", "source_location.csv": "source_location",
+    "occurrence.csv": "occurrence", "filecontent.csv": "filecontent", "element_component.csv": "element_component",
+}
+
+package_a = {
+    "a/module.py": "import os\n\n\ndef join(path: str) -> str:\n    return os.path.join(path, 'a')\n",
+    "a/classes.py": "class A:\n    def __init__(self, x):\n        self.x = x\n\n    def get(self):\n        return self.x\n",
+    "a/calls.py": "from a.module import join\n\nprint(join('b'))\nvalue = [i * 2 for i in range(10)]\n",
+}
+package_b = {
+    "b/module.py": "import os\n\n\ndef split(path):\n    return os.path.split(path)\n",
+    "b/loops.py": "def f(n):\n    total = 0\n    for i in range(n):\n        if i % 2:\n            total += i\n"
+                  "    return total\n",
+}
+package_c = {"c/module.py": "def g(x):\n    return x + 1\n"}
+# files keep their ids when packages are added
+file_ids = {filename: id_ for id_, filename in enumerate([*package_a, *package_b, *package_c])}
+
+
+def read_outputs(output_path):
+    from SourceCodeTools.code.data.file_utils import unpersist
+
+    outputs = {}
+    for filename in sorted(os.listdir(output_path)):
+        if filename.startswith("common_") or filename == "node_names.json":
+            outputs[filename] = unpersist(join(output_path, filename)).reset_index(drop=True)
+    return outputs
+
+
+def assert_same_outputs(full_path, incremental_path):
+    full = read_outputs(full_path)
+    incremental = read_outputs(incremental_path)
+
+    assert "common_nodes.json" in full and "common_edges.json" in full
+    assert full.keys() == incremental.keys()
+    for filename in full:
+        pd.testing.assert_frame_equal(full[filename], incremental[filename], check_dtype=False, obj=filename)
+
+
+def write_source_code(path, packages):
+    records = []
+    for package in packages:
+        for filename, filecontent in package.items():
+            records.append({"id": file_ids[filename], "package": filename.split("/")[0], "filecontent": filecontent})
+    pd.DataFrame.from_records(records).to_csv(path, index=False)
+
+
+def build_ast_dataset(source_code_path, output_path, incremental):
+    from SourceCodeTools.code.data.ast_graph.build_ast_graph import AstDatasetCreator
+
+    dataset = AstDatasetCreator(
+        source_code_path, "python", None, False, False, False, do_extraction=True, track_offsets=True,
+        chunksize=2, incremental=incremental
+    )
+    dataset.merge(output_path)
+    del dataset
+
+
+def test_incremental_ast_dataset_matches_full_build(tmp_path, deterministic_identifiers):
+    full_source_code = join(tmp_path, "full", "source_code.csv")
+    incremental_source_code = join(tmp_path, "incremental", "source_code.csv")
+    os.makedirs(os.path.dirname(full_source_code))
+    os.makedirs(os.path.dirname(incremental_source_code))
+
+    write_source_code(full_source_code, [package_a, package_b])
+    build_ast_dataset(full_source_code, join(tmp_path, "full_output"), incremental=False)
+
+    write_source_code(incremental_source_code, [package_a])
+    build_ast_dataset(incremental_source_code, join(tmp_path, "incremental_output"), incremental=True)
+    write_source_code(incremental_source_code, [package_a, package_b])
+    build_ast_dataset(incremental_source_code, join(tmp_path, "incremental_output"), incremental=True)
+
+    assert_same_outputs(join(tmp_path, "full_output", "with_ast"), join(tmp_path, "incremental_output", "with_ast"))
+
+
+def export_sourcetrail_environment(package, environments_path):
+    """
+    Export tables of Sourcetrail database the same way as `extract.sql` does.
+    """
+    env_path = join(environments_path, package)
+    os.makedirs(env_path)
+    database_path = join(env_path, f"{package}.srctrldb")
+    shutil.copy(join(example_environments, package, f"{package}.srctrldb"), database_path)
+
+    with sqlite3.connect(database_path) as connection:
+        for filename, table in sourcetrail_tables.items():
+            pd.read_sql_query(f"SELECT * FROM {table}", connection).to_csv(join(env_path, filename), index=False)
+
+
+def build_sourcetrail_dataset(environments_path, output_path, incremental):
+    from SourceCodeTools.code.data.sourcetrail.DatasetCreator2 import DatasetCreator
+
+    dataset = DatasetCreator(
+        environments_path, "python", None, False, False, False, do_extraction=True, track_offsets=True,
+        incremental=incremental
+    )
+    dataset.merge(output_path)
+    del dataset
+
+
+def test_incremental_sourcetrail_dataset_matches_full_build(tmp_path, deterministic_identifiers):
+    full_environments = join(tmp_path, "full")
+    incremental_environments = join(tmp_path, "incremental")
+
+    export_sourcetrail_environment("example", full_environments)
+    export_sourcetrail_environment("example2", full_environments)
+    build_sourcetrail_dataset(full_environments, join(tmp_path, "full_output"), incremental=False)
+
+    export_sourcetrail_environment("example", incremental_environments)
+    build_sourcetrail_dataset(incremental_environments, join(tmp_path, "incremental_output"), incremental=True)
+    export_sourcetrail_environment("example2", incremental_environments)
+    build_sourcetrail_dataset(incremental_environments, join(tmp_path, "incremental_output"), incremental=True)
+
+    for graph in ["no_ast", "with_ast"]:
+        assert_same_outputs(join(tmp_path, "full_output", graph), join(tmp_path, "incremental_output", graph))
+
+
+def test_inserted_package_does_not_affect_other_environments(tmp_path, caplog, deterministic_identifiers):
+    import logging
+
+    source_code = join(tmp_path, "source_code.csv")
+
+    write_source_code(source_code, [package_a, package_c])
+    build_ast_dataset(source_code, join(tmp_path, "output"), incremental=True)
+
+    write_source_code(source_code, [package_a, package_b, package_c])
+    with caplog.at_level(logging.INFO):
+        build_ast_dataset(source_code, join(tmp_path, "output"), incremental=True)
+
+    assert sum(record.getMessage() == "Environment is not changed, skipping extraction" for record in caplog.records) == 2
+    assert len([dir for dir in os.listdir(join(tmp_path, "source_code_graph_builder")) if dir.startswith("package_")]) == 3
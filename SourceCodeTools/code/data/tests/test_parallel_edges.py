@@ -0,0 +1,138 @@
+import tempfile
+from collections import defaultdict
+from os.path import join
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+# ids are assigned to filtered chunks, writes into a copy of a slice would be lost under copy-on-write
+pytestmark = pytest.mark.filterwarnings("error::pandas.errors.SettingWithCopyWarning")
+
+global_edge_types = {"global_mention", "global_mention_rev"}
+edge_priority = {"next": 0, "prev": 1, "defined_in": 2}
+
+
+def baseline_handle_parallel_edges(edges):
+    """
+    Removal of parallel edges as it was done for a single chunk before spill files were introduced.
+    """
+    edges = edges.copy()
+    edges["id"] = range(len(edges))
+
+    existing_global_edges = set()
+    edge_bank = defaultdict(list)
+    ids_to_remove = set()
+    for id_, type_, src, dst in edges[["id", "type", "source_node_id", "target_node_id"]].values:
+        if type_ in global_edge_types:
+            global_edge = (type_, src, dst)
+            if global_edge not in existing_global_edges:
+                existing_global_edges.add(global_edge)
+            else:
+                ids_to_remove.add(id_)
+        else:
+            edge_bank[(src, dst)].append((id_, type_))
+
+    for key, parallel_edges in edge_bank.items():
+        if len(parallel_edges) > 1:
+            parallel_edges = sorted(parallel_edges, key=lambda x: edge_priority.get(x[1], 3))
+            ids_to_remove.update(pe[0] for pe in parallel_edges[1:])
+
+    edges = edges[edges["id"].apply(lambda id_: id_ not in ids_to_remove)]
+    edges["id"] = range(len(edges))
+    return edges
+
+
+def get_writing_mode(is_csv, first_written):
+    kwargs = {}
+    if first_written is True:
+        kwargs["mode"] = "a"
+        if is_csv:
+            kwargs["header"] = False
+    return kwargs
+
+
+def test_remove_parallel_edges_matches_baseline():
+    from SourceCodeTools.code.common import read_edges
+    from SourceCodeTools.code.data.file_utils import persist
+    from SourceCodeTools.code.data.parallel_edges import remove_parallel_edges_with_chunks
+
+    rnd = np.random.RandomState(0)
+    num_edges = 20000
+    types = sorted(global_edge_types) + list(edge_priority.keys()) + ["arg"]
+    # small number of nodes to get many parallel edges
+    edges = pd.DataFrame({
+        "id": np.arange(num_edges),
+        "type": [types[i] for i in rnd.randint(0, len(types), num_edges)],
+        "source_node_id": rnd.randint(0, 60, num_edges),
+        "target_node_id": rnd.randint(0, 60, num_edges),
+    })
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        edges_path = join(tmp_dir, "common_edges.json")
+        persist(edges, edges_path)
+        remove_parallel_edges_with_chunks(
+            edges_path, global_edge_types=global_edge_types, edge_priority=edge_priority,
+            kwarg_fn=get_writing_mode, num_partitions=7
+        )
+        result = read_edges(edges_path)
+
+    baseline = baseline_handle_parallel_edges(edges)
+
+    assert 0 < len(result) < num_edges
+    columns = ["id", "type", "source_node_id", "target_node_id"]
+    assert result[columns].astype(str).values.tolist() == baseline[columns].astype(str).values.tolist()
+
+
+def edge_keys(edges):
+    return sorted(
+        (type_ if type_ in global_edge_types else "", src, dst)
+        for type_, src, dst in edges[["type", "source_node_id", "target_node_id"]].values.tolist()
+    )
+
+
+def test_appended_edges_match_full_removal():
+    from SourceCodeTools.code.common import read_edges
+    from SourceCodeTools.code.data.file_utils import persist
+    from SourceCodeTools.code.data.parallel_edges import remove_parallel_edges_with_chunks, find_edges_present_in
+
+    rnd = np.random.RandomState(1)
+    num_edges = 5000
+    types = sorted(global_edge_types) + list(edge_priority.keys()) + ["arg"]
+    edges = pd.DataFrame({
+        "id": np.arange(num_edges),
+        "type": [types[i] for i in rnd.randint(0, len(types), num_edges)],
+        "source_node_id": rnd.randint(0, 60, num_edges),
+        "target_node_id": rnd.randint(0, 60, num_edges),
+    })
+    existing, new = edges.iloc[:3000], edges.iloc[3000:]
+
+    def remove_parallel_edges(path):
+        remove_parallel_edges_with_chunks(
+            path, global_edge_types=global_edge_types, edge_priority=edge_priority,
+            kwarg_fn=get_writing_mode, num_partitions=5
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        full_path = join(tmp_dir, "full_edges.json")
+        persist(edges, full_path)
+        remove_parallel_edges(full_path)
+        full = read_edges(full_path)
+
+        existing_path = join(tmp_dir, "common_edges.json")
+        new_path = join(tmp_dir, "new_edges.json")
+        persist(existing, existing_path)
+        persist(new, new_path)
+        remove_parallel_edges(existing_path)
+        remove_parallel_edges(new_path)
+
+        num_existing = len(read_edges(existing_path))
+        present, next_id = find_edges_present_in(new_path, existing_path, global_edge_types)
+        new = read_edges(new_path)[~present]
+        appended = pd.concat([read_edges(existing_path), new])
+
+    assert next_id == num_existing
+    assert 0 < len(new) < len(present)
+    assert len(appended) == len(full)
+    assert edge_keys(appended) == edge_keys(full)
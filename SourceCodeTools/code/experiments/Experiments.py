@@ -12,6 +12,7 @@ import numpy as np
 from SourceCodeTools.code.data.dataset.Dataset import filter_dst_by_freq
 from SourceCodeTools.code.data.file_utils import unpersist
 from SourceCodeTools.models.Embedder import Embedder
+from SourceCodeTools.models.negative_sampling import AliasSampler
 import pickle
 
 from SourceCodeTools.tabular.common import compact_property
@@ -449,10 +450,10 @@ class Experiment:
         """
         if strategy == "word2vec":
             counts = self.target['dst'].value_counts(normalize=True)
-            freq = counts.values ** unigram_power
-            self.freq = freq / sum(freq)
             self.dst_idxs = counts.index
-            self.dst_neg_sampling = lambda size: np.random.choice(self.dst_idxs, size, replace=True, p=self.freq)
+            self.dst_sampler = AliasSampler(counts.index.to_numpy(), counts.values, power=unigram_power)
+            self.freq = self.dst_sampler.probs
+            self.dst_neg_sampling = self.dst_sampler.sample
         elif strategy == "uniform":
             self.dst_neg_sampling = lambda size: np.random.choice(self.unique_dst, size, replace=True)
 
@@ -0,0 +1,125 @@
+import re
+from collections import Counter
+
+import pandas as pd
+
+
+function_source = """def f(a: int, b=None) -> str:
+    total = 0
+    for i in range(a):
+        if i % 2 and b is not None:
+            total += b[i].value
+        else:
+            print(f"{i}", total, sep=", ")
+    while total > 0:
+        total -= 1
+    try:
+        x = [j * 2 for j in range(total)]
+    except Exception as e:
+        raise ValueError("a") from e
+    return str(lambda y: y + x[0])
+"""
+
+module_source = """import os
+from a.b import c as d
+
+
+class A(object):
+    value: int = 1
+
+    def __init__(self, x):
+        self.x = x
+
+    @property
+    def get(self):
+        return self.x[1:2], {k: v for k, v in os.environ.items()}
+
+
+with open("a") as f:
+    data = f.read()
+"""
+
+# random identifiers in default mode and file identifier with sequential ids in compact mode
+identifier_pattern = re.compile(r"_0x[0-9a-f]+(_\d+)?")
+position_fields = [
+    "line", "end_line", "col_offset", "end_col_offset", "var_line", "var_end_line", "var_col_offset",
+    "var_end_col_offset"
+]
+
+
+def normalize_name(name):
+    return identifier_pattern.sub("", name)
+
+
+def describe_node(name, type, string):
+    return normalize_name(name), type, None if string is None else str(string)
+
+
+def default_edges(edges):
+    return Counter(
+        (
+            describe_node(edge["src"].name, edge["src"].type, edge["src"].string),
+            describe_node(edge["dst"].name, edge["dst"].type, edge["dst"].string),
+            edge["type"],
+            normalize_name(edge["scope"].name) if edge["scope"] is not None else None,
+            tuple(edge.get(field, None) for field in position_fields),
+        )
+        for edge in edges
+    )
+
+
+def compact_edges(edges, nodes):
+    nodes = nodes.set_index("id")
+
+    def describe(node_id):
+        node = nodes.loc[node_id]
+        return describe_node(node["name"], node["type"], node["string"])
+
+    def value(value):
+        return None if pd.isna(value) else int(value)
+
+    return Counter(
+        (
+            describe(edge["src"]),
+            describe(edge["dst"]),
+            edge["type"],
+            normalize_name(nodes.loc[edge["scope"], "name"]) if not pd.isna(edge["scope"]) else None,
+            tuple(value(edge[field]) for field in position_fields),
+        )
+        for _, edge in edges.iterrows()
+    )
+
+
+def assert_compact_matches_default_mode(source):
+    from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator
+
+    generator = AstGraphGenerator(source)
+    edges, _ = generator.parse(generator.root)
+    expected = default_edges(edges)
+
+    generator = AstGraphGenerator(source, compact=True)
+    generator.parse(generator.root)
+    edges = generator.get_compact_edges()
+    computed = compact_edges(edges, generator.get_nodes())
+
+    assert len(edges) > 100
+    assert computed == expected
+
+
+def test_compact_function_matches_default_mode():
+    assert_compact_matches_default_mode(function_source)
+
+
+def test_compact_module_matches_default_mode():
+    assert_compact_matches_default_mode(module_source)
+
+
+def test_compact_nodes_have_no_dict():
+    from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, CompactNode, GNode
+
+    generator = AstGraphGenerator(function_source, compact=True)
+    node = generator.make_node("a", "Name")
+
+    assert isinstance(node, CompactNode)
+    assert not hasattr(node, "__dict__")
+    assert node == GNode(name="a", type="Name")
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+def baseline_map_id_columns(df, column_names, mapper):
+    df = df.copy()
+    for col in column_names:
+        if col in df.columns:
+            df[col] = df[col].apply(lambda x: mapper.get(x, pd.NA))
+    return df
+
+
+def as_values(column):
+    return [None if pd.isna(value) else value for value in column]
+
+
+def test_map_id_columns_matches_dict_lookup():
+    from SourceCodeTools.code.common import map_id_columns
+
+    rnd = np.random.RandomState(0)
+    keys = rnd.choice(10 ** 6, size=1000, replace=False)
+    mapping = dict(zip(keys.tolist(), rnd.permutation(len(keys)).tolist()))
+
+    num_rows = 5000
+    # part of the ids are unknown
+    ids = rnd.choice(np.concatenate([keys, np.arange(10 ** 6, 10 ** 6 + 100)]), size=num_rows)
+    mentioned_in = pd.array(
+        [None if rnd.rand() < 0.3 else int(value) for value in rnd.choice(keys, size=num_rows)], dtype="Int32"
+    )
+    table = pd.DataFrame({"source_node_id": ids, "mentioned_in": mentioned_in, "type": ["edge"] * num_rows})
+
+    columns = ["source_node_id", "mentioned_in", "target_node_id"]
+    baseline = baseline_map_id_columns(table, columns, mapping)
+    mapped = map_id_columns(table, columns, mapping)
+
+    assert list(baseline.columns) == list(mapped.columns)
+    for column in baseline.columns:
+        assert as_values(baseline[column]) == as_values(mapped[column])
+    assert pd.api.types.is_integer_dtype(mapped["source_node_id"].dtype)
+
+
+def test_id_mapper_with_string_keys():
+    from SourceCodeTools.code.common import IdMapper
+
+    mapping = {"a": 10, "b": 20, "c": 30}
+    column = pd.Series(["c", "a", None, "d", "b"], dtype="string", index=[5, 6, 7, 8, 9])
+
+    mapped = IdMapper.from_dict(mapping).map(column)
+
+    assert list(mapped.index) == list(column.index)
+    assert as_values(mapped) == as_values(column.apply(lambda x: mapping.get(x, pd.NA)))
+
+
+def test_id_mapper_with_object_values():
+    from SourceCodeTools.code.common import IdMapper
+
+    mapping = {1: "x", 2: "y"}
+    column = pd.Series([2, 3, 1], dtype=object)
+
+    mapped = IdMapper.from_dict(mapping).map(column)
+
+    assert as_values(mapped) == ["y", None, "x"]
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def random_ranges(rnd, num_ranges, max_position=1000, max_length=200):
+    starts = rnd.randint(0, max_position, num_ranges)
+    # lengths of different scales, including empty ranges
+    lengths = (rnd.pareto(1., num_ranges) * 5).astype(np.int64) % max_length
+    return [(int(start), int(start + length)) for start, length in zip(starts, lengths)]
+
+
+def test_interval_index_matches_pairwise_overlap():
+    from SourceCodeTools.code.annotator_utils import IntervalIndex, overlap
+
+    rnd = np.random.RandomState(0)
+    for _ in range(20):
+        intervals = random_ranges(rnd, rnd.randint(1, 200))
+        ranges = random_ranges(rnd, rnd.randint(1, 200))
+
+        index = IntervalIndex([i[0] for i in intervals], [i[1] for i in intervals])
+        range_positions, interval_positions = index.query([r[0] for r in ranges], [r[1] for r in ranges])
+
+        expected = [
+            (range_position, interval_position)
+            for range_position, range_ in enumerate(ranges)
+            for interval_position, interval in enumerate(intervals)
+            if overlap(range_, interval)
+        ]
+        assert list(zip(range_positions.tolist(), interval_positions.tolist())) == expected
+
+        overlaps_any = index.overlaps_any([r[0] for r in ranges], [r[1] for r in ranges])
+        assert overlaps_any.tolist() == [any(overlap(r, i) for i in intervals) for r in ranges]
+
+
+def test_interval_index_assigns_enclosing_definitions():
+    """
+    Definitions are assigned to offsets the same way as with the nested loop in `process_code`.
+    """
+    from SourceCodeTools.code.annotator_utils import IntervalIndex, overlap
+
+    rnd = np.random.RandomState(1)
+    definitions = [(start, start + length, "definition") for start, length in [(0, 500), (10, 100), (200, 50)]]
+    offsets = [[start, end, "node", set()] for start, end in random_ranges(rnd, 300, max_position=800, max_length=30)]
+
+    expected = [set() for _ in offsets]
+    for def_ in definitions:
+        for position, offset_ in enumerate(offsets):
+            if overlap(def_, offset_):
+                expected[position].add(tuple(def_))
+
+    definition_index = IntervalIndex([def_[0] for def_ in definitions], [def_[1] for def_ in definitions])
+    offset_positions, definition_positions = definition_index.query(
+        [offset_[0] for offset_ in offsets], [offset_[1] for offset_ in offsets]
+    )
+    for offset_position, definition_position in zip(offset_positions.tolist(), definition_positions.tolist()):
+        offsets[offset_position][3].add(tuple(definitions[definition_position]))
+
+    assert [offset_[3] for offset_ in offsets] == expected
+
+
+def test_interval_index_empty():
+    from SourceCodeTools.code.annotator_utils import IntervalIndex
+
+    index = IntervalIndex([], [])
+    range_positions, interval_positions = index.query([1, 2], [3, 4])
+    assert len(index) == 0
+    assert len(range_positions) == 0 and len(interval_positions) == 0
@@ -8,6 +8,20 @@ class Embedder:
         self.inv = dict(zip(iid, aid))
 
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self.e, np.memmap) and self.e.filename is not None:
+            # store location of memory mapped embeddings instead of their content
+            state["e"] = None
+            state["mmap_path"] = self.e.filename
+        return state
+
+    def __setstate__(self, state):
+        mmap_path = state.pop("mmap_path", None)
+        self.__dict__.update(state)
+        if mmap_path is not None:
+            self.e = np.load(mmap_path, mmap_mode="r")
+
     def __getitem__(self, key):
         # if not hasattr(self, "map_id"):
         #     self.map_id = np.vectorize(lambda id: self.ind[id])
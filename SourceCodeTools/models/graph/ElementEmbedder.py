@@ -28,7 +28,7 @@ class GraphLinkSampler(ElementEmbedderBase, Scorer):
 
     def sample_negative(self, size, ids=None, strategy="closest"):
         if strategy == "w2v" or self.scorer_index is None:
-            negative = ElementEmbedderBase.sample_negative(self, size)
+            negative = ElementEmbedderBase.sample_negative(self, size, ids=ids)
         else:
             negative = Scorer.sample_closest_negative(self, ids, k=size // len(ids))
             assert len(negative) == size
@@ -178,6 +178,21 @@ class SelectiveGraphLinkSampler(ElementEmbedderBase, Scorer):
 
 
 
+def estimate_staleness(embedder, sample_size):
+    """
+    Estimate how much embeddings stored in the index of the embedder differ from current embeddings.
+    :param embedder: embedder with `embed_keys` and Scorer index
+    :param sample_size: number of randomly chosen candidates that are embedded again
+    :return: mean relative L2 distance between stored and current embeddings of sampled candidates
+    """
+    all_keys = embedder.get_keys_for_scoring()
+    positions = np.random.choice(len(all_keys), size=min(sample_size, len(all_keys)), replace=False)
+    current = embedder.embed_keys([all_keys[position] for position in positions])
+    stored = embedder.scorer_all_emb[positions]
+    distance = np.linalg.norm(current - stored, axis=1) / (np.linalg.norm(stored, axis=1) + 1e-8)
+    return float(np.mean(distance))
+
+
 class ElementEmbedder(ElementEmbedderBase, nn.Module, Scorer):
     def __init__(self, elements, nodes, emb_size, compact_dst=True):
         ElementEmbedderBase.__init__(self, elements=elements, nodes=nodes, compact_dst=compact_dst)
@@ -197,7 +212,7 @@ class ElementEmbedder(ElementEmbedderBase, nn.Module, Scorer):
         # TODO
         # Try other distributions
         if strategy == "w2v":
-            negative = ElementEmbedderBase.sample_negative(self, size)
+            negative = ElementEmbedderBase.sample_negative(self, size, ids=ids)
         else:
             ### negative = random.choices(Scorer.sample_closest_negative(self, ids), k=size)
             negative = Scorer.sample_closest_negative(self, ids, k=size // len(ids))
@@ -208,10 +223,15 @@ class ElementEmbedder(ElementEmbedderBase, nn.Module, Scorer):
     def forward(self, input, **kwargs):
         return self.norm(self.embed(input))
 
-    def set_embed(self):
-        all_keys = self.get_keys_for_scoring()
+    def embed_keys(self, keys):
         with torch.set_grad_enabled(False):
-            self.scorer_all_emb = self(torch.LongTensor(all_keys).to(self.embed.weight.device)).detach().cpu().numpy()
+            return self(torch.LongTensor(keys).to(self.embed.weight.device)).detach().cpu().numpy()
+
+    def set_embed(self):
+        self.scorer_all_emb = self.embed_keys(self.get_keys_for_scoring())
+
+    def estimate_staleness(self, sample_size):
+        return estimate_staleness(self, sample_size)
 
     def prepare_index(self):
         self.set_embed()
@@ -276,7 +296,7 @@ class ElementEmbedderWithCharNGramSubwords(ElementEmbedderBase, nn.Module, Score
         # TODO
         # Try other distributions
         if strategy == "w2v":
-            negative = ElementEmbedderBase.sample_negative(self, size)
+            negative = ElementEmbedderBase.sample_negative(self, size, ids=ids)
         else:
             ### negative = random.choices(Scorer.sample_closest_negative(self, ids), k=size)
             negative = Scorer.sample_closest_negative(self, ids, k=size // len(ids))
@@ -289,11 +309,16 @@ class ElementEmbedderWithCharNGramSubwords(ElementEmbedderBase, nn.Module, Score
         x = self.embed(input)
         return self.norm(torch.mean(x, dim=1))
 
-    def set_embed(self):
-        all_keys = self.get_keys_for_scoring()
-        emb_matr = np.array([self.name2repr[key] for key in all_keys], dtype=np.int32)
+    def embed_keys(self, keys):
+        emb_matr = np.array([self.name2repr[key] for key in keys], dtype=np.int32)
         with torch.set_grad_enabled(False):
-            self.scorer_all_emb = self(torch.LongTensor(emb_matr).to(self.embed.weight.device)).detach().cpu().numpy()
+            return self(torch.LongTensor(emb_matr).to(self.embed.weight.device)).detach().cpu().numpy()
+
+    def set_embed(self):
+        self.scorer_all_emb = self.embed_keys(self.get_keys_for_scoring())
+
+    def estimate_staleness(self, sample_size):
+        return estimate_staleness(self, sample_size)
 
     def prepare_index(self):
         self.set_embed()
@@ -5,6 +5,7 @@ from typing import Tuple
 import numpy as np
 import random as rnd
 
+from SourceCodeTools.models.negative_sampling import AliasSampler
 from SourceCodeTools.tabular.common import compact_property
 
 
@@ -109,15 +110,25 @@ class ElementEmbedderBase:
         # compute distribution of dst elements
         counts = self.elements['emb_id'].value_counts(normalize=True)
         self.idxs = counts.index
-        self.neg_prob = counts.to_numpy()
-        self.neg_prob **= skipgram_sampling_power
+        self.neg_sampler = AliasSampler(counts.index.to_numpy(), counts.to_numpy(), power=skipgram_sampling_power)
+        self.neg_prob = self.neg_sampler.probs
 
-        self.neg_prob /= sum(self.neg_prob)
-
-    def sample_negative(self, size):
+    def sample_negative(self, size, ids=None):
+        """
+        Sample targets from unigram distribution raised to the power of 0.75.
+        :param size: number of samples
+        :param ids: when given, samples are drawn for every id in equal numbers, positive targets of ids are excluded.
+            Samples are ordered in rounds over ids, so that sample `j` belongs to `ids[j % len(ids)]`, the same way
+            as the batch is tiled with `repeat` when negatives are paired with source nodes
+        :return: array of targets
+        """
         # TODO
         # Try other distributions
-        return np.random.choice(self.idxs, size, replace=True, p=self.neg_prob)
+        if ids is None or len(ids) == 0 or size % len(ids) != 0:
+            return self.neg_sampler.sample(size)
+        return self.neg_sampler.sample_excluding(
+            [self.element_lookup[id] for id in ids], k=size // len(ids)
+        ).T.reshape(-1)
 
     def __getitem__(self, ids):
         return np.fromiter((rnd.choice(self.element_lookup[id]) for id in ids), dtype=np.int32)
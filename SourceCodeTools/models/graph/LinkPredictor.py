@@ -57,6 +57,18 @@ class BilinearLinkPedictor(nn.Module):
     def forward(self, x1, x2):
         return self.bilinear(self.act(self.l1(x1)), self.act(self.l2(x2)))
 
+    def forward_pairwise(self, x1, x2):
+        """
+        Compute logits for all pairs of rows from x1 and x2 without repeating inputs.
+        :return: tensor with shape (len(x1), len(x2), target_classes)
+        """
+        h1 = self.act(self.l1(x1))
+        h2 = self.act(self.l2(x2))
+        logits = torch.einsum("ik,ckl,jl->ijc", h1, self.bilinear.weight, h2)
+        if self.bilinear.bias is not None:
+            logits = logits + self.bilinear.bias
+        return logits
+
 
 class CosineLinkPredictor(nn.Module):
     def __init__(self, margin=0.):
@@ -100,6 +112,14 @@ class TransRLinkPredictor(nn.Module):
         self.proj_matr = nn.Embedding(num_embeddings=num_relations, embedding_dim=input_dim * rel_dim)
         self.triplet_loss = nn.TripletMarginLoss(margin=margin)
 
+    def get_projection(self, label):
+        """
+        Get projection matrix and translation vector for a single relation.
+        :return: tensors with shapes (rel_dim, input_dim) and (rel_dim,)
+        """
+        labels = torch.LongTensor([label]).to(self.proj_matr.weight.device)
+        return self.proj_matr(labels).reshape((self.rel_dim, self.input_dim)), self.rel_emb(labels)[0]
+
     def forward(self, a, p, n, labels):
         weights = self.proj_matr(labels).reshape((-1, self.rel_dim, self.input_dim))
         rels = self.rel_emb(labels)
@@ -1,4 +1,5 @@
 from SourceCodeTools.nlp import token_hasher
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -24,25 +25,59 @@ class NodeEmbedder(nn.Module):
             ['global_graph_id', 'typed_id', 'type', 'type_backup', embedding_field]
         ]
 
-        type_name = list(zip(nodes_with_embeddings['type_backup'], nodes_with_embeddings[embedding_field]))
+        assert len(nodes_with_embeddings) == len(nodes_with_embeddings[["type", "typed_id"]].drop_duplicates())
 
-        self.node_info = dict(zip(
-            list(zip(nodes_with_embeddings['type'], nodes_with_embeddings['typed_id'])),
-            type_name
-        ))
+        # names do not change during training, bucket ids are computed once for every unique name
+        unique_names = nodes_with_embeddings[embedding_field].unique()
+        name2bucket = dict(zip(unique_names, (token_hasher(name, self.n_buckets) for name in unique_names)))
+        bucket_ids = nodes_with_embeddings[embedding_field].map(name2bucket)
+        nodes_with_embeddings = nodes_with_embeddings.assign(bucket_id=bucket_ids)
 
-        assert len(nodes_with_embeddings) == len(self.node_info)
-
-        self.node_info_global = dict(zip(
-            nodes_with_embeddings['global_graph_id'],
-            type_name
-        ))
+        self._create_lookup_tables(nodes, nodes_with_embeddings, "bucket_id", pad_value=self.n_buckets)
 
         if pretrained is None:
             self._create_buckets()
         else:
             self._create_buckets_from_pretrained(pretrained)
 
+    def _create_lookup_tables(self, nodes, nodes_with_embeddings, value_column, pad_value):
+        """
+        Create tensors that map typed ids of every node type, and global ids, to values from `value_column`. Nodes
+        that are not in `nodes_with_embeddings` are mapped to `pad_value`. Tables are stored as buffers so that they
+        are moved to the same device as embeddings, but they are not stored in checkpoints.
+        """
+        def create_table(size, ids, values):
+            table = torch.full((size,), pad_value, dtype=torch.long)
+            table[torch.from_numpy(np.asarray(ids, dtype=np.int64))] = torch.from_numpy(np.asarray(values, dtype=np.int64))
+            return table
+
+        embeddable_by_type = dict(tuple(nodes_with_embeddings.groupby("type", observed=True)))
+
+        self.lookup_table_names = {}
+        for ind, (node_type, typed_ids) in enumerate(nodes.groupby("type", observed=True)["typed_id"]):
+            type_nodes = embeddable_by_type.get(node_type, nodes_with_embeddings.iloc[:0])
+            table_name = f"lookup_table_{ind}"
+            self.register_buffer(
+                table_name,
+                create_table(int(typed_ids.max()) + 1, type_nodes["typed_id"].values, type_nodes[value_column].values),
+                persistent=False
+            )
+            self.lookup_table_names[node_type] = table_name
+
+        self.register_buffer(
+            "global_lookup_table",
+            create_table(
+                int(nodes["global_graph_id"].max()) + 1, nodes_with_embeddings["global_graph_id"].values,
+                nodes_with_embeddings[value_column].values
+            ),
+            persistent=False
+        )
+
+    def _get_lookup_table(self, node_type):
+        if node_type is None:
+            return self.global_lookup_table
+        return getattr(self, self.lookup_table_names[node_type])
+
     def _create_buckets(self):
         self.buckets = nn.Embedding(self.n_buckets + 1, self.emb_size, padding_idx=self.n_buckets, sparse=True)
 
@@ -50,52 +85,53 @@ class NodeEmbedder(nn.Module):
 
         assert pretrained.shape[1] == self.emb_size
 
-        import numpy as np
-
         weights_with_pad = torch.tensor(np.vstack([pretrained, np.zeros((1, self.emb_size), dtype=np.float32)]))
 
         self.buckets = nn.Embedding.from_pretrained(weights_with_pad, freeze=False, padding_idx=self.n_buckets, sparse=True)
 
-    def _get_embedding_from_node_info(self, keys, node_info, masked=None):
-        idxs = []
-
+    @staticmethod
+    def _get_masked_ids(node_type, masked):
+        """
+        Select masked ids for the current node type. Masks are dictionaries with node types as keys, or collections
+        of (node_type, id) pairs. For global ids the mask is a collection of global ids.
+        """
         if isinstance(masked, dict):
-            new_masked = set()
-            for ntype, nids in masked.items():
-                for nid in nids:
-                    new_masked.add((ntype, nid))
-            masked = new_masked
-
-        for key in keys:
-            if key not in node_info or masked is not None and key in masked:
-            # if key in node_info and key not in masked:
-                idxs.append(self.n_buckets)
-            else:
-                real_type, name = node_info[key]
-                idxs.append(token_hasher(name, self.n_buckets))
-
-        return self.buckets(torch.LongTensor(idxs))
+            if node_type is None:
+                return []
+            masked_ids = masked.get(node_type, [])
+        elif node_type is None:
+            masked_ids = masked
+        else:
+            masked_ids = [nid for ntype, nid in masked if ntype == node_type]
+        if isinstance(masked_ids, torch.Tensor):
+            return masked_ids
+        return list(masked_ids)
 
-    def _get_embeddings_with_type(self, node_type, ids, masked=None):
-        type_ids = ((node_type, id_) for id_ in ids)
-        return self._get_embedding_from_node_info(type_ids, self.node_info, masked=masked)
+    def _apply_mask(self, bucket_ids, node_ids, node_type, masked):
+        masked_ids = self._get_masked_ids(node_type, masked)
+        if len(masked_ids) == 0:
+            return bucket_ids
 
-    def _get_embeddings_global(self, ids, masked=None):
-        return self._get_embedding_from_node_info(ids, self.node_info_global, masked=masked)
+        masked_ids, _ = torch.sort(torch.as_tensor(masked_ids, dtype=torch.long, device=node_ids.device))
+        positions = torch.searchsorted(masked_ids, node_ids).clamp(max=len(masked_ids) - 1)
+        is_masked = masked_ids[positions] == node_ids
+        return bucket_ids.masked_fill(is_masked, self.n_buckets)
 
     def get_embeddings(self, node_type=None, node_ids=None, masked=None):
         assert node_ids is not None
-        if node_type is None:
-            return self._get_embeddings_global(node_ids, masked=masked)
-        else:
-            return self._get_embeddings_with_type(node_type, node_ids, masked=masked)
+        lookup_table = self._get_lookup_table(node_type)
+        node_ids = torch.as_tensor(node_ids, dtype=torch.long).to(lookup_table.device)
+        bucket_ids = lookup_table[node_ids]
+        if masked is not None:
+            bucket_ids = self._apply_mask(bucket_ids, node_ids, node_type, masked)
+        return self.buckets(bucket_ids)
 
     def forward(self, node_type=None, node_ids=None, train_embeddings=True, masked=None):
         if train_embeddings:
-            return self.get_embeddings(node_type, node_ids.tolist(), masked=masked)
+            return self.get_embeddings(node_type, node_ids, masked=masked)
         else:
             with torch.set_grad_enabled(False):
-                return self.get_embeddings(node_type, node_ids.tolist(), masked=masked)
+                return self.get_embeddings(node_type, node_ids, masked=masked)
 
 
 class NodeIdEmbedder(NodeEmbedder):
@@ -117,21 +153,18 @@ class NodeIdEmbedder(NodeEmbedder):
             ['global_graph_id', 'typed_id', 'type', 'type_backup', embedding_field]
         ]
 
-        self.to_global_map = {}
-        for global_graph_id, typed_id, type_, type_backup, name in nodes_with_embeddings.values:
-            if type_ not in self.to_global_map:
-                self.to_global_map[type_] = {}
-
-            self.to_global_map[type_][typed_id] = global_graph_id
+        self._create_lookup_tables(nodes, nodes_with_embeddings, "global_graph_id", pad_value=self.n_buckets)
 
         self._create_buckets()
 
     def get_embeddings(self, node_type=None, node_ids=None, masked=None):
         assert node_ids is not None
+        node_ids = torch.as_tensor(node_ids, dtype=torch.long)
         if node_type is not None:
-            node_ids = list(map(lambda local_id: self.to_global_map[node_type][local_id], node_ids))
+            lookup_table = self._get_lookup_table(node_type)
+            node_ids = lookup_table[node_ids.to(lookup_table.device)]
 
-        return self.buckets(torch.LongTensor(node_ids))
+        return self.buckets(node_ids.to(self.buckets.weight.device))
 
 
 # class SimpleNodeEmbedder(nn.Module):
@@ -1,4 +1,8 @@
 """RGCN layer implementation"""
+import os
+from os.path import join
+
+import numpy as np
 import torch
 import torch as th
 import torch.nn as nn
@@ -347,12 +351,54 @@ class RGCNSampling(nn.Module):
         else:
             return h
 
-    def inference(self, batch_size, device, num_workers, x=None):
-        """Minibatch inference of final representation over all node types.
+    def _create_layer_output(self, layer_id, output_path=None, dtype="float32"):
+        """
+        Create storage for outputs of the layer. Outputs are kept in memory, or written to files in `output_path`.
+        Outputs of the last layer are stored in a single file `embeddings.npy`, where node types follow each other
+        in the order of `g.ntypes`, the same way as global graph ids.
+        """
+        dim = self.h_dim if layer_id != len(self.layers) - 1 else self.out_dim
+        if output_path is None:
+            return {k: th.zeros(self.g.number_of_nodes(k), dim) for k in self.g.ntypes}
+
+        if layer_id != len(self.layers) - 1:
+            return {
+                k: np.lib.format.open_memmap(
+                    join(output_path, f"layer_{layer_id}_{k}.npy"), mode="w+", dtype=dtype,
+                    shape=(self.g.number_of_nodes(k), dim)
+                ) for k in self.g.ntypes
+            }
+
+        embeddings = np.lib.format.open_memmap(
+            join(output_path, "embeddings.npy"), mode="w+", dtype=dtype,
+            shape=(sum(self.g.number_of_nodes(k) for k in self.g.ntypes), dim)
+        )
+        y = {}
+        offset = 0
+        for k in self.g.ntypes:
+            y[k] = embeddings[offset: offset + self.g.number_of_nodes(k)]
+            offset += self.g.number_of_nodes(k)
+        return y
+
+    @staticmethod
+    def _gather(source, ids):
+        if isinstance(source, np.ndarray):
+            return th.from_numpy(np.asarray(source[ids.numpy()], dtype=np.float32))
+        return source[ids]
+
+    def inference(self, batch_size, device, num_workers, x=None, output_path=None, dtype="float32"):
+        """Minibatch inference of final representation over all node types. Every layer is computed for all nodes
+        before the next layer. When `output_path` is given, inputs and outputs of layers can be memory mapped arrays,
+        and outputs of every layer are written to files in `output_path`, so that embeddings of large graphs do not
+        need to fit into memory. Files of intermediate layers are removed once the next layer is computed.
 
         ***NOTE***
         For node classification, the model is trained to predict on only one node type's
         label.  Therefore, only that type's final representation is meaningful.
+        :param x: dictionary with input embeddings for every node type, tensors or arrays indexed with typed ids
+        :param output_path: directory for memory mapped outputs of layers
+        :param dtype: data type of memory mapped outputs
+        :return: dictionary with outputs of the last layer for every node type
         """
         h0 = x
 
@@ -362,11 +408,7 @@ class RGCNSampling(nn.Module):
             #     x = self.embed_layer()
 
             for l, (layer, norm) in enumerate(zip(self.layers, self.layer_norm)):
-                y = {
-                    k: th.zeros(
-                        self.g.number_of_nodes(k),
-                        self.h_dim if l != len(self.layers) - 1 else self.out_dim)
-                    for k in self.g.ntypes}
+                y = self._create_layer_output(l, output_path, dtype)
 
                 sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
                 dataloader = dgl.dataloading.NodeDataLoader(
@@ -374,7 +416,7 @@ class RGCNSampling(nn.Module):
                     {k: th.arange(self.g.number_of_nodes(k)) for k in self.g.ntypes},
                     sampler,
                     batch_size=batch_size,
-                    shuffle=True,
+                    shuffle=False,  # consecutive outputs are written to consecutive rows
                     drop_last=False,
                     num_workers=num_workers)
 
@@ -386,13 +428,23 @@ class RGCNSampling(nn.Module):
                         input_nodes = {key: input_nodes}
                         output_nodes = {key: output_nodes}
 
-                    _h0 = {k: h0[k][input_nodes[k]].to(device) for k in input_nodes.keys()}
-                    h = {k: x[k][input_nodes[k]].to(device) for k in input_nodes.keys()}
+                    _h0 = {k: self._gather(h0[k], input_nodes[k]).to(device) for k in input_nodes.keys()}
+                    h = {k: self._gather(x[k], input_nodes[k]).to(device) for k in input_nodes.keys()}
                     h = layer(block, h, _h0)
                     h = self.normalize(h, norm)
 
                     for k in h.keys():
-                        y[k][output_nodes[k]] = h[k].cpu()
+                        if output_path is None:
+                            y[k][output_nodes[k]] = h[k].cpu()
+                        else:
+                            y[k][output_nodes[k].numpy()] = h[k].cpu().numpy()
+
+                if output_path is not None:
+                    for k in y:
+                        y[k].flush()
+                    if l > 0:
+                        for k in x:
+                            os.remove(x[k].filename)
 
                 x = y
             return y
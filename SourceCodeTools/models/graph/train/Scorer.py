@@ -1,15 +1,16 @@
-import random
 import time
-from collections import Iterable, defaultdict
+from collections import defaultdict
+from collections.abc import Iterable
 from typing import Dict, List
 
 import torch
 import numpy as np
-from sklearn.metrics import ndcg_score, top_k_accuracy_score
 from sklearn.neighbors import NearestNeighbors
 from sklearn.neighbors._ball_tree import BallTree
 from sklearn.preprocessing import normalize
 
+from SourceCodeTools.models.negative_sampling import AliasSampler, GroupedSampler
+
 
 class FaissIndex:
     def __init__(self, X, method="inner_prod", *args, **kwargs):
@@ -40,36 +41,140 @@ class FaissIndex:
 
 
 class Brute:
-    def __init__(self, X, method="inner_prod", device="cpu", *args, **kwargs):
-        self.vectors = X
+    """
+    Exact nearest neighbour search. Vectors are uploaded to the device once, and are updated in place when only
+    some of the embeddings change. Queries are processed in batches with one matrix multiplication per batch.
+    """
+    def __init__(self, X, method="inner_prod", device="cpu", query_batch_size=1024, *args, **kwargs):
+        self.source = X
         self.method = method
         self.device = device
+        self.query_batch_size = query_batch_size
+        self.vectors = torch.tensor(X, dtype=torch.float32, device=self.device)
+
+    def update(self, positions, X):
+        """
+        Replace vectors at given positions.
+        """
+        positions = torch.LongTensor(positions).to(self.device)
+        self.vectors[positions] = torch.tensor(X, dtype=torch.float32, device=self.device)
 
     def query_inner_prod(self, X, k):
-        X = torch.Tensor(normalize(X, axis=1)).to(self.device)
-        vectors = torch.Tensor(self.vectors).to(self.device)
-        score = (vectors @ X.T).reshape(-1,).to("cpu").numpy()
-        ind = np.flip(np.argsort(score))[:k]
-        return score[ind][:k], ind
+        X = torch.tensor(normalize(X, axis=1), dtype=torch.float32, device=self.device)
+        return torch.topk(X @ self.vectors.T, k=k, dim=1)
 
     def query_l2(self, X, k):
-        vectors = torch.Tensor(self.vectors).to(self.device)
-        X = torch.Tensor(X).to(self.device)
-        score = torch.norm(vectors - X, dim=-1).to("cpu").numpy()
-        # score = np.linalg.norm(vectors - X).reshape(-1,)
-        ind = np.argsort(score)[:k]
-        return score[ind][:k], ind
+        X = torch.tensor(X, dtype=torch.float32, device=self.device)
+        return torch.topk(torch.cdist(X, self.vectors), k=k, dim=1, largest=False)
 
     def query(self, X, k):
-        assert X.shape[0] == 1
         if self.method == "inner_prod":
-            dist, ind = self.query_inner_prod(X, k)
+            query_fn = self.query_inner_prod
         elif self.method == "l2":
-            dist, ind = self.query_l2(X, k)
+            query_fn = self.query_l2
         else:
             raise NotImplementedError()
 
-        return dist, ind#.reshape((-1,1))
+        k = min(k, self.vectors.shape[0])
+
+        dist = []
+        ind = []
+        with torch.set_grad_enabled(False):
+            for i in range(0, X.shape[0], self.query_batch_size):
+                batch_dist, batch_ind = query_fn(X[i: i + self.query_batch_size], k)
+                dist.append(batch_dist.cpu().numpy())
+                ind.append(batch_ind.cpu().numpy())
+
+        return np.concatenate(dist), np.concatenate(ind)
+
+
+class RankingMetrics:
+    """
+    Accumulates ranking metrics over chunks of queries. Only ranks of positive candidates are computed from the score
+    matrix, dense label matrices are never created. Ties are resolved in the order of candidates for hits, ranks and
+    average precision, and are averaged for NDCG the same way as in `sklearn.metrics.ndcg_score`.
+    """
+    def __init__(self, at):
+        self.at = at
+        self.max_k = max(at)
+        # cumulative discount, element i is the DCG of i relevant items at the top of the ranking
+        self.discount_cumsum = np.concatenate([[0.], np.cumsum(1. / np.log2(np.arange(self.max_k) + 2))])
+
+        self.num_queries = 0
+        self.hits = {k: 0. for k in at}
+        self.ndcg = {k: 0. for k in at}
+        self.first_ranks = []
+        self.average_precision = 0.
+
+    def _discounted(self, num_items, k):
+        return self.discount_cumsum[np.minimum(num_items, k)]
+
+    def add(self, scores, query_ids, positions):
+        """
+        :param scores: tensor with scores of all candidates for a chunk of queries
+        :param query_ids: array with the row in `scores` for every positive candidate, sorted
+        :param positions: array with the column in `scores` for every positive candidate
+        """
+        num_queries, num_candidates = scores.shape
+        self.num_queries += num_queries
+        if len(query_ids) == 0:
+            return
+
+        device = scores.device
+        query_ids_ = torch.LongTensor(query_ids).to(device)
+        positions_ = torch.LongTensor(positions).to(device)
+
+        query_scores = scores[query_ids_]
+        positive_scores = query_scores.gather(1, positions_.unsqueeze(1))
+        num_greater = (query_scores > positive_scores).sum(1)
+        is_equal = query_scores == positive_scores
+        num_equal = is_equal.sum(1)
+        num_equal_before = (is_equal & (torch.arange(num_candidates, device=device) < positions_.unsqueeze(1))).sum(1)
+
+        num_greater = num_greater.cpu().numpy()
+        num_equal = num_equal.cpu().numpy()
+        ranks = num_greater + num_equal_before.cpu().numpy() + 1
+
+        order = np.lexsort((ranks, query_ids))
+        query_ids, ranks, num_greater, num_equal = \
+            query_ids[order], ranks[order], num_greater[order], num_equal[order]
+
+        num_positive = np.bincount(query_ids, minlength=num_queries)
+        has_positive = num_positive > 0
+        first_positive = np.cumsum(num_positive) - num_positive
+        positive_order = np.arange(len(query_ids)) - np.repeat(first_positive, num_positive)
+
+        for k in self.at:
+            hits = np.bincount(query_ids, weights=ranks <= k, minlength=num_queries)
+            self.hits[k] += (hits[has_positive] / np.minimum(num_positive[has_positive], k)).sum()
+
+            # positive candidate gets the average discount of positions occupied by candidates with equal scores
+            gain = (self._discounted(num_greater + num_equal, k) - self._discounted(num_greater, k)) / num_equal
+            dcg = np.bincount(query_ids, weights=gain, minlength=num_queries)
+            self.ndcg[k] += (dcg[has_positive] / self._discounted(num_positive[has_positive], k)).sum()
+
+        self.first_ranks.append(ranks[first_positive[has_positive]])
+        precision = np.bincount(query_ids, weights=(positive_order + 1) / ranks, minlength=num_queries)
+        self.average_precision += (precision[has_positive] / num_positive[has_positive]).sum()
+
+    def compute(self):
+        """
+        :return: dictionary with metrics averaged over queries. Queries without positive candidates count as misses.
+            Metrics are NaN when there were no queries, mean rank and MRR are NaN when there were no positive
+            candidates.
+        """
+        def average(value, count):
+            return float(value / count) if count > 0 else float("nan")
+
+        scores = {}
+        scores.update({f"hits@{k}": average(self.hits[k], self.num_queries) for k in self.at})
+        scores.update({f"ndcg@{k}": average(self.ndcg[k], self.num_queries) for k in self.at})
+
+        first_ranks = np.concatenate(self.first_ranks) if len(self.first_ranks) > 0 else np.zeros(0)
+        scores["mr"] = average(first_ranks.sum(), len(first_ranks))
+        scores["mrr"] = average((1. / first_ranks).sum(), len(first_ranks))
+        scores["map"] = average(self.average_precision, self.num_queries)
+        return scores
 
 
 class Scorer:
@@ -78,6 +183,10 @@ class Scorer:
     similarity. It becomes less useful when the decision is made by neural network because it does not need to mode
     points to learn how to make correct decisions.
     """
+    # maximum number of query and candidate pairs scored at once by a link predictor, with 100-dimensional embeddings
+    # the broadcast path of `score_candidates_lp` materializes about 50Mb of pair embeddings
+    scorer_max_pairs = 2 ** 16
+
     def __init__(
             self, num_embs, emb_size, src2dst: Dict[int, List[int]], neighbours_to_sample=5, index_backend="brute",
             method = "inner_prod", device="cpu", ns_groups=None
@@ -101,8 +210,10 @@ class Scorer:
 
         self.scorer_all_emb = normalize(np.ones((num_embs, emb_size)), axis=1)  # unique dst embedding table
         self.scorer_all_keys = self.get_cand_to_score_against(None)
+        self.scorer_all_keys_array = np.array(self.scorer_all_keys)
         self.scorer_key_order = dict(zip(self.scorer_all_keys, range(len(self.scorer_all_keys))))
         self.scorer_index = None
+        self.scorer_updated_positions = []  # positions of embeddings changed after the index was prepared
         self.neighbours_to_sample = min(neighbours_to_sample, self.scorer_num_emb)
         self.prepare_ns_groups(ns_groups)
 
@@ -128,24 +239,15 @@ class Scorer:
             if id_ in unique_dst:
                 self.scorer_ns_group2nodes[mentioned_in_].append(id_)
 
-    def sample_negative_from_groups(self, key_groups, k):
-        possible_targets = []
-        for key_group in key_groups:
-            any_key = key_group[0]
-            possible_negative = self.scorer_ns_group2nodes[self.scorer_node2ns_group[any_key]]
-            possible_negative_ = list(set(possible_negative) - set(key_group))
-            if len(possible_negative_) < k:
-                # backup strategy
-                possible_negative_.extend(
-                    random.choices(list(set(self.scorer_all_keys) - set(key_group)), k=k - len(possible_negative_))
-                )
-            possible_targets.append(possible_negative_)
-        return possible_targets
+        self.scorer_ns_sampler = GroupedSampler(
+            self.scorer_ns_group2nodes, fallback=AliasSampler(self.scorer_all_keys_array)
+        )
 
 
     def prepare_index(self, override_strategy=None):
         if self.scorer_method == "nn":
             self.scorer_index = None
+            self.scorer_updated_positions = []
             return
         if self.scorer_index_backend == "sklearn":
             self.scorer_index = NearestNeighbors()
@@ -155,9 +257,16 @@ class Scorer:
         elif self.scorer_index_backend == "faiss":
             self.scorer_index = FaissIndex(self.scorer_all_emb, method=self.scorer_method)
         elif self.scorer_index_backend == "brute":
-            self.scorer_index = Brute(self.scorer_all_emb, method=self.scorer_method, device=self.scorer_device)
+            if isinstance(self.scorer_index, Brute) and self.scorer_index.source is self.scorer_all_emb:
+                # embedding table was updated in place, only changed vectors are uploaded
+                if len(self.scorer_updated_positions) > 0:
+                    positions = np.unique(np.concatenate(self.scorer_updated_positions))
+                    self.scorer_index.update(positions, self.scorer_all_emb[positions])
+            else:
+                self.scorer_index = Brute(self.scorer_all_emb, method=self.scorer_method, device=self.scorer_device)
         else:
             raise ValueError(f"Unsupported backend: {self.scorer_index_backend}. Supported backends are: sklearn|faiss")
+        self.scorer_updated_positions = []
 
     def sample_closest_negative(self, ids, k=None):
         if k is None:
@@ -174,37 +283,70 @@ class Scorer:
                 seed_pool[-1] = seed_pool[-1] + [id]  # make sure that original list is not changed
         # [seed_pool.append(self.scorer_src2dst[id]) for id in ids]
         if hasattr(self, "scorer_ns_group2nodes"):
-            nested_negative = self.sample_negative_from_groups(seed_pool, k=k+1)
+            # groups with less than k + 1 candidates are complemented with random keys
+            groups = [self.scorer_node2ns_group[key_group[0]] for key_group in seed_pool]
+            return self.scorer_ns_sampler.sample(groups, seed_pool, k=k, min_candidates=k + 1).reshape(-1).tolist()
+
+        group_ids, candidates = self.get_closest_candidates(seed_pool, k=k+1)
+        return self.sample_from_candidates(seed_pool, group_ids, candidates, k=k)
+
+    def get_closest_candidates(self, key_groups, k=None):
+        """
+        Find closest neighbours for all keys from all groups with a single index query. Neighbours that belong to the
+        same group as the query key are excluded, since they are positive examples.
+        :param key_groups: list of lists with keys
+        :param k: number of neighbours for every key
+        :return: arrays of group ids and positions of candidate keys in `scorer_all_keys`, every candidate appears
+            once per group, pairs are sorted by group id
+        """
+        group_sizes = np.fromiter(map(len, key_groups), dtype=np.int64, count=len(key_groups))
+        key_group_ids = np.repeat(np.arange(len(key_groups)), group_sizes)
+        key_positions = np.fromiter(
+            (self.scorer_key_order[key] for key_group in key_groups for key in key_group),
+            dtype=np.int64, count=group_sizes.sum()
+        )
+        if len(key_positions) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        _, closest = self.scorer_index.query(self.scorer_all_emb[key_positions], k=k)
+        closest = np.asarray(closest, dtype=np.int64).reshape(len(key_positions), -1)
+
+        # pairs of group id and key position are packed into a single integer for set operations
+        num_keys = len(self.scorer_all_keys)
+        candidate_pairs = np.repeat(key_group_ids, closest.shape[1]) * num_keys + closest.ravel()
+        positive_pairs = key_group_ids * num_keys + key_positions
+        # faiss returns -1 when there are not enough neighbours
+        is_valid = (closest.ravel() >= 0) & ~np.isin(candidate_pairs, positive_pairs)
+        candidate_pairs = np.unique(candidate_pairs[is_valid])
+        return candidate_pairs // num_keys, candidate_pairs % num_keys
+
+    def sample_from_candidates(self, key_groups, group_ids, candidates, k):
+        """
+        Sample `k` negative keys for every group uniformly from its candidates. Groups without candidates get random
+        keys that are not in the group.
+        :return: list of sampled keys, `k` keys for every group in the order of groups
+        """
+        num_groups = len(key_groups)
+        counts = np.bincount(group_ids, minlength=num_groups)
+        offsets = np.cumsum(counts) - counts
+
+        if len(candidates) > 0:
+            sampled = offsets[:, None] + (np.random.random((num_groups, k)) * counts[:, None]).astype(np.int64)
+            sampled = candidates[np.minimum(sampled, len(candidates) - 1)]
         else:
-            nested_negative = self.get_closest_to_keys(seed_pool, k=k+1)
-
-        negative = []
-        for neg in nested_negative:
-            negative.extend(random.choices(neg, k=k))
-        return negative
-
-    def get_closest_to_keys(self, key_groups, k=None):
-        possible_targets = []
-        for key_group in key_groups:
-            closest_keys = []
-            for key in key_group:
-                _, closest = self.scorer_index.query(
-                    self.scorer_all_emb[self.scorer_key_order[key]].reshape(1, -1), k=k
-                )
-                closest_keys.extend(self.scorer_all_keys[c] for c in closest.ravel())
-            # ensure that negative samples do not come from positive edges
-            closest_keys_ = list(set(closest_keys) - set(key_group))
-            if len(closest_keys_) == 0:
-                # backup strategy
-                closest_keys_ = random.choices(list(set(self.scorer_all_keys) - set(key_group)), k=k)
-            possible_targets.append(closest_keys_)
-            # possible_targets.extend(self.scorer_all_keys[c] for c in closest.ravel())
-        return possible_targets
-        # return list(set(possible_targets) - set(keys))
+            sampled = np.zeros((num_groups, k), dtype=np.int64)
+
+        for group in np.flatnonzero(counts == 0):
+            # backup strategy
+            positives = [self.scorer_key_order[key] for key in key_groups[group]]
+            sampled[group] = np.random.choice(np.setdiff1d(np.arange(len(self.scorer_all_keys)), positives), size=k)
+
+        return self.scorer_all_keys_array[sampled.ravel()].tolist()
 
     def set_embed(self, ids, embs):
 
         ids = np.array(list(map(self.scorer_key_order.get, ids.tolist())))
+        self.scorer_updated_positions.append(ids)
         self.scorer_all_emb[ids, :] = normalize(embs, axis=1) if self.scorer_method == "inner_prod" else embs
 
         # for ind, id in enumerate(ids):
@@ -219,71 +361,79 @@ class Scorer:
         score_matr = (score_matr + 1.) / 2.
         # score_matr = score_matr - self.margin
         # score_matr[score_matr < 0.] = 0.
-        y_pred = score_matr.cpu().tolist()
-
-        return y_pred
+        return score_matr
 
     def set_margin(self, margin):
         self.margin = margin
 
+    def set_max_pairs(self, max_pairs):
+        self.scorer_max_pairs = max_pairs
+
     def score_candidates_l2(self, to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, at=None):
 
-        y_pred = []
-        for i in range(len(to_score_ids)):
-            input_embs = to_score_embs[i, :].reshape(1, -1)
-            score_matr = torch.norm(embs_to_score_against - input_embs, dim=-1)
-            score_matr = 1. / (1. + score_matr)
-            # score_matr = score_matr + self.margin
-            # score_matr[score_matr < 0.] = 0
-            y_pred.append(score_matr.cpu().tolist())
-
-        # embs_to_score_against = embs_to_score_against.unsqueeze(0)
-        # to_score_embs = to_score_embs.unsqueeze(1)
-        #
-        # score_matr = -torch.norm(embs_to_score_against - to_score_embs, dim=-1)
+        score_matr = torch.cdist(
+            to_score_embs, embs_to_score_against, compute_mode="donot_use_mm_for_euclid_dist"
+        )
+        score_matr = 1. / (1. + score_matr)
         # score_matr = score_matr + self.margin
         # score_matr[score_matr < 0.] = 0
-        # y_pred = score_matr.cpu().tolist()
-
-        return y_pred
+        return score_matr
 
     def score_candidates_lp(
             self, to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, link_predictor, at=None,
-            with_types=None
+            with_types=None, projection_cache=None, max_pairs=None
     ):
+        """
+        Score all candidates for a batch of queries with a link predictor.
+        :param with_types: list with edge type for every row of `to_score_embs`, or None if link predictor does not
+            use types
+        :param projection_cache: dictionary where projections of candidates for every relation are stored between
+            calls, should be reset when candidate embeddings change
+        :param max_pairs: maximum number of query and candidate pairs evaluated in a single forward pass. Without
+            `forward_pairwise`, both embeddings of every pair are materialized on the device. Defaults to the value
+            set with `set_max_pairs`
+        """
+
+        if max_pairs is None:
+            max_pairs = self.scorer_max_pairs
 
         if with_types is None:
+            num_queries = to_score_embs.shape[0]
+            candidate_block = max(1, max_pairs // num_queries)
+
             y_pred = []
-            for i in range(len(to_score_ids)):
-                input_embs = to_score_embs[i, :].repeat((embs_to_score_against.shape[0], 1))
-                # predictor_input = torch.cat([input_embs, all_emb], dim=1)
-                y_pred.append(
-                    torch.nn.functional.softmax(link_predictor(input_embs, embs_to_score_against), dim=1)[:, 1].tolist()
-                )  # 0 - negative, 1 - positive
+            for start in range(0, embs_to_score_against.shape[0], candidate_block):
+                candidates = embs_to_score_against[start: start + candidate_block]
+                if hasattr(link_predictor, "forward_pairwise"):
+                    logits = link_predictor.forward_pairwise(to_score_embs, candidates)
+                else:
+                    logits = link_predictor(
+                        to_score_embs.repeat_interleave(candidates.shape[0], dim=0),
+                        candidates.repeat((num_queries, 1))
+                    ).reshape((num_queries, candidates.shape[0], -1))
+                y_pred.append(torch.nn.functional.softmax(logits, dim=-1)[..., 1])  # 0 - negative, 1 - positive
 
-            return y_pred
+            return torch.cat(y_pred, dim=1)
 
         else:
-            y_pred = []
-            for i in range(len(to_score_ids)):
-                y_pred.append(dict())
-                for type in with_types[i]:
-                    input_embs = to_score_embs[i, :].unsqueeze(0)
-                    # predictor_input = torch.cat([input_embs, all_emb], dim=1)
-
-                    labels = torch.LongTensor([type]).to(link_predictor.proj_matr.weight.device)
-                    weights = link_predictor.proj_matr(labels).reshape((-1, link_predictor.rel_dim, link_predictor.input_dim))
-                    rels = link_predictor.rel_emb(labels)
-                    m_a = (weights * input_embs.unsqueeze(1)).sum(-1)
-                    m_s = (weights * embs_to_score_against.unsqueeze(1)).sum(-1)
-
-                    transl = m_a + rels
-                    sim = torch.norm(transl - m_s, dim=-1)
-                    sim = 1./ (1. + sim)
-                    y_pred[-1][type] = sim.cpu().tolist()
+            if projection_cache is None:
+                projection_cache = {}
 
-            return y_pred
+            y_pred = torch.empty(
+                (to_score_embs.shape[0], embs_to_score_against.shape[0]), device=to_score_embs.device
+            )
+            with_types = np.array(with_types)
+            for type in np.unique(with_types):
+                rows = torch.LongTensor(np.flatnonzero(with_types == type)).to(to_score_embs.device)
+                weights, rels = link_predictor.get_projection(int(type))
+                if type not in projection_cache:
+                    projection_cache[type] = embs_to_score_against @ weights.t()
+
+                transl = to_score_embs[rows] @ weights.t() + rels
+                sim = torch.cdist(transl, projection_cache[type], compute_mode="donot_use_mm_for_euclid_dist")
+                y_pred[rows] = 1. / (1. + sim)
 
+            return y_pred
 
     def get_gt_candidates(self, ids):
         candidates = [set(list(self.scorer_src2dst[id])) for id in ids]
@@ -320,94 +470,57 @@ class Scorer:
     def get_keys_for_scoring(self):
         return self.scorer_all_keys
 
-    def hits_at_k(self, y_true, y_pred, k):
-        correct = y_true
-        predicted = y_pred
-        result = []
-        for y_true, y_pred in zip(correct, predicted):
-            ind_true = set([ind for ind, y_t in enumerate(y_true) if y_t == 1.])
-            ind_pred = set(list(np.flip(np.argsort(y_pred))[:k]))
-            result.append(len(ind_pred.intersection(ind_true)) / min(len(ind_true), k))
-
-        return sum(result) / len(result)
-
-    def mean_rank(self, y_true, y_pred):
-        true_ranks = []
-        reciprocal_ranks = []
-
-        correct = y_true
-        predicted = y_pred
-        for y_true, y_pred in zip(correct, predicted):
-            ranks = sorted(zip(y_true, y_pred), key=lambda x: x[1], reverse=True)
-            for ind, (true, pred) in enumerate(ranks):
-                if true > 0.:
-                    true_ranks.append(ind + 1)
-                    reciprocal_ranks.append(1 / (ind + 1))
-                    break  # should consider only first result https://en.wikipedia.org/wiki/Mean_reciprocal_rank
-
-        return sum(true_ranks) / len(true_ranks), sum(reciprocal_ranks) / len(reciprocal_ranks)
-
-    def mean_average_precision(self, y_true, y_pred):
-        correct = y_true
-        predicted = y_pred
-        map = 0.
-        for y_true, y_pred in zip(correct, predicted):
-            ranks = sorted(zip(y_true, y_pred), key=lambda x: x[1], reverse=True)
-            found_relevant = 0
-            avep = 0.
-            for ind, (true, pred) in enumerate(ranks):
-                if true > 0.:
-                    found_relevant += 1
-                    avep += found_relevant / (ind + 1)  # precision@k
-            avep /= found_relevant
-
-            map += avep
-
-        map /= len(correct)
-
-        return map
-
-    def get_y_true_from_candidate_list(self, candidates, keys_to_score_against):
-        y_true = [[1. if key in cand else 0. for key in keys_to_score_against] for cand in candidates]
-        return y_true
-
-    def get_y_true_from_candidates(self, candidates, keys_to_score_against):
-
+    def get_positive_positions(self, candidates):
+        """
+        Create ranking queries from positive candidates. Without types, every id is a query. With types, every
+        combination of id and edge type is a query.
+        :param candidates: list of sets with positive candidates for every id
+        :return: row in `to_score_embs` for every query, edge type for every query (None without types), and two
+            arrays with query index and position in `scorer_all_keys` for every positive candidate
+        """
         has_types = isinstance(list(candidates[0])[0], tuple)
 
-        if not has_types:
-            return self.get_y_true_from_candidate_list(candidates, keys_to_score_against)
-
-        candidate_dicts = []
-        for cand in candidates:
-            candidate_dicts.append(dict())
-            for ent, type in cand:
-                if type not in candidate_dicts[-1]:
-                    candidate_dicts[-1][type] = []
-                candidate_dicts[-1][type].append(ent)
-
-        y_true = []
-        for cand in candidate_dicts:
-            y_true.append(dict())
-            for type, ents in cand.items():
-                y_true[-1][type] = [1. if key in ents else 0. for key in keys_to_score_against]
-                assert sum(y_true[-1][type]) > 0.
-
-        return y_true
-
-    def flatten_pred(self, y):
-
-        flattened = []
-        for x in y:
-            for key, scores in x.items():
-                flattened.append(scores)
-
-        return flattened
-
-    def score_candidates(self, to_score_ids, to_score_embs, link_predictor=None, at=None, type=None, device="cpu"):
+        query_rows = []
+        query_types = [] if has_types else None
+        positive_queries = []
+        positive_positions = []
+
+        def add_query(row, positives):
+            positions = [self.scorer_key_order[key] for key in positives if key in self.scorer_key_order]
+            positive_queries.extend([len(query_rows)] * len(positions))
+            positive_positions.extend(positions)
+            query_rows.append(row)
+
+        for row, cand in enumerate(candidates):
+            if has_types:
+                cand_by_type = defaultdict(list)
+                for ent, type in cand:
+                    cand_by_type[type].append(ent)
+                for type, ents in cand_by_type.items():
+                    query_types.append(type)
+                    add_query(row, ents)
+            else:
+                add_query(row, cand)
+
+        return query_rows, query_types, np.array(positive_queries, dtype=np.int64), \
+               np.array(positive_positions, dtype=np.int64)
+
+    def score_candidates(
+            self, to_score_ids, to_score_embs, link_predictor=None, at=None, type=None, device="cpu", chunk_size=128,
+            max_pairs=None
+    ):
+        """
+        Rank all candidate keys for every id and compute ranking metrics. Scores are computed on the device of
+        `to_score_embs` for chunks of queries, and only ranks of positive candidates are collected.
+        :param chunk_size: number of queries scored at once
+        :param max_pairs: maximum number of query and candidate pairs evaluated in a single forward pass of a link
+            predictor, see `score_candidates_lp`
+        """
 
         if at is None:
             at = [1, 3, 5, 10]
+        if not isinstance(at, Iterable):
+            at = [at]
 
         start = time.time()
 
@@ -417,51 +530,46 @@ class Scorer:
         # keys_to_score_against = self.get_cand_to_score_against(to_score_ids)
         keys_to_score_against = self.get_keys_for_scoring()
 
-        y_true = self.get_y_true_from_candidates(candidates, keys_to_score_against)
+        query_rows, query_types, positive_queries, positive_positions = self.get_positive_positions(candidates)
 
         embs_to_score_against = self.get_embeddings_for_scoring(device=to_score_embs.device)
 
         if type == "nn":
-            has_types = isinstance(y_true[0], dict)
+            projection_cache = {}
 
-            y_pred = self.score_candidates_lp(
-                to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against,
-                link_predictor, at=at, with_types=y_true if has_types else None
-            )
+            def score_fn(rows, types):
+                return self.score_candidates_lp(
+                    rows, to_score_embs[rows], keys_to_score_against, embs_to_score_against,
+                    link_predictor, at=at, with_types=types, projection_cache=projection_cache, max_pairs=max_pairs
+                )
         elif type == "inner_prod":
-            y_pred = self.score_candidates_cosine(
-                to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, at=at
-            )
+            def score_fn(rows, types):
+                return self.score_candidates_cosine(
+                    rows, to_score_embs[rows], keys_to_score_against, embs_to_score_against, at=at
+                )
         elif type == "l2":
-            y_pred = self.score_candidates_l2(
-                to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, at=at
-            )
+            def score_fn(rows, types):
+                return self.score_candidates_l2(
+                    rows, to_score_embs[rows], keys_to_score_against, embs_to_score_against, at=at
+                )
         else:
             raise ValueError(f"`type` can be either `nn` or `inner_prod` but `{type}` given")
 
-        has_types = isinstance(y_pred[0], dict)
+        metrics = RankingMetrics(at)
+        chunk_boundaries = np.searchsorted(positive_queries, np.arange(0, len(query_rows) + chunk_size, chunk_size))
 
-        if has_types:
-            y_true = self.flatten_pred(y_true)
-            y_pred = self.flatten_pred(y_pred)
-
-        scores = {}
-        # y_true_onehot = np.array(y_true)
-        # labels=list(range(y_true_onehot.shape[1]))
+        with torch.set_grad_enabled(False):
+            for chunk_ind, chunk_start in enumerate(range(0, len(query_rows), chunk_size)):
+                chunk_end = min(chunk_start + chunk_size, len(query_rows))
+                chunk_positives = slice(chunk_boundaries[chunk_ind], chunk_boundaries[chunk_ind + 1])
+                scores = score_fn(
+                    query_rows[chunk_start: chunk_end],
+                    query_types[chunk_start: chunk_end] if query_types is not None else None
+                )
+                metrics.add(
+                    scores, positive_queries[chunk_positives] - chunk_start, positive_positions[chunk_positives]
+                )
 
-        if isinstance(at, Iterable):
-            scores.update({f"hits@{k}": self.hits_at_k(y_true, y_pred, k=k) for k in at})
-            scores.update({f"ndcg@{k}": ndcg_score(y_true, y_pred, k=k) for k in at})
-            # scores = {f"ndcg@{k}": ndcg_score(y_true, y_pred, k=k) for k in at}
-        else:
-            scores.update({f"hits@{at}": self.hits_at_k(y_true, y_pred, k=at)})
-            scores.update({f"ndcg@{at}": ndcg_score(y_true, y_pred, k=at)})
-            # scores = {f"ndcg@{at}": ndcg_score(y_true, y_pred, k=at)}
-
-        mr, mrr = self.mean_rank(y_true, y_pred)
-        map = self.mean_average_precision(y_true, y_pred)
-        scores["mr"] = mr
-        scores["mrr"] = mrr
-        scores["map"] = map
+        scores = metrics.compute()
         scores["scoring_time"] = time.time() - start
         return scores
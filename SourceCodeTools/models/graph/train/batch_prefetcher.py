@@ -0,0 +1,105 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+
+def prepare_objective_batch(objective, device, data_split="train"):
+    """
+    Get next batch of the objective, move blocks to the device and compute the parts of the input that do not depend
+    on model parameters.
+    :return: tuple with input nodes, seeds and blocks
+    """
+    input_nodes, seeds, blocks = objective.loader_next(data_split)
+    blocks = [blk.to(device) for blk in blocks]
+    objective.prefetch_mask(seeds)
+    return input_nodes, seeds, blocks
+
+
+def iterate_objective_batches(objectives, device, num_batches, data_split="train"):
+    """
+    Prepare batches of all objectives for every step sequentially.
+    """
+    for _ in range(num_batches):
+        try:
+            yield [prepare_objective_batch(objective, device, data_split) for objective in objectives]
+        except StopIteration:
+            return
+
+
+class BatchPrefetcher:
+    """
+    Prepares batches of all objectives for the following steps in a background thread, while the current step is
+    computed. Batches of different objectives are sampled concurrently. The number of prepared steps is bounded by
+    `queue_size`. Targets and negative samples are not prepared in advance because they depend on embeddings that are
+    updated at every step.
+    """
+    _end = object()
+
+    def __init__(self, objectives, device, num_batches, queue_size=2, data_split="train"):
+        """
+        :param objectives: list of objectives
+        :param device: device for blocks
+        :param num_batches: number of steps to prepare
+        :param queue_size: maximum number of prepared steps
+        """
+        self.objectives = objectives
+        self.device = device
+        self.num_batches = num_batches
+        self.data_split = data_split
+
+        self.queue = Queue(maxsize=queue_size)
+        self.stop_event = Event()
+        self.executor = ThreadPoolExecutor(max_workers=len(objectives))
+        self.thread = Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for _ in range(self.num_batches):
+                if self.stop_event.is_set():
+                    return
+                futures = [
+                    self.executor.submit(prepare_objective_batch, objective, self.device, self.data_split)
+                    for objective in self.objectives
+                ]
+                if not self._put([future.result() for future in futures]):
+                    return
+        except StopIteration:
+            pass
+        except Exception as e:
+            logging.error(f"Error while preparing batches: {e}")
+            self._put(e)
+        self._put(self._end)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = self.queue.get()
+        if item is self._end:
+            # keep the end marker for the following calls
+            self._put(self._end)
+            raise StopIteration()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self.stop_event.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        self.thread.join()
+        self.executor.shutdown(wait=True)
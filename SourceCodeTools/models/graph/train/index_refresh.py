@@ -0,0 +1,61 @@
+from time import time
+
+
+class IndexRefreshScheduler:
+    """
+    Decides when the nearest neighbour index of a target embedder is refreshed during training. The index is
+    refreshed every `refresh_interval` steps, or earlier when the staleness of stored embeddings exceeds
+    `staleness_threshold`. Staleness is estimated only for target embedders that implement `estimate_staleness`.
+    """
+    def __init__(self, refresh_interval=1, staleness_threshold=None, staleness_sample_size=256):
+        """
+        :param refresh_interval: maximum number of steps between refreshes, 1 refreshes the index before every step
+        :param staleness_threshold: mean relative change of embeddings that triggers refresh, None disables
+            staleness checks
+        :param staleness_sample_size: number of candidates used to estimate staleness
+        """
+        self.refresh_interval = max(1, refresh_interval)
+        self.staleness_threshold = staleness_threshold
+        self.staleness_sample_size = staleness_sample_size
+
+        self.steps_since_refresh = 0
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.num_refreshes = 0
+        self.refresh_time = 0.
+        self.staleness = []
+
+    def _is_stale(self, target_embedder):
+        if self.staleness_threshold is None or not hasattr(target_embedder, "estimate_staleness"):
+            return False
+        staleness = target_embedder.estimate_staleness(self.staleness_sample_size)
+        self.staleness.append(staleness)
+        return staleness >= self.staleness_threshold
+
+    def refresh(self, target_embedder):
+        start = time()
+        target_embedder.prepare_index()
+        self.refresh_time += time() - start
+        self.num_refreshes += 1
+        self.steps_since_refresh = 0
+
+    def step(self, target_embedder):
+        """
+        Called before every training step, refreshes the index when needed.
+        :return: True if the index was refreshed
+        """
+        if self.steps_since_refresh + 1 >= self.refresh_interval or self._is_stale(target_embedder):
+            self.refresh(target_embedder)
+            return True
+        self.steps_since_refresh += 1
+        return False
+
+    def get_metrics(self):
+        metrics = {
+            "IndexRefreshes": self.num_refreshes,
+            "IndexRefreshTime": self.refresh_time,
+        }
+        if len(self.staleness) > 0:
+            metrics["IndexStaleness"] = sum(self.staleness) / len(self.staleness)
+        return metrics
@@ -0,0 +1,202 @@
+import logging
+
+import dgl
+import torch
+
+
+class LayerImportanceSampler(dgl.dataloading.BlockSampler):
+    """
+    Layer-wise importance sampling in the spirit of LADIES. For every layer, a fixed number of source nodes is sampled
+    from the union of neighbourhoods of the seed nodes. Probability of a node is proportional to the squared norm of
+    its column in the row-normalized adjacency matrix restricted to the seeds, so that nodes connected to many seeds
+    are preferred. The size of blocks does not grow with the degree of nodes, and hub nodes do not bring all their
+    neighbours into the block. Messages are not re-weighted with sampling probabilities.
+    """
+    def __init__(self, layer_sizes, return_eids=False):
+        """
+        :param layer_sizes: list with the number of sampled source nodes for every layer, starting from the input layer
+        """
+        super(LayerImportanceSampler, self).__init__(len(layer_sizes), return_eids)
+        self.layer_sizes = layer_sizes
+
+    @staticmethod
+    def _group_by_node(nodes_per_etype):
+        """
+        Map node ids from several edge types to positions in the list of unique nodes.
+        :param nodes_per_etype: list of tensors with node ids of the same node type
+        :return: unique node ids, and the list of tensors with positions of nodes in the unique ids
+        """
+        unique, inverse = torch.unique(torch.cat(nodes_per_etype), return_inverse=True)
+        return unique, torch.split(inverse, [len(nodes) for nodes in nodes_per_etype])
+
+    def sample_frontier(self, block_id, g, seed_nodes):
+        frontier = dgl.in_subgraph(g, seed_nodes)
+        etypes = [etype for etype in frontier.canonical_etypes if frontier.num_edges(etype) > 0]
+        if len(etypes) == 0:
+            return frontier
+
+        edges = {etype: frontier.edges(etype=etype) for etype in etypes}
+
+        # weight of an edge in the row-normalized adjacency matrix is 1 / in-degree of the destination
+        edge_weights = {}
+        for dsttype in set(etype[2] for etype in etypes):
+            dst_etypes = [etype for etype in etypes if etype[2] == dsttype]
+            _, positions = self._group_by_node([edges[etype][1] for etype in dst_etypes])
+            in_degrees = torch.bincount(torch.cat(positions)).float()
+            for etype, dst_positions in zip(dst_etypes, positions):
+                edge_weights[etype] = 1. / in_degrees[dst_positions]
+
+        candidates = []
+        candidate_importance = []
+        edge_candidates = {}
+        for srctype in set(etype[0] for etype in etypes):
+            src_etypes = [etype for etype in etypes if etype[0] == srctype]
+            unique_src, positions = self._group_by_node([edges[etype][0] for etype in src_etypes])
+            importance = torch.zeros(len(unique_src))
+            for etype, src_positions in zip(src_etypes, positions):
+                importance.index_add_(0, src_positions, edge_weights[etype] ** 2)
+                edge_candidates[etype] = (len(candidates), src_positions)
+            candidates.append(unique_src)
+            candidate_importance.append(importance)
+
+        offsets = torch.cumsum(torch.LongTensor([0] + [len(c) for c in candidates]), dim=0)
+        candidate_importance = torch.cat(candidate_importance)
+
+        num_sampled = min(self.layer_sizes[block_id], len(candidate_importance))
+        sampled = torch.multinomial(candidate_importance, num_sampled, replacement=False)
+        is_sampled = torch.zeros(len(candidate_importance), dtype=torch.bool)
+        is_sampled[sampled] = True
+
+        # edges are removed from the frontier instead of taking an edge subgraph, so that node ids and ids of edges
+        # in the parent graph stay the same
+        for etype in etypes:
+            group, src_positions = edge_candidates[etype]
+            edge_mask = is_sampled[offsets[group] + src_positions]
+            removed_edges = frontier.edges(form="eid", etype=etype)[~edge_mask]
+            if len(removed_edges) > 0:
+                frontier = dgl.remove_edges(frontier, removed_edges, etype=etype)
+
+        return frontier
+
+
+class NeighbourhoodSampling:
+    """
+    Settings of neighbourhood sampling for data loaders of objectives. Supported modes are
+        full: all neighbours of nodes are used
+        neighbour: every node samples a fixed number of neighbours on every layer
+        layer: fixed number of nodes is sampled on every layer with LayerImportanceSampler
+    Fanout of edge types can be limited in full and neighbour modes to avoid blocks with all neighbours of hub nodes.
+    """
+    modes = {"full", "neighbour", "layer"}
+
+    def __init__(
+            self, mode="full", fanouts=None, edge_type_fanouts=None, layer_sizes=None, num_workers=0,
+            prefetch_factor=2
+    ):
+        """
+        :param mode: one of `full`, `neighbour`, `layer`
+        :param fanouts: number of sampled neighbours for every layer, starting from the input layer. The last value is
+            repeated when the model has more layers.
+        :param edge_type_fanouts: dictionary with the maximum number of sampled neighbours for edge types
+        :param layer_sizes: number of sampled nodes for every layer in `layer` mode, starting from the input layer
+        :param num_workers: number of worker processes for sampling blocks of training, validation and test loaders
+        :param prefetch_factor: number of batches prepared in advance by every worker
+        """
+        if mode not in self.modes:
+            raise ValueError(f"Unknown neighbourhood sampling mode: {mode}, supported modes are {self.modes}")
+        if mode != "full" and fanouts is None:
+            raise ValueError(f"Fanouts should be provided for neighbourhood sampling mode {mode}")
+
+        self.mode = mode
+        self.fanouts = fanouts
+        self.edge_type_fanouts = edge_type_fanouts if edge_type_fanouts is not None else {}
+        self.layer_sizes = layer_sizes
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+
+    @staticmethod
+    def _parse_list(value):
+        if value is None or isinstance(value, list):
+            return value
+        if isinstance(value, int):
+            return [value]
+        return [int(v) for v in str(value).split(",")]
+
+    @staticmethod
+    def _parse_dict(value):
+        if value is None or isinstance(value, dict):
+            return value
+        edge_type_fanouts = {}
+        for record in str(value).split(","):
+            etype, fanout = record.rsplit(":", maxsplit=1)
+            edge_type_fanouts[etype.strip()] = int(fanout)
+        return edge_type_fanouts
+
+    @classmethod
+    def from_trainer_params(cls, trainer_params):
+        """
+        Create sampling settings from trainer parameters. Options missing in configurations of earlier versions
+        default to full neighbourhood sampling without worker processes.
+        """
+        fanouts = cls._parse_list(trainer_params.get("sampling_fanouts", None))
+        if fanouts is None:
+            fanouts = [trainer_params["sampling_neighbourhood_size"]]
+
+        layer_sizes = cls._parse_list(trainer_params.get("layer_sampling_size", None))
+        if layer_sizes is None:
+            layer_sizes = [trainer_params["batch_size"] * trainer_params["sampling_neighbourhood_size"]]
+
+        return cls(
+            mode=trainer_params.get("neighbourhood_sampler", "full"),
+            fanouts=fanouts,
+            edge_type_fanouts=cls._parse_dict(trainer_params.get("edge_type_fanouts", None)),
+            layer_sizes=layer_sizes,
+            num_workers=trainer_params.get("loader_workers", 0),
+            prefetch_factor=trainer_params.get("loader_prefetch_factor", 2)
+        )
+
+    @staticmethod
+    def _per_layer(values, num_layers):
+        return [values[min(layer, len(values) - 1)] for layer in range(num_layers)]
+
+    def _get_layer_fanouts(self, graph, num_layers):
+        default_fanout = -1
+        fanouts = self._per_layer(self.fanouts, num_layers) if self.mode == "neighbour" else [default_fanout] * num_layers
+
+        if len(self.edge_type_fanouts) == 0:
+            return fanouts
+
+        unknown_etypes = set(self.edge_type_fanouts) - set(etype[1] for etype in graph.canonical_etypes)
+        if len(unknown_etypes) > 0:
+            logging.warning(f"Fanout is specified for edge types that are not in the graph: {unknown_etypes}")
+
+        def limit_fanout(fanout, etype):
+            limit = self.edge_type_fanouts.get(etype[1], None)
+            if limit is None:
+                return fanout
+            return limit if fanout == -1 else min(fanout, limit)
+
+        return [
+            {etype: limit_fanout(fanout, etype) for etype in graph.canonical_etypes}
+            for fanout in fanouts
+        ]
+
+    def create_block_sampler(self, graph, num_layers):
+        if self.mode == "layer":
+            return LayerImportanceSampler(self._per_layer(self.layer_sizes, num_layers))
+        if self.mode == "full" and len(self.edge_type_fanouts) == 0:
+            return dgl.dataloading.MultiLayerFullNeighborSampler(num_layers)
+        return dgl.dataloading.MultiLayerNeighborSampler(self._get_layer_fanouts(graph, num_layers))
+
+    def get_loader_arguments(self, use_workers=True):
+        """
+        Arguments for `dgl.dataloading.NodeDataLoader`. Workers are kept alive between epochs. Loaders that are
+        created for a single batch should not use workers.
+        """
+        if not use_workers or self.num_workers == 0:
+            return {"num_workers": 0}
+        return {
+            "num_workers": self.num_workers,
+            "prefetch_factor": self.prefetch_factor,
+            "persistent_workers": True
+        }
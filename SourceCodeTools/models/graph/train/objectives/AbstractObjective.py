@@ -11,6 +11,7 @@ from SourceCodeTools.mltools.torch import compute_accuracy
 from SourceCodeTools.models.graph.ElementEmbedder import ElementEmbedderWithBpeSubwords, GraphLinkSampler
 from SourceCodeTools.models.graph.ElementEmbedderBase import ElementEmbedderBase
 from SourceCodeTools.models.graph.LinkPredictor import CosineLinkPredictor, BilinearLinkPedictor, L2LinkPredictor
+from SourceCodeTools.models.graph.train.neighbourhood_sampling import NeighbourhoodSampling
 
 import torch.nn as nn
 
@@ -92,7 +93,12 @@ class AbstractObjective(nn.Module):
 
         self.name = name
         self.graph_model = graph_model
-        self.sampling_neighbourhood_size = sampling_neighbourhood_size
+        if isinstance(sampling_neighbourhood_size, NeighbourhoodSampling):
+            self.neighbourhood_sampling = sampling_neighbourhood_size
+            self.sampling_neighbourhood_size = sampling_neighbourhood_size.fanouts[0]
+        else:
+            self.neighbourhood_sampling = NeighbourhoodSampling(fanouts=[sampling_neighbourhood_size])
+            self.sampling_neighbourhood_size = sampling_neighbourhood_size
         self.batch_size = batch_size
         self.target_emb_size = target_emb_size
         self.node_embedder = node_embedder
@@ -105,6 +111,7 @@ class AbstractObjective(nn.Module):
         self.early_stopping_tracker = EarlyStoppingTracker(early_stopping_tolerance) if early_stopping else None
         self.early_stopping_trigger = False
         self.ns_groups = ns_groups
+        self.prefetched_masks = {}
 
         self.verify_parameters()
 
@@ -282,25 +289,28 @@ class AbstractObjective(nn.Module):
 
         return train_idx, val_idx, test_idx
 
-    def _create_loader(self, ids, batch_size=None, shuffle=False):
+    def _create_loader(self, ids, batch_size=None, shuffle=False, use_workers=False):
         if batch_size is None:
             # TODO
             # only works when ids do not have types
             batch_size = self._idx_len(ids)
-        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(self.graph_model.num_layers)
+        sampler = self.neighbourhood_sampling.create_block_sampler(self.graph_model.g, self.graph_model.num_layers)
         loader = dgl.dataloading.NodeDataLoader(
-            self.graph_model.g, ids, sampler, batch_size=batch_size, shuffle=shuffle, num_workers=0)
+            self.graph_model.g, ids, sampler, batch_size=batch_size, shuffle=shuffle,
+            **self.neighbourhood_sampling.get_loader_arguments(use_workers=use_workers)
+        )
         return loader
 
     def _get_loaders(self, train_idx, val_idx, test_idx, batch_size):
 
-        train_loader = self._create_loader(train_idx, batch_size, shuffle=False)
-        val_loader = self._create_loader(val_idx, batch_size, shuffle=False)
-        test_loader = self._create_loader(test_idx, batch_size, shuffle=False)
+        train_loader = self._create_loader(train_idx, batch_size, shuffle=False, use_workers=True)
+        val_loader = self._create_loader(val_idx, batch_size, shuffle=False, use_workers=True)
+        test_loader = self._create_loader(test_idx, batch_size, shuffle=False, use_workers=True)
 
         return train_loader, val_loader, test_loader
 
     def reset_iterator(self, data_split):
+        self.prefetched_masks.clear()
         iter_name = f"{data_split}_loader_iter"
         setattr(self, iter_name, iter(getattr(self, f"{data_split}_loader")))
 
@@ -580,8 +590,23 @@ class AbstractObjective(nn.Module):
             python_seeds = seeds.tolist()
         return python_seeds
 
+    def prefetch_mask(self, seeds):
+        """
+        Compute mask for seeds in advance, the mask is used by `get_mask` when the batch is processed.
+        """
+        if self.masker is not None:
+            self.prefetched_masks[id(seeds)] = (seeds, self.masker.get_mask(self.seeds_to_python(seeds)))
+
+    def get_mask(self, seeds):
+        if self.masker is None:
+            return None
+        prefetched = self.prefetched_masks.pop(id(seeds), None)
+        if prefetched is not None and prefetched[0] is seeds:
+            return prefetched[1]
+        return self.masker.get_mask(self.seeds_to_python(seeds))
+
     def forward(self, input_nodes, seeds, blocks, train_embeddings=True, neg_sampling_strategy=None):
-        masked = self.masker.get_mask(self.seeds_to_python(seeds)) if self.masker is not None else None
+        masked = self.get_mask(seeds)
         graph_emb = self._graph_embeddings(input_nodes, blocks, train_embeddings, masked=masked)
         node_embs_, element_embs_, labels = self.prepare_for_prediction(
             graph_emb, seeds, self.target_embedding_fn, negative_factor=self.negative_factor,
@@ -3,12 +3,14 @@ from collections import OrderedDict, defaultdict
 from itertools import chain
 from typing import Optional
 
+import dgl
 import numpy as np
 import torch
 from sklearn.metrics import ndcg_score, top_k_accuracy_score
 from torch import nn
 from tqdm import tqdm
 
+from SourceCodeTools.code.data.dataset.SubgraphMapping import SubgraphMapping
 from SourceCodeTools.code.data.dataset.SubwordMasker import SubwordMasker
 from SourceCodeTools.code.data.file_utils import unpersist
 from SourceCodeTools.models.graph.ElementEmbedder import ElementEmbedderWithBpeSubwords
@@ -21,50 +23,44 @@ from SourceCodeTools.tabular.common import compact_property
 
 
 class SubgraphLoader:
-    def __init__(self, ids, subgraph_mapping, loading_fn, batch_size, graph_node_types):
+    def __init__(self, ids, subgraph_mapping, block_sampler, graph, batch_size):
+        """
+        :param ids: subgraph ids
+        :param subgraph_mapping: SubgraphMapping or dictionary {subgraph_id: {node_type: list of typed ids}}
+        :param block_sampler: block sampler shared by all batches
+        :param graph: graph for sampling blocks
+        :param batch_size: number of subgraphs in a batch
+        """
         self.ids = ids
-        self.loading_fn = loading_fn
+        if not isinstance(subgraph_mapping, SubgraphMapping):
+            subgraph_mapping = SubgraphMapping.from_dict(subgraph_mapping)
         self.subgraph_mapping = subgraph_mapping
+        self.block_sampler = block_sampler
+        self.graph = graph
         self.iterator = None
         self.batch_size = batch_size
-        self.graph_node_types = graph_node_types
 
     def load_ids(self, batch_ids):
-        node_ids = dict()
-        subgraphs = dict()
-
-        for id_ in batch_ids:
-            subgraph_nodes = self._get_subgraph(id_)
-            subgraphs[id_] = subgraph_nodes
-
-            for type_ in subgraph_nodes:
-                if type_ not in node_ids:
-                    node_ids[type_] = set()
-                node_ids[type_].update(subgraph_nodes[type_])
-
-        for type_ in node_ids:
-            node_ids[type_] = sorted(list(node_ids[type_]))
-
-        coincidence_matrix = []
-        for id_, subgraph in subgraphs.items():
-            coincidence_matrix.append([])
-            for type_ in self.graph_node_types:
-                subgraph_nodes = subgraph[type_]
-                for node_id in node_ids[type_]:
-                    coincidence_matrix[-1].append(node_id in subgraph_nodes)
-
-        coincidence_matrix = torch.BoolTensor(coincidence_matrix)
-
-        loader = self.loading_fn(node_ids)
+        """
+        Sample blocks for nodes of subgraphs in the batch.
+        :return: input nodes, tuple with sparse membership matrix of subgraphs and batch nodes and batch ids, blocks
+        """
+        if isinstance(batch_ids, torch.Tensor):
+            batch_ids = batch_ids.tolist()
+        node_ids, rows, columns, num_nodes = self.subgraph_mapping.get_batch(batch_ids, self.graph.ntypes)
+
+        coincidence_matrix = torch.sparse_coo_tensor(
+            torch.from_numpy(np.stack([rows, columns])), torch.ones(len(rows)), size=(len(batch_ids), num_nodes)
+        ).coalesce()
+
+        blocks = self.block_sampler.sample_blocks(
+            self.graph, {type_: torch.from_numpy(ids_) for type_, ids_ in node_ids.items()}
+        )
+        input_nodes = blocks[0].srcdata[dgl.NID]
 
-        for input_nodes, seeds, blocks in loader:
-            # generator contains only one batch
-            return input_nodes, (coincidence_matrix, torch.LongTensor(batch_ids)), blocks
+        return input_nodes, (coincidence_matrix, torch.LongTensor(batch_ids)), blocks
 
     def __iter__(self):
-        # TODO
-        # supports only nodes without types
-
         for i in range(0, len(self.ids), self.batch_size):
             batch_ids = self.ids[i: i + self.batch_size]
             yield self.load_ids(batch_ids)
@@ -163,10 +159,15 @@ class SubgraphAbstractObjective(AbstractObjective):
         # logging.info("Batch size is ignored for subgraphs")
 
         subgraph_mapping = self.subgraph_mapping
+        if not isinstance(subgraph_mapping, SubgraphMapping):
+            subgraph_mapping = SubgraphMapping.from_dict(subgraph_mapping)
 
-        train_loader = SubgraphLoader(train_idx, subgraph_mapping, self._create_loader, batch_size, self.graph_model.g.ntypes)
-        val_loader = SubgraphLoader(val_idx, subgraph_mapping, self._create_loader, batch_size, self.graph_model.g.ntypes)
-        test_loader = SubgraphLoader(test_idx, subgraph_mapping, self._create_loader, batch_size, self.graph_model.g.ntypes)
+        graph = self.graph_model.g
+        block_sampler = self.neighbourhood_sampling.create_block_sampler(graph, self.graph_model.num_layers)
+
+        train_loader = SubgraphLoader(train_idx, subgraph_mapping, block_sampler, graph, batch_size)
+        val_loader = SubgraphLoader(val_idx, subgraph_mapping, block_sampler, graph, batch_size)
+        test_loader = SubgraphLoader(test_idx, subgraph_mapping, block_sampler, graph, batch_size)
 
         return train_loader, val_loader, test_loader
 
@@ -189,23 +190,30 @@ class SubgraphAbstractObjective(AbstractObjective):
             self.get_prefix("link_predictor", state_dicts)
         )
 
-    def pooling_fn(self, node_embeddings):
-        return torch.mean(node_embeddings, dim=0, keepdim=True)
+    def pooling_fn(self, node_embeddings, subgraph_masks):
+        """
+        Average embeddings of nodes of every subgraph.
+        :param node_embeddings: embeddings of batch nodes
+        :param subgraph_masks: sparse membership matrix with subgraphs as rows and batch nodes as columns
+        """
+        subgraph_masks = subgraph_masks.to(node_embeddings.device)
+        num_nodes = torch.sparse.sum(subgraph_masks, dim=1).to_dense().unsqueeze(1)
+        return torch.sparse.mm(subgraph_masks, node_embeddings) / num_nodes
 
     def _graph_embeddings(self, input_nodes, blocks, train_embeddings=True, masked=None, subgraph_masks=None):
         node_embs = super(SubgraphAbstractObjective, self)._graph_embeddings(
             input_nodes, blocks, train_embeddings, masked
         )
 
-        subgraph_embs = []
-        for subgraph_mask in subgraph_masks:
-            subgraph_embs.append(self.pooling_fn(node_embs[subgraph_mask]))
+        return self.pooling_fn(node_embs, subgraph_masks)
 
-        return torch.cat(subgraph_embs, dim=0)
+    def prefetch_mask(self, seeds):
+        subgraph_masks, seeds = seeds
+        super(SubgraphAbstractObjective, self).prefetch_mask(seeds)
 
     def forward(self, input_nodes, seeds, blocks, train_embeddings=True, neg_sampling_strategy=None):
         subgraph_masks, seeds = seeds
-        masked = self.masker.get_mask(self.seeds_to_python(seeds)) if self.masker is not None else None
+        masked = self.get_mask(seeds)
         graph_emb = self._graph_embeddings(input_nodes, blocks, train_embeddings, masked=masked, subgraph_masks=subgraph_masks)
         subgraph_embs_, element_embs_, labels = self.prepare_for_prediction(
             graph_emb, seeds, self.target_embedding_fn, negative_factor=self.negative_factor,
@@ -7,6 +7,7 @@ from torch import nn
 
 from SourceCodeTools.code.data.dataset.SubwordMasker import SubwordMasker
 from SourceCodeTools.models.graph.ElementEmbedder import ElementEmbedderWithBpeSubwords
+from SourceCodeTools.models.negative_sampling import AliasSampler
 from SourceCodeTools.models.graph.train.Scorer import Scorer
 from SourceCodeTools.models.graph.train.objectives.SubgraphClassifierObjective import SubgraphAbstractObjective, \
     SubgraphElementEmbedderBase
@@ -131,6 +132,7 @@ class SubgraphElementEmbedderMatcher(SubgraphElementEmbedderBase, Scorer):
     def init(self, compact_dst):
         self.id2name = dict(zip(self.elements["id"], self.elements["dst"]))
         self.all_names = set(self.id2name.values())
+        self.name_sampler = AliasSampler(list(self.all_names))
         assert len(self.id2name) == len(self.elements)
 
         self.name2id = dict()
@@ -149,9 +151,6 @@ class SubgraphElementEmbedderMatcher(SubgraphElementEmbedderBase, Scorer):
         return np.fromiter((rnd.choice(list(set(self.name2id[self.id2name[id]]) - {id})) for id in ids), dtype=np.int32)
 
     def sample_negative(self, size, ids=None):
-        negative = []
-        for id in ids:
-            rnd_name = rnd.choice(list(self.all_names - {self.id2name[id]}))
-            rnd_id = rnd.choice(list(self.name2id[rnd_name]))
-            negative.append(rnd_id)
+        negative_names = self.name_sampler.sample_excluding([[self.id2name[id]] for id in ids], k=1).reshape(-1)
+        negative = [rnd.choice(self.name2id[rnd_name]) for rnd_name in negative_names]
         return np.array(negative, dtype=np.int32)
@@ -1,5 +1,4 @@
 import os
-from collections import defaultdict
 from copy import copy
 from pprint import pprint
 from typing import Tuple
@@ -24,6 +23,11 @@ from SourceCodeTools.models.graph.train.objectives.GraphLinkClassificationObject
 from SourceCodeTools.models.graph.train.objectives.SubgraphClassifierObjective import SubgraphClassifierObjective
 from SourceCodeTools.models.graph.train.objectives.SubgraphEmbedderObjective import SubgraphEmbeddingObjective, \
     SubgraphMatchingObjective
+from SourceCodeTools.models.graph.train.batch_prefetcher import BatchPrefetcher, iterate_objective_batches
+from SourceCodeTools.models.graph.train.index_refresh import IndexRefreshScheduler
+from SourceCodeTools.models.graph.train.Scorer import Scorer
+from SourceCodeTools.models.graph.train.neighbourhood_sampling import NeighbourhoodSampling
+from SourceCodeTools.models.graph.train.training_metrics import TrainingMetrics, get_grad_norm
 from SourceCodeTools.models.graph.train.utils import get_name
 
 
@@ -112,12 +116,17 @@ class SamplingMultitaskTrainer:
         if "var_misuse_link" in objective_list:
             self.create_var_misuse_edge_objective(dataset, tokenizer_path)
 
+        for objective in self.objectives:
+            target_embedder = getattr(objective, "target_embedder", None)
+            if isinstance(target_embedder, Scorer):
+                target_embedder.set_max_pairs(self.trainer_params.get("scoring_max_pairs", Scorer.scorer_max_pairs))
+
     def create_token_pred_objective(self, dataset, tokenizer_path):
         self.objectives.append(
             TokenNamePrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_token_prediction, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 masker=dataset.create_subword_masker(), measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"]
@@ -135,7 +144,7 @@ class SamplingMultitaskTrainer:
             NodeNamePrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_node_names, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 masker=dataset.create_node_name_masker(tokenizer_path),
                 measure_scores=self.trainer_params["measure_scores"],
@@ -158,7 +167,7 @@ class SamplingMultitaskTrainer:
             objective_name,
             self.graph_model, self.node_embedder, dataset.nodes,
             labels_fn, self.device,
-            self.sampling_neighbourhood_size, self.batch_size,
+            self.neighbourhood_sampling, self.batch_size,
             tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
             masker=masker,  # dataset.create_node_name_masker(tokenizer_path),
             measure_scores=self.trainer_params["measure_scores"],
@@ -205,7 +214,7 @@ class SamplingMultitaskTrainer:
             TypeAnnPrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_type_prediction, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 masker=None,
                 measure_scores=self.trainer_params["measure_scores"],
@@ -218,7 +227,7 @@ class SamplingMultitaskTrainer:
             NodeNameClassifier(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_node_names, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size,
                 masker=dataset.create_node_name_masker(tokenizer_path),
                 measure_scores=self.trainer_params["measure_scores"],
@@ -231,7 +240,7 @@ class SamplingMultitaskTrainer:
             VariableNameUsePrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_var_use, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 masker=dataset.create_variable_name_masker(tokenizer_path),
                 measure_scores=self.trainer_params["measure_scores"],
@@ -244,7 +253,7 @@ class SamplingMultitaskTrainer:
             NextCallPrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_api_call, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"]
@@ -258,7 +267,7 @@ class SamplingMultitaskTrainer:
             GlobalLinkPrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_global_edges_prediction, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="nn",
                 measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"]
@@ -270,7 +279,7 @@ class SamplingMultitaskTrainer:
             EdgePrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_edge_prediction, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type=self.trainer_params["metric"],
                 measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"], nn_index=self.trainer_params["nn_index"],
@@ -291,7 +300,7 @@ class SamplingMultitaskTrainer:
             SelectiveGraphLinkObjective(
                 "VarMisuseLinks", self.graph_model, self.node_embedder, dataset.nodes,
                 load_misuse_edges, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type=self.trainer_params["metric"],
                 measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"], nn_index=self.trainer_params["nn_index"],
@@ -304,7 +313,7 @@ class SamplingMultitaskTrainer:
             TransRObjective(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_edge_prediction, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size,
                 link_predictor_type=self.trainer_params["metric"],
                 measure_scores=self.trainer_params["measure_scores"],
@@ -318,7 +327,7 @@ class SamplingMultitaskTrainer:
             GraphTextPrediction(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_docstring, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size, link_predictor_type="inner_prod",
                 measure_scores=self.trainer_params["measure_scores"],
                 dilate_scores=self.trainer_params["dilate_scores"]
@@ -330,7 +339,7 @@ class SamplingMultitaskTrainer:
             GraphTextGeneration(
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_docstring, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size,
             )
         )
@@ -341,7 +350,7 @@ class SamplingMultitaskTrainer:
                 "NodeTypeClassifier",
                 self.graph_model, self.node_embedder, dataset.nodes,
                 dataset.load_node_classes, self.device,
-                self.sampling_neighbourhood_size, self.batch_size,
+                self.neighbourhood_sampling, self.batch_size,
                 tokenizer_path=tokenizer_path, target_emb_size=self.elem_emb_size,
                 masker=dataset.create_node_clf_masker(),
                 measure_scores=self.trainer_params["measure_scores"],
@@ -393,6 +402,10 @@ class SamplingMultitaskTrainer:
     def sampling_neighbourhood_size(self):
         return self.trainer_params['sampling_neighbourhood_size']
 
+    @property
+    def neighbourhood_sampling(self):
+        return NeighbourhoodSampling.from_trainer_params(self.trainer_params)
+
     @property
     def neg_sampling_factor(self):
         return self.trainer_params['neg_sampling_factor']
@@ -481,7 +494,6 @@ class SamplingMultitaskTrainer:
                 _ = objective.target_embedding_fn(batch)  # scorer embedding updated inside
 
     def _get_grad_norms(self):
-        total_norm = 0.
 
         def get_all_params():
             for pg in self.optimizer.param_groups:
@@ -492,13 +504,24 @@ class SamplingMultitaskTrainer:
                 for param in pg["params"]:
                     yield param
 
-        for p in get_all_params():
-            if p.grad is not None:
-                param_norm = p.grad.detach().data.norm(2)
-                total_norm += param_norm.item() ** 2
+        return get_grad_norm(get_all_params())
 
-        total_norm = total_norm ** 0.5
-        return total_norm
+    def _get_train_batches(self, num_batches):
+        """
+        Iterator over batches of all objectives for training steps. Blocks are already on the device.
+        """
+        prefetch_batches = self.trainer_params.get("prefetch_batches", 0)
+        if prefetch_batches > 0:
+            return BatchPrefetcher(self.objectives, self.device, num_batches, queue_size=prefetch_batches)
+        return iterate_objective_batches(self.objectives, self.device, num_batches)
+
+    def _create_index_refresh_schedulers(self):
+        return {
+            objective.name: IndexRefreshScheduler(
+                refresh_interval=self.trainer_params.get("index_refresh_interval", 1),
+                staleness_threshold=self.trainer_params.get("index_staleness_threshold", None)
+            ) for objective in self.objectives
+        }
 
     def train_all(self):
         """
@@ -510,10 +533,13 @@ class SamplingMultitaskTrainer:
         best_val_loss = float("inf")
         write_best_model = False
 
+        index_refresh = self._create_index_refresh_schedulers()
+
         for objective in self.objectives:
             with torch.set_grad_enabled(False):
                 self.compute_embeddings_for_scorer(objective)
-                objective.target_embedder.prepare_index()  # need this to update sampler for the next epoch
+                # need this to update sampler for the next epoch
+                index_refresh[objective.name].refresh(objective.target_embedder)
 
         for epoch in range(self.epoch, self.epochs):
             self.epoch = epoch
@@ -523,31 +549,31 @@ class SamplingMultitaskTrainer:
             summary_dict = {}
             num_batches = min([objective.num_train_batches for objective in self.objectives])
 
-            train_losses = defaultdict(list)
-            train_accs = defaultdict(list)
+            train_metrics = TrainingMetrics(
+                self.summary_writer, self.device, flush_interval=self.trainer_params.get("summary_interval", 1)
+            )
 
             # def append_metric(destination, name, metric):
             #     if name not in destination:
             #         destination[name] = []
             #     destination[name].append(metric)
 
-            for step in tqdm(range(num_batches), total=num_batches, desc=f"Epoch {self.epoch}"):
+            train_batches = self._get_train_batches(num_batches)
 
-                loss_accum = 0
+            for step in tqdm(range(num_batches), total=num_batches, desc=f"Epoch {self.epoch}"):
 
                 summary = {}
+                train_averages = {}
 
                 try:
-                    loaders = [objective.loader_next("train") for objective in self.objectives]
+                    loaders = next(train_batches)
                 except StopIteration:
                     break
 
                 self.optimizer.zero_grad()
                 self.sparse_optimizer.zero_grad()
                 for ind, (objective, (input_nodes, seeds, blocks)) in enumerate(zip(self.objectives, loaders)):
-                    blocks = [blk.to(self.device) for blk in blocks]
-
-                    objective.target_embedder.prepare_index()
+                    index_refresh[objective.name].step(objective.target_embedder)
 
                     do_break = False
                     for block in blocks:
@@ -563,7 +589,6 @@ class SamplingMultitaskTrainer:
                     )
 
                     loss = loss / len(self.objectives)  # assumes the same batch size for all objectives
-                    loss_accum += loss.item()
                     # for groups in self.optimizer.param_groups:
                     #     for param in groups["params"]:
                     #         torch.nn.utils.clip_grad_norm_(param, max_norm=1.)
@@ -572,38 +597,47 @@ class SamplingMultitaskTrainer:
                     summary = {}
                     add_to_summary(
                         summary=summary, partition="train", objective_name=objective.name,
-                        scores={"Loss": loss.item(), "Accuracy": acc}, postfix=""
+                        scores={"Loss": loss.detach(), "Accuracy": acc}, postfix=""
                     )
 
-                    train_losses[f"Loss/train_avg/{objective.name}"].append(loss.item())
-                    train_accs[f"Accuracy/train_avg/{objective.name}"].append(acc)
+                    train_averages[f"Loss/train_avg/{objective.name}"] = loss.detach()
+                    train_averages[f"Accuracy/train_avg/{objective.name}"] = acc
 
                     # except ZeroEdges as e:
                     #     logging.warning(f"Zero edges in loader in step {step}")
                     # except Exception as e:
                     #     raise e
 
-                grad_norms = {"grad_norm": self._get_grad_norms()}
+                grad_norm = self._get_grad_norms()
 
                 self.optimizer.step()
                 self.sparse_optimizer.step()
                 step += 1
 
-                self.write_summary(summary, self.batch)
-                summary_dict.update(summary)
+                train_metrics.add(self.batch, summary)
 
                 self.batch += 1
-                # summary = {
-                #     f"Loss/train": loss_accum,
-                # }
-                summary = {key: sum(val) / len(val) for key, val in train_losses.items()}
-                summary.update({key: sum(val) / len(val) for key, val in train_accs.items()})
+                train_metrics.add_averaged(self.batch, train_averages)
+                if grad_norm is not None:
+                    summary = {}
+                    add_to_summary(
+                        summary=summary, partition="train", objective_name="",
+                        scores={"grad_norm": grad_norm}, postfix=""
+                    )
+                    train_metrics.add(self.batch, summary)
+                train_metrics.step()
+
+            train_batches.close()
+            summary_dict.update(train_metrics.finish())
+
+            summary = {}
+            for objective in self.objectives:
                 add_to_summary(
-                    summary=summary, partition="train", objective_name="",
-                    scores=grad_norms, postfix=""
+                    summary, "train", objective.name, index_refresh[objective.name].get_metrics(), postfix=""
                 )
-                self.write_summary(summary, self.batch)
-                summary_dict.update(summary)
+                index_refresh[objective.name].reset_metrics()
+            self.write_summary(summary, self.batch)
+            summary_dict.update(summary)
 
             for objective in self.objectives:
                 objective.reset_iterator("train")
@@ -612,7 +646,8 @@ class SamplingMultitaskTrainer:
                 objective.eval()
 
                 with torch.set_grad_enabled(False):
-                    objective.target_embedder.prepare_index()  # need this to update sampler for the next epoch
+                    # need this to update sampler for the next epoch
+                    index_refresh[objective.name].refresh(objective.target_embedder)
 
                     val_scores = objective.evaluate("val")
                     test_scores = objective.evaluate("test")
@@ -747,9 +782,62 @@ class SamplingMultitaskTrainer:
         for objective in self.objectives:
             objective.to(device)
 
-    def get_embeddings(self):
+    def _write_node_embeddings(self, output_path, dtype, chunk_size=100000):
+        """
+        Write input embeddings of nodes to memory mapped files in chunks.
+        :return: dictionary with memory mapped embeddings for every node type
+        """
+        nodes = self.graph_model.g.nodes
+        node_embs = {}
+        for ntype in self.graph_model.g.ntypes:
+            typed_ids = nodes[ntype].data['typed_id']
+            node_embs[ntype] = np.lib.format.open_memmap(
+                join(output_path, f"input_{ntype}.npy"), mode="w+", dtype=dtype,
+                shape=(len(typed_ids), self.node_embedder.emb_size)
+            )
+            for start in range(0, len(typed_ids), chunk_size):
+                node_embs[ntype][start: start + chunk_size] = self.node_embedder(
+                    node_type=ntype, node_ids=typed_ids[start: start + chunk_size], train_embeddings=False
+                ).cpu().numpy()
+            node_embs[ntype].flush()
+        return node_embs
+
+    def get_embeddings(self, output_path=None, dtype=None):
+        """
+        Compute embeddings of all nodes with the graph model.
+        :param output_path: directory for memory mapped embeddings. When `mmap_embeddings` is enabled, model
+            directory is used by default. Embeddings are computed in memory if no directory is given.
+        :param dtype: data type of memory mapped embeddings, `mmap_embeddings_dtype` by default
+        :return: list with Embedder
+        """
+        if output_path is None and self.trainer_params.get("mmap_embeddings", False):
+            output_path = self.model_base_path
+        if dtype is None:
+            dtype = self.trainer_params.get("mmap_embeddings_dtype", "float32")
+
         # self.graph_model.g.nodes["function"].data.keys()
         nodes = self.graph_model.g.nodes
+
+        original_id = []
+        global_id = []
+        for ntype in self.graph_model.g.ntypes:
+            original_id.extend(nodes[ntype].data['original_id'].tolist())
+            global_id.extend(nodes[ntype].data['global_graph_id'].tolist())
+
+        if output_path is not None:
+            os.makedirs(output_path, exist_ok=True)
+            logging.info(f"Computing all embeddings into {output_path}")
+            node_embs = self._write_node_embeddings(output_path, dtype)
+            self.graph_model.inference(
+                batch_size=2048, device='cpu', num_workers=self.trainer_params.get("loader_workers", 0),
+                x=node_embs, output_path=output_path, dtype=dtype
+            )
+            for ntype in node_embs:
+                os.remove(node_embs[ntype].filename)
+            # rows of the embedding file follow global graph ids
+            embeddings = np.load(join(output_path, "embeddings.npy"), mmap_mode="r")
+            return [Embedder(dict(zip(original_id, global_id)), embeddings)]
+
         node_embs = {
             ntype: self.node_embedder(node_type=ntype, node_ids=nodes[ntype].data['typed_id'], train_embeddings=False)
             for ntype in self.graph_model.g.ntypes
@@ -758,15 +846,7 @@ class SamplingMultitaskTrainer:
         logging.info("Computing all embeddings")
         h = self.graph_model.inference(batch_size=2048, device='cpu', num_workers=0, x=node_embs)
 
-        original_id = []
-        global_id = []
-        embeddings = []
-        for ntype in self.graph_model.g.ntypes:
-            embeddings.append(h[ntype])
-            original_id.extend(nodes[ntype].data['original_id'].tolist())
-            global_id.extend(nodes[ntype].data['global_graph_id'].tolist())
-
-        embeddings = torch.cat(embeddings, dim=0).detach().numpy()
+        embeddings = torch.cat([h[ntype] for ntype in self.graph_model.g.ntypes], dim=0).detach().numpy()
 
         return [Embedder(dict(zip(original_id, global_id)), embeddings)]
 
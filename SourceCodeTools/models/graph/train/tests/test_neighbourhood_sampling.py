@@ -0,0 +1,89 @@
+import dgl
+import torch
+
+
+def create_graph():
+    """
+    Seed nodes 0 and 1 have ten `node` neighbours, five of them are shared, and node 1 has eight `word` neighbours.
+    Seed node 12 has no neighbours. Edges between other nodes do not belong to the neighbourhood of the seeds.
+    """
+    return dgl.heterograph({
+        ("node", "a", "node"): (
+            torch.LongTensor(list(range(2, 12)) + list(range(2, 7)) + [7, 8]),
+            torch.LongTensor([0] * 10 + [1] * 5 + [5, 5])
+        ),
+        ("word", "b", "node"): (torch.arange(8), torch.LongTensor([1] * 8)),
+    }, num_nodes_dict={"node": 13, "word": 8})
+
+
+seeds = {"node": torch.LongTensor([0, 1, 12])}
+
+
+def get_edges(graph):
+    return {
+        (etype, int(src), int(dst))
+        for etype in graph.canonical_etypes for src, dst in zip(*graph.edges(etype=etype))
+    }
+
+
+def test_layer_importance_sampler_samples_layer_sizes():
+    from SourceCodeTools.models.graph.train.neighbourhood_sampling import LayerImportanceSampler
+
+    torch.manual_seed(0)
+    graph = create_graph()
+    neighbourhood = get_edges(dgl.in_subgraph(graph, seeds))
+    sampler = LayerImportanceSampler([4, 7, 100])
+
+    # the last layer has fewer candidates than its size
+    for block_id, num_sampled in enumerate([4, 7, 18]):
+        for _ in range(10):
+            frontier = sampler.sample_frontier(block_id, graph, seeds)
+            edges = get_edges(frontier)
+            sampled = {(etype[0], src) for etype, src, _ in edges}
+
+            assert len(sampled) == num_sampled
+            # sampled nodes keep all their edges to the seeds
+            assert edges == {edge for edge in neighbourhood if (edge[0][0], edge[1]) in sampled}
+
+
+def test_layer_importance_sampler_keeps_seeds():
+    from SourceCodeTools.models.graph.train.neighbourhood_sampling import LayerImportanceSampler
+
+    torch.manual_seed(0)
+    graph = create_graph()
+    sampler = LayerImportanceSampler([1])
+
+    for _ in range(10):
+        block = dgl.to_block(sampler.sample_frontier(0, graph, seeds), seeds)
+
+        assert block.dstnodes["node"].data[dgl.NID].tolist() == [0, 1, 12]
+        assert block.srcnodes["node"].data[dgl.NID][:3].tolist() == [0, 1, 12]
+        assert block.num_edges() > 0
+
+
+def test_fallback_fanouts():
+    from SourceCodeTools.models.graph.train.neighbourhood_sampling import NeighbourhoodSampling, \
+        LayerImportanceSampler
+
+    graph = create_graph()
+    trainer_params = {"batch_size": 4, "sampling_neighbourhood_size": 3}
+
+    sampling = NeighbourhoodSampling.from_trainer_params({**trainer_params, "neighbourhood_sampler": "neighbour"})
+    assert sampling._get_layer_fanouts(graph, 3) == [3, 3, 3]
+
+    sampling = NeighbourhoodSampling.from_trainer_params({**trainer_params, "neighbourhood_sampler": "layer"})
+    sampler = sampling.create_block_sampler(graph, 2)
+    assert isinstance(sampler, LayerImportanceSampler)
+    assert sampler.layer_sizes == [12, 12]
+
+    # the last fanout is repeated for the remaining layers
+    sampling = NeighbourhoodSampling(mode="neighbour", fanouts=[5, 2])
+    assert sampling._get_layer_fanouts(graph, 3) == [5, 2, 2]
+
+    # edge types without a limit use the fanout of the layer
+    etype_a, etype_b = ("node", "a", "node"), ("word", "b", "node")
+    sampling = NeighbourhoodSampling(mode="neighbour", fanouts=[5, 2], edge_type_fanouts={"a": 3})
+    assert sampling._get_layer_fanouts(graph, 2) == [{etype_a: 3, etype_b: 5}, {etype_a: 2, etype_b: 2}]
+
+    sampling = NeighbourhoodSampling(mode="full", edge_type_fanouts={"b": 4})
+    assert sampling._get_layer_fanouts(graph, 2) == [{etype_a: -1, etype_b: 4}] * 2
@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+
+
+def discount(position):
+    return 1. / math.log2(position + 1)
+
+
+# query 0: positive candidate 2 is tied with candidate 1 and occupies positions 2 and 3
+# query 1: positive candidates 1 and 2 are at positions 1 and 3
+# query 2: no positive candidates
+scores = [
+    [0.9, 0.5, 0.5, 0.1],
+    [0.2, 0.8, 0.3, 0.7],
+    [0.1, 0.2, 0.3, 0.4],
+]
+query_ids = np.array([0, 1, 1])
+positions = np.array([2, 1, 2])
+
+expected = {
+    "hits@1": (0. + 1.) / 3,
+    "hits@3": (1. + 1.) / 3,
+    "ndcg@1": (0. + 1.) / 3,
+    # tied positive candidate gets the average discount of positions 2 and 3
+    "ndcg@3": (
+        (discount(2) + discount(3)) / 2 / discount(1) +
+        (discount(1) + discount(3)) / (discount(1) + discount(2))
+    ) / 3,
+    # ties are resolved in the order of candidates, rank of the first positive candidate of query 0 is 3
+    "mr": (3 + 1) / 2,
+    "mrr": (1 / 3 + 1.) / 2,
+    "map": (1 / 3 + (1 / 1 + 2 / 3) / 2) / 3,
+}
+
+
+def assert_metrics(computed):
+    assert computed.keys() == expected.keys()
+    for metric, value in expected.items():
+        assert math.isclose(computed[metric], value, rel_tol=1e-6), metric
+
+
+def test_ranking_metrics_hand_computed():
+    import torch
+    from SourceCodeTools.models.graph.train.Scorer import RankingMetrics
+
+    metrics = RankingMetrics([1, 3])
+    metrics.add(torch.tensor(scores), query_ids, positions)
+    assert_metrics(metrics.compute())
+
+
+def test_ranking_metrics_in_chunks():
+    import torch
+    from SourceCodeTools.models.graph.train.Scorer import RankingMetrics
+
+    metrics = RankingMetrics([1, 3])
+    metrics.add(torch.tensor(scores[:1]), query_ids[:1], positions[:1])
+    metrics.add(torch.tensor(scores[1:]), query_ids[1:] - 1, positions[1:])
+    assert_metrics(metrics.compute())
+
+
+def test_ranking_metrics_without_positives():
+    import torch
+    from SourceCodeTools.models.graph.train.Scorer import RankingMetrics
+
+    metrics = RankingMetrics([1, 3])
+    metrics.add(torch.tensor(scores), np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    computed = metrics.compute()
+
+    assert computed["hits@1"] == 0. and computed["ndcg@3"] == 0. and computed["map"] == 0.
+    assert math.isnan(computed["mr"]) and math.isnan(computed["mrr"])
+
+    computed = RankingMetrics([1, 3]).compute()
+    assert all(math.isnan(value) for value in computed.values())
@@ -0,0 +1,34 @@
+import torch
+
+
+class RecordingLinkPredictor(torch.nn.Module):
+    """
+    Scores pairs by the inner product of their embeddings and records the number of pairs in every forward pass.
+    """
+    def __init__(self):
+        super(RecordingLinkPredictor, self).__init__()
+        self.num_pairs = []
+
+    def forward(self, x1, x2):
+        self.num_pairs.append(x1.shape[0])
+        score = (x1 * x2).sum(dim=1, keepdim=True)
+        return torch.cat([-score, score], dim=1)
+
+
+def test_score_candidates_lp_limits_pairs():
+    from SourceCodeTools.models.graph.train.Scorer import Scorer
+
+    scorer = Scorer(num_embs=10, emb_size=4, src2dst={0: list(range(10))})
+    queries = torch.rand(3, 4)
+    candidates = torch.rand(10, 4)
+
+    link_predictor = RecordingLinkPredictor()
+    expected = scorer.score_candidates_lp(None, queries, None, candidates, link_predictor)
+    assert link_predictor.num_pairs == [30]
+
+    scorer.set_max_pairs(7)
+    link_predictor = RecordingLinkPredictor()
+    computed = scorer.score_candidates_lp(None, queries, None, candidates, link_predictor)
+    # two candidates for each of three queries in every forward pass
+    assert link_predictor.num_pairs == [6] * 5
+    assert torch.allclose(computed, expected)
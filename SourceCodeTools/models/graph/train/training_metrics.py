@@ -0,0 +1,124 @@
+import torch
+
+
+def get_grad_norm(parameters):
+    """
+    Compute global norm of gradients without copying intermediate results to the host, the same way as in
+    `torch.nn.utils.clip_grad_norm_`.
+    :param parameters: iterable with parameters
+    :return: tensor with the norm, or None if there are no gradients
+    """
+    norms = [param.grad.detach().norm(2) for param in parameters if param.grad is not None]
+    if len(norms) == 0:
+        return None
+    device = norms[0].device
+    return torch.norm(torch.stack([norm.to(device) for norm in norms]), 2)
+
+
+class TrainingMetrics:
+    """
+    Accumulates training metrics on the device and writes them to the summary every `flush_interval` steps. Values
+    of all steps since the last flush are copied to the host with a single transfer. On GPU the transfer is
+    asynchronous, and the values are written during the next flush, so that the training loop does not wait for the
+    device.
+    """
+    def __init__(self, summary_writer, device, flush_interval=1):
+        """
+        :param summary_writer: tensorboard SummaryWriter
+        :param device: device where metrics are accumulated
+        :param flush_interval: number of steps between transfers of metrics to the host
+        """
+        self.summary_writer = summary_writer
+        self.device = torch.device(device)
+        self.flush_interval = max(1, flush_interval)
+
+        self.records = []  # (step, name) for every value in `values`
+        self.values = []
+        self.num_steps = 0
+        self.in_transfer = None
+
+        self.average_sums = {}
+        self.average_counts = {}
+        self.last_values = {}
+
+    def _as_tensor(self, value):
+        if isinstance(value, torch.Tensor):
+            return value.detach().float().reshape(())
+        return torch.tensor(float(value), device=self.device)
+
+    def add(self, step, scores):
+        """
+        Record values for the step.
+        :param scores: dictionary with metric names and values, values are tensors or numbers
+        """
+        for name, value in scores.items():
+            self.records.append((step, name))
+            self.values.append(self._as_tensor(value).to(self.device))
+
+    def add_averaged(self, step, scores):
+        """
+        Record running averages of metrics over all steps recorded with this object. The trainer creates new metrics
+        for every epoch, therefore, averages are computed within an epoch.
+        :param scores: dictionary with metric names and values of the current step
+        """
+        averages = {}
+        for name, value in scores.items():
+            value = self._as_tensor(value).to(self.device)
+            if name in self.average_sums:
+                self.average_sums[name] = self.average_sums[name] + value
+                self.average_counts[name] += 1
+            else:
+                self.average_sums[name] = value
+                self.average_counts[name] = 1
+            averages[name] = self.average_sums[name] / self.average_counts[name]
+        self.add(step, averages)
+
+    def step(self):
+        """
+        Mark the end of a training step, metrics are transferred every `flush_interval` steps.
+        """
+        self.num_steps += 1
+        if self.num_steps % self.flush_interval == 0:
+            self.flush()
+
+    def _write(self):
+        if self.in_transfer is None:
+            return
+        records, values, event = self.in_transfer
+        if event is not None:
+            event.synchronize()
+        for (step, name), value in zip(records, values.tolist()):
+            self.summary_writer.add_scalar(name, value, step)
+            self.last_values[name] = value
+        self.in_transfer = None
+
+    def flush(self, wait=False):
+        """
+        Start transfer of recorded metrics to the host, and write metrics from the previous transfer.
+        :param wait: write all metrics before returning
+        """
+        self._write()
+
+        if len(self.values) > 0:
+            values = torch.stack(self.values)
+            event = None
+            if values.is_cuda:
+                host_values = torch.empty(values.shape, dtype=values.dtype, pin_memory=True)
+                host_values.copy_(values, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+                values = host_values
+            self.in_transfer = (self.records, values, event)
+            self.records = []
+            self.values = []
+
+        if wait:
+            self._write()
+
+    def finish(self):
+        """
+        Write all recorded metrics.
+        :return: dictionary with the last written value of every metric
+        """
+        self.flush(wait=True)
+        return dict(self.last_values)
@@ -0,0 +1,259 @@
+import logging
+
+import numpy as np
+
+
+def _find_positions(sorted_values, sorter, values):
+    """
+    Find positions of values in the array that was sorted with `sorter`.
+    :return: array of positions, -1 for values that are not present
+    """
+    values = np.asarray(values, dtype=sorted_values.dtype)
+    if len(sorted_values) == 0 or len(values) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    found = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return np.where(sorted_values[found] == values, sorter[found], -1)
+
+
+def _flatten_rows(rows):
+    """
+    :param rows: list of iterables
+    :return: array with row id of every element and flat list of elements
+    """
+    row_ids = []
+    elements = []
+    for row_id, row in enumerate(rows):
+        row = list(row)
+        row_ids.extend([row_id] * len(row))
+        elements.extend(row)
+    return np.array(row_ids, dtype=np.int64), elements
+
+
+class AliasSampler:
+    """
+    Samples values from a discrete distribution with Walker's alias method. The alias table is built once, and every
+    sample takes constant time, while `np.random.choice` with probabilities processes the whole distribution on every
+    call. Values excluded for a particular query, e.g. positive examples, are rejected and sampled again.
+    """
+    def __init__(self, values, weights=None, power=1.):
+        """
+        :param values: values to sample
+        :param weights: unnormalized weights of values, uniform distribution is used when not given
+        :param power: power applied to weights, 0.75 gives unigram distribution used for negative sampling in word2vec
+        """
+        self.values = np.asarray(values)
+        if weights is None:
+            probs = np.full(len(self.values), 1. / len(self.values))
+        else:
+            probs = np.asarray(weights, dtype=np.float64) ** power
+            probs /= probs.sum()
+        self.probs = probs
+
+        self.threshold, self.alias = self._build_table(probs)
+
+        self.sorter = np.argsort(self.values, kind="stable")
+        self.sorted_values = self.values[self.sorter]
+        self.tensors = {}
+
+    @staticmethod
+    def _build_table(probs):
+        num_values = len(probs)
+        scaled = probs * num_values
+        threshold = np.ones(num_values)
+        alias = np.arange(num_values)
+
+        small = np.flatnonzero(scaled < 1.).tolist()
+        large = np.flatnonzero(scaled >= 1.).tolist()
+        while len(small) > 0 and len(large) > 0:
+            less, more = small.pop(), large.pop()
+            threshold[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.
+            if scaled[more] < 1.:
+                small.append(more)
+            else:
+                large.append(more)
+        # remaining columns are full up to rounding errors
+        return threshold, alias
+
+    def __len__(self):
+        return len(self.values)
+
+    def sample_positions(self, size):
+        columns = np.random.randint(0, len(self.values), size=size)
+        accepted = np.random.random(size) < self.threshold[columns]
+        return np.where(accepted, columns, self.alias[columns])
+
+    def sample(self, size):
+        """
+        :return: array with `size` sampled values
+        """
+        return self.values[self.sample_positions(size)]
+
+    def get_positions(self, values):
+        """
+        :return: positions of values in the sampler, -1 for unknown values
+        """
+        return _find_positions(self.sorted_values, self.sorter, values)
+
+    def sample_excluding(self, exclude, k, max_tries=16):
+        """
+        Sample `k` values for every query, so that values excluded for the query are not sampled.
+        :param exclude: list with iterables of excluded values for every query
+        :param k: number of samples for every query
+        :param max_tries: number of rejection rounds, remaining samples are drawn from explicitly filtered values.
+            When all values are excluded for a query, its samples are drawn without exclusion.
+        :return: array with shape (number of queries, k)
+        """
+        num_queries = len(exclude)
+        num_values = len(self.values)
+        row_ids, excluded = _flatten_rows(exclude)
+        excluded = self.get_positions(excluded)
+        is_known = excluded != -1
+        # pairs of query and position are packed into a single integer for membership tests
+        excluded_pairs = np.unique(row_ids[is_known] * num_values + excluded[is_known])
+
+        sampled = self.sample_positions((num_queries, k))
+        query_ids = np.repeat(np.arange(num_queries), k).reshape(num_queries, k)
+
+        def is_excluded(positions, queries):
+            return np.isin(queries * num_values + positions, excluded_pairs)
+
+        rejected = is_excluded(sampled, query_ids)
+        for _ in range(max_tries):
+            if not rejected.any():
+                break
+            sampled[rejected] = self.sample_positions(rejected.sum())
+            rejected[rejected] = is_excluded(sampled[rejected], query_ids[rejected])
+
+        for query in np.unique(query_ids[rejected]):
+            query_rejected = rejected[query]
+            allowed = np.setdiff1d(
+                np.arange(num_values), excluded_pairs[excluded_pairs // num_values == query] % num_values
+            )
+            if len(allowed) == 0:
+                # e.g. a node that is connected to every candidate, samples are kept as they are
+                logging.warning(f"All values are excluded for query {query}, sampling without exclusion")
+                continue
+            allowed_probs = self.probs[allowed]
+            if allowed_probs.sum() > 0:
+                probs = allowed_probs / allowed_probs.sum()
+            else:
+                probs = None  # uniform sampling among allowed values
+            sampled[query, query_rejected] = np.random.choice(allowed, size=query_rejected.sum(), p=probs)
+
+        return self.values[sampled]
+
+    def sample_tensor(self, size, device="cpu"):
+        """
+        Sample positions of values on the device without transferring the alias table at every call.
+        :return: tensor with positions of sampled values
+        """
+        import torch
+
+        device = torch.device(device)
+        if device not in self.tensors:
+            self.tensors[device] = (
+                torch.tensor(self.threshold, dtype=torch.float32, device=device),
+                torch.tensor(self.alias, dtype=torch.long, device=device)
+            )
+        threshold, alias = self.tensors[device]
+        columns = torch.randint(0, len(self.values), (size,), device=device)
+        accepted = torch.rand(size, device=device) < threshold[columns]
+        return torch.where(accepted, columns, alias[columns])
+
+
+class GroupedSampler:
+    """
+    Samples values uniformly within groups, e.g. negative examples from the same file. Every value belongs to one
+    group. When a group does not have enough candidates, samples are drawn from the fallback sampler with the
+    probability of missing candidates.
+    """
+    def __init__(self, groups, fallback=None):
+        """
+        :param groups: dictionary with the list of values for every group
+        :param fallback: AliasSampler used when groups do not have enough candidates
+        """
+        self.group_names = list(groups.keys())
+        self.group_index = dict(zip(self.group_names, range(len(self.group_names))))
+        self.counts = np.array([len(groups[group]) for group in self.group_names], dtype=np.int64)
+        self.offsets = np.cumsum(self.counts) - self.counts
+        self.values = np.array([value for group in self.group_names for value in groups[group]])
+        self.value_groups = np.repeat(np.arange(len(self.group_names)), self.counts)
+        # unknown groups are mapped to an additional empty group
+        self.counts = np.append(self.counts, 0)
+        self.offsets = np.append(self.offsets, len(self.values))
+
+        self.sorter = np.argsort(self.values, kind="stable")
+        self.sorted_values = self.values[self.sorter]
+        self.fallback = fallback
+
+    def _count_candidates(self, group_ids, exclude):
+        """
+        Count values of the group of every query that are not excluded for the query.
+        """
+        row_ids, excluded = _flatten_rows(exclude)
+        excluded = _find_positions(self.sorted_values, self.sorter, excluded)
+        in_group = excluded != -1
+        in_group[in_group] = self.value_groups[excluded[in_group]] == group_ids[row_ids[in_group]]
+        # values can repeat in the list of excluded values
+        pairs = np.unique(row_ids[in_group] * len(self.values) + excluded[in_group])
+        num_excluded = np.bincount(pairs // len(self.values), minlength=len(group_ids))
+        return self.counts[group_ids] - num_excluded, pairs
+
+    def sample(self, groups, exclude, k, min_candidates=None, max_tries=16):
+        """
+        Sample `k` values for every query from its group.
+        :param groups: list with the group of every query
+        :param exclude: list with iterables of excluded values for every query
+        :param k: number of samples for every query
+        :param min_candidates: minimum number of candidates in the group, when the group has `m` candidates, each
+            sample is taken from the group with probability `m / min_candidates`, and from the fallback sampler
+            otherwise. Equals `k` by default.
+        :return: array with shape (number of queries, k)
+        """
+        if min_candidates is None:
+            min_candidates = k
+        num_queries = len(groups)
+        empty_group = len(self.group_names)
+        group_ids = np.array([self.group_index.get(group, empty_group) for group in groups], dtype=np.int64)
+        num_candidates, excluded_pairs = self._count_candidates(group_ids, exclude)
+
+        from_group = np.random.random((num_queries, k)) * min_candidates < num_candidates[:, None]
+        query_ids = np.repeat(np.arange(num_queries), k).reshape(num_queries, k)
+
+        def sample_in_group(queries):
+            group = group_ids[queries]
+            return self.offsets[group] + (np.random.random(len(queries)) * self.counts[group]).astype(np.int64)
+
+        def is_excluded(positions, queries):
+            return np.isin(queries * len(self.values) + positions, excluded_pairs)
+
+        sampled = np.zeros((num_queries, k), dtype=np.int64)
+        sampled[from_group] = sample_in_group(query_ids[from_group])
+        rejected = from_group.copy()
+        rejected[from_group] = is_excluded(sampled[from_group], query_ids[from_group])
+        for _ in range(max_tries):
+            if not rejected.any():
+                break
+            sampled[rejected] = sample_in_group(query_ids[rejected])
+            rejected[rejected] = is_excluded(sampled[rejected], query_ids[rejected])
+
+        for query in np.unique(query_ids[rejected]):
+            group = group_ids[query]
+            group_positions = np.arange(self.offsets[group], self.offsets[group] + self.counts[group])
+            allowed = np.setdiff1d(
+                group_positions, excluded_pairs[excluded_pairs // len(self.values) == query] % len(self.values)
+            )
+            sampled[query, rejected[query]] = np.random.choice(allowed, size=rejected[query].sum())
+
+        result = np.empty((num_queries, k), dtype=self.values.dtype)
+        result[from_group] = self.values[sampled[from_group]]
+        if not from_group.all():
+            if self.fallback is None:
+                raise ValueError("Groups do not have enough candidates and fallback sampler is not provided")
+            from_fallback = ~from_group
+            fallback_queries = np.flatnonzero(from_fallback.any(axis=1))
+            fallback = self.fallback.sample_excluding([exclude[query] for query in fallback_queries], k)
+            result[from_fallback] = fallback[from_fallback[fallback_queries]]
+        return result
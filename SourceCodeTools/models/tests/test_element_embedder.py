@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+
+def test_negatives_are_aligned_with_repeated_batch():
+    """
+    Negatives are paired with `node_embeddings_batch.repeat(k, 1)` in `AbstractObjective.prepare_for_prediction`,
+    negative `j` belongs to batch node `j % len(ids)`.
+    """
+    from SourceCodeTools.models.graph.ElementEmbedderBase import ElementEmbedderBase
+
+    np.random.seed(0)
+    num_nodes = 6
+    nodes = pd.DataFrame({
+        "id": np.arange(num_nodes), "global_graph_id": np.arange(num_nodes), "typed_id": np.arange(num_nodes),
+        "type": ["node"] * num_nodes,
+    })
+    # every node has a few positive targets out of 8
+    rnd = np.random.RandomState(0)
+    elements = pd.DataFrame([
+        {"src": src, "dst": f"target_{dst}"}
+        for src in range(num_nodes) for dst in rnd.choice(8, size=3, replace=False)
+    ])
+    embedder = ElementEmbedderBase(elements, nodes)
+
+    ids = [0, 3, 5, 1]
+    k = 5
+    negative = embedder.sample_negative(len(ids) * k, ids=ids)
+
+    assert len(negative) == len(ids) * k
+    for j, target in enumerate(negative):
+        assert target not in embedder.element_lookup[ids[j % len(ids)]]
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def test_alias_sampler_frequencies():
+    from SourceCodeTools.models.negative_sampling import AliasSampler
+
+    np.random.seed(0)
+    values = np.array([10, 20, 30, 40, 50])
+    weights = np.array([1., 2., 3., 4., 0.])
+    sampler = AliasSampler(values, weights, power=0.75)
+
+    samples = sampler.sample(200000)
+    frequencies = np.array([(samples == value).mean() for value in values])
+
+    expected = weights ** 0.75 / (weights ** 0.75).sum()
+    assert np.allclose(sampler.probs, expected)
+    assert np.allclose(frequencies, expected, atol=0.005)
+    assert frequencies[-1] == 0.
+
+
+def test_alias_sampler_excludes_values():
+    from SourceCodeTools.models.negative_sampling import AliasSampler
+
+    np.random.seed(1)
+    values = np.arange(100, 110)
+    weights = np.arange(1, 11)
+    sampler = AliasSampler(values, weights)
+
+    exclude = [[100, 101, 102], [109], [], [105, 105, 999]]
+    samples = sampler.sample_excluding(exclude, k=20000)
+
+    assert samples.shape == (len(exclude), 20000)
+    for query_samples, excluded in zip(samples, exclude):
+        assert not np.isin(query_samples, excluded).any()
+
+    # remaining values keep their relative frequencies
+    allowed = np.setdiff1d(values, exclude[0])
+    expected = sampler.probs[allowed - 100] / sampler.probs[allowed - 100].sum()
+    frequencies = np.array([(samples[0] == value).mean() for value in allowed])
+    assert np.allclose(frequencies, expected, atol=0.01)
+
+
+def test_alias_sampler_all_values_excluded():
+    from SourceCodeTools.models.negative_sampling import AliasSampler
+
+    np.random.seed(2)
+    sampler = AliasSampler([1, 2, 3])
+
+    samples = sampler.sample_excluding([[1, 2, 3], [1]], k=50)
+
+    assert samples.shape == (2, 50)
+    assert np.isin(samples[0], [1, 2, 3]).all()
+    assert np.isin(samples[1], [2, 3]).all()
+
+
+def test_alias_sampler_allowed_values_with_zero_probability():
+    from SourceCodeTools.models.negative_sampling import AliasSampler
+
+    np.random.seed(3)
+    sampler = AliasSampler([1, 2, 3, 4], weights=[1., 0., 0., 0.])
+
+    samples = sampler.sample_excluding([[1]], k=3000)
+
+    assert np.isin(samples, [2, 3, 4]).all()
+    frequencies = np.array([(samples == value).mean() for value in [2, 3, 4]])
+    assert np.allclose(frequencies, 1 / 3, atol=0.05)
+
+
+def test_grouped_sampler():
+    from SourceCodeTools.models.negative_sampling import AliasSampler, GroupedSampler
+
+    np.random.seed(4)
+    groups = {"a": [1, 2, 3, 4], "b": [5, 6], "c": [7]}
+    fallback = AliasSampler(np.arange(1, 20))
+    sampler = GroupedSampler(groups, fallback=fallback)
+
+    samples = sampler.sample(["a", "b", "c", "unknown"], exclude=[[1], [5, 6], [], [8]], k=1000, min_candidates=3)
+
+    # group "a" has enough candidates
+    assert np.isin(samples[0], [2, 3, 4]).all()
+    assert np.allclose([(samples[0] == value).mean() for value in [2, 3, 4]], 1 / 3, atol=0.05)
+    # all candidates of group "b" are excluded, samples come from the fallback sampler
+    assert not np.isin(samples[1], [5, 6]).any()
+    # group "c" has a single candidate that is sampled with probability 1 / min_candidates
+    assert abs((samples[2] == 7).mean() - (1 / 3 + 2 / 3 / 19)) < 0.05
+    # unknown group samples from the fallback sampler
+    assert not np.isin(samples[3], [8]).any()
+    assert np.isin(samples[3], np.arange(1, 20)).all()
@@ -19,7 +19,8 @@ config_specification = {
         "restricted_id_pool": None,
         "random_seed": None,
         "subgraph_id_column": "mentioned_in",
-        "subgraph_partition": None
+        "subgraph_partition": None,
+        "dataset_cache_dir": None
     },
     "TRAINING": {
         "model_output_dir": None,
@@ -27,6 +28,13 @@ config_specification = {
         "pretraining_phase": 0,
 
         "sampling_neighbourhood_size": 10,
+        "neighbourhood_sampler": "full",
+        "sampling_fanouts": None,
+        "edge_type_fanouts": None,
+        "layer_sampling_size": None,
+        "loader_workers": 0,
+        "loader_prefetch_factor": 2,
+        "prefetch_batches": 0,
         "neg_sampling_factor": 3,
         "use_layer_scheduling": False,
         "schedule_layers_every": 10,
@@ -47,11 +55,17 @@ config_specification = {
         "force_w2v_ns": False,
         "use_ns_groups": False,
         "nn_index": "brute",
+        "index_refresh_interval": 1,
+        "index_staleness_threshold": None,
 
         "metric": "inner_prod",
 
         "measure_scores": False,
         "dilate_scores": 200,  # downsample
+        "scoring_max_pairs": 65536,
+        "summary_interval": 1,
+        "mmap_embeddings": False,
+        "mmap_embeddings_dtype": "float32",
 
         "gpu": -1,
 
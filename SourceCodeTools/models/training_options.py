@@ -15,6 +15,7 @@ def add_data_arguments(parser):
     parser.add_argument('--restricted_id_pool', dest='restricted_id_pool', default=None, help='???')
     parser.add_argument('--subgraph_partition', default=None)
     parser.add_argument('--subgraph_id_column', default=None)
+    parser.add_argument('--dataset_cache_dir', dest='dataset_cache_dir', default=None, help='Directory for preprocessed datasets shared between experiments')
 
 
 def add_pretraining_arguments(parser):
@@ -30,6 +31,13 @@ def add_training_arguments(parser):
     parser.add_argument('--node_emb_size', dest='node_emb_size', default=100, type=int, help='Dimensionality of node embeddings')
     parser.add_argument('--elem_emb_size', dest='elem_emb_size', default=100, type=int, help='Dimensionality of target embeddings (node names). Should match node embeddings when cosine distance loss is used')
     parser.add_argument('--sampling_neighbourhood_size', dest='sampling_neighbourhood_size', default=10, type=int, help='Number of dependencies to sample per node')
+    parser.add_argument('--neighbourhood_sampler', dest='neighbourhood_sampler', default="full", choices=["full", "neighbour", "layer"], help='Neighbourhood sampling for objectives: all neighbours, fixed number of neighbours per node, or fixed number of nodes per layer')
+    parser.add_argument('--sampling_fanouts', dest='sampling_fanouts', default=None, type=str, help='Comma separated number of neighbours for every layer, starting from the input layer. `sampling_neighbourhood_size` is used by default')
+    parser.add_argument('--edge_type_fanouts', dest='edge_type_fanouts', default=None, type=str, help='Comma separated limits for the number of neighbours of edge types, e.g. `defined_in_module:5,calls:10`')
+    parser.add_argument('--layer_sampling_size', dest='layer_sampling_size', default=None, type=str, help='Comma separated number of nodes sampled for every layer in `layer` sampling mode')
+    parser.add_argument('--loader_workers', dest='loader_workers', default=0, type=int, help='Number of worker processes for sampling batches')
+    parser.add_argument('--loader_prefetch_factor', dest='loader_prefetch_factor', default=2, type=int, help='Number of batches prefetched by every worker')
+    parser.add_argument('--prefetch_batches', dest='prefetch_batches', default=0, type=int, help='Number of training steps prepared in a background thread for all objectives, 0 disables prefetching')
     parser.add_argument('--neg_sampling_factor', dest='neg_sampling_factor', default=3, type=int, help='Number of negative samples for each positive')
 
     parser.add_argument('--use_layer_scheduling', action='store_true', help='???')
@@ -50,6 +58,8 @@ def add_training_arguments(parser):
 
     parser.add_argument("--metric", default="inner_prod", type=str, help='???')
     parser.add_argument("--nn_index", default="brute", type=str, help='Index backend for generating negative samples???')
+    parser.add_argument("--index_refresh_interval", default=1, type=int, help='Number of training steps between refreshes of target indices used for negative sampling')
+    parser.add_argument("--index_staleness_threshold", default=None, type=float, help='Refresh target index earlier when mean relative change of sampled target embeddings exceeds this value')
 
     parser.add_argument("--external_dataset", default=None, type=str, help='Path to external graph, use for inference')
 
@@ -57,6 +67,10 @@ def add_training_arguments(parser):
 def add_scoring_arguments(parser):
     parser.add_argument('--measure_scores', action='store_true')
     parser.add_argument('--dilate_scores', dest='dilate_scores', default=200, type=int, help='')
+    parser.add_argument('--scoring_max_pairs', dest='scoring_max_pairs', default=65536, type=int, help='Maximum number of query and candidate pairs scored at once by a link predictor when measuring ranking scores')
+    parser.add_argument('--summary_interval', dest='summary_interval', default=1, type=int, help='Number of training steps between transfers of training metrics from the device to the summary')
+    parser.add_argument('--mmap_embeddings', action='store_true', help='Compute final node embeddings layer by layer into memory mapped files in the model directory')
+    parser.add_argument('--mmap_embeddings_dtype', dest='mmap_embeddings_dtype', default="float32", choices=["float16", "float32"], help='Data type of memory mapped node embeddings')
 
 
 def add_performance_arguments(parser):
@@ -2,8 +2,9 @@ import hashlib
 import json
 import random
 import tempfile
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from copy import copy
+from multiprocessing import Pool
 from pathlib import Path
 from math import ceil
 from typing import Dict, Optional, Union
@@ -39,6 +40,19 @@ def filter_unlabeled(entities, declarations):
     return for_mask
 
 
+_worker_batcher = None
+
+
+def _init_encoding_worker(batcher):
+    global _worker_batcher
+    _worker_batcher = batcher
+
+
+def _encode_in_worker(record):
+    id_, text, annotations = record
+    return _worker_batcher._encode_record(_worker_batcher._prepare_record(id_, text, annotations))
+
+
 def print_token_tag(doc, tags):
     for t, tag in zip(doc, tags):
         print(t, "\t", tag)
@@ -86,8 +100,19 @@ class Batcher:
             self, data, batch_size: int, seq_len: int,
             wordmap: Dict[str, int], *, tagmap: Optional[TagMap] = None,
             class_weights=False, sort_by_length=True, tokenizer="spacy", no_localization=False,
-            cache_dir: Optional[Union[str, Path]] = None, **kwargs
+            cache_dir: Optional[Union[str, Path]] = None, cache_commit_interval: int = 1000,
+            hot_cache_size: int = 10000, preencode: bool = False, num_workers: int = 1, **kwargs
     ):
+        """
+        Encoded records are looked up in an in-memory LRU cache, then in preencoded rows, and then in the batch cache
+        on disk. Records that are encoded during iteration are written to the batch cache in bulk.
+        :param cache_commit_interval: number of newly encoded records after which the batch cache is saved, pending
+            records are also saved at the end of every pass over the data
+        :param hot_cache_size: number of encoded records kept in memory, 0 disables the in-memory cache
+        :param preencode: encode all records before training and store them in a memory mapped array with a fixed
+            length row for every record
+        :param num_workers: number of processes used for preencoding
+        """
         self._data = data
         self._batch_size = batch_size
         self._max_seq_len = seq_len
@@ -104,11 +129,19 @@ class Batcher:
         self._sort_by_length = sort_by_length
         self._data_ids = set()
         self._batch_generator = None
+        self._cache_commit_interval = max(1, cache_commit_interval)
+        self._hot_cache_size = hot_cache_size
+        self._hot_cache = OrderedDict()
+        self._pending_batch_records = {}
+        self._preencoded = None
 
         self._create_cache()
         self._prepare_data()
         self._create_mappers(**kwargs)
 
+        if preencode:
+            self._preencode(num_workers)
+
     @property
     def _data_cache_path(self):
         return self._get_cache_location_name("DataCache")
@@ -121,6 +154,12 @@ class Batcher:
     def _batch_cache_path(self):
         return self._get_cache_location_name("BatchCache")
 
+    @property
+    def _preencoded_path(self):
+        # train and test batchers share the cache directory, rows are stored for a particular set of records
+        ids = ",".join(map(str, sorted(self._iterate_record_ids())))
+        return self._get_cache_location_name(f"Preencoded{self._compute_text_id(ids)}")
+
     @property
     def _length_cache_path(self):
         return self._get_cache_location_name("LengthCache")
@@ -189,6 +228,22 @@ class Batcher:
         self._length_cache = KVStore(self._length_cache_path)
         self._batch_cache = KVStore(self._batch_cache_path)
 
+    def __getstate__(self):
+        # state sent to preencoding workers, caches and tokenizer are not picklable
+        excluded = {
+            "_data", "_nlp", "_data_cache", "_length_cache", "_batch_cache", "_tmp_dir", "_batch_generator",
+            "_mappers", "_hot_cache", "_pending_batch_records", "_preencoded"
+        }
+        return {key: value for key, value in self.__dict__.items() if key not in excluded}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._nlp = create_tokenizer(self._tokenizer)
+        self._hot_cache = OrderedDict()
+        self._pending_batch_records = {}
+        self._preencoded = None
+        self._create_mappers()
+
     @staticmethod
     def _compute_text_id(text):
         return abs(int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16)) % 1152921504606846976
@@ -392,11 +447,7 @@ class Batcher:
             MapperSpec(field="tokens", target_field="tok_ids", encoder=wordmap_enc)
         )
 
-    # @lru_cache(maxsize=200000)
-    def _encode_for_batch(self, record):
-
-        if record.id in self._batch_cache:
-            return self._batch_cache[record.id]
+    def _encode_record(self, record):
 
         def encode(seq, encoder, pad, preproc_fn=None):
             if preproc_fn is None:
@@ -433,11 +484,144 @@ class Batcher:
         output["lens"] = np.array(num_tokens if num_tokens < self._max_seq_len else self._max_seq_len, dtype=np.int32)
         output["id"] = record.id
 
-        self._batch_cache[record.id] = output
+        return output
+
+    def _remember(self, id_, output):
+        if self._hot_cache_size <= 0:
+            return
+        self._hot_cache[id_] = output
+        if len(self._hot_cache) > self._hot_cache_size:
+            self._hot_cache.popitem(last=False)
+
+    def _get_cached_encoding(self, id_):
+        """
+        Look up encoded record in the in-memory cache, preencoded rows, records waiting to be written, and the batch
+        cache.
+        :return: encoded record or None
+        """
+        if id_ in self._hot_cache:
+            self._hot_cache.move_to_end(id_)
+            return self._hot_cache[id_]
+
+        if self._preencoded is not None and id_ in self._preencoded["rows"]:
+            output = self._unpack_row(self._preencoded["array"][self._preencoded["rows"][id_]], id_)
+        elif id_ in self._pending_batch_records:
+            output = self._pending_batch_records[id_]
+        elif id_ in self._batch_cache:
+            output = self._batch_cache[id_]
+        else:
+            return None
+
+        self._remember(id_, output)
+        return output
+
+    def _store_encoded(self, id_, output):
+        self._pending_batch_records[id_] = output
+        self._remember(id_, output)
+        if len(self._pending_batch_records) >= self._cache_commit_interval:
+            self._commit_batch_cache()
+
+    def _commit_batch_cache(self):
+        """
+        Write pending encoded records to the batch cache and save its index once.
+        """
+        if len(self._pending_batch_records) == 0:
+            return
+        for id_, output in self._pending_batch_records.items():
+            self._batch_cache[id_] = output
         self._batch_cache.save()
+        self._pending_batch_records.clear()
+
+    def _encode_for_batch(self, record):
+        output = self._get_cached_encoding(record.id)
+        if output is None:
+            output = self._encode_record(record)
+            self._store_encoded(record.id, output)
+        return output
+
+    @staticmethod
+    def _get_row_layout(output):
+        """
+        Compute positions of fields of an encoded record in a packed int32 row.
+        :return: list of (field, offset, width, dtype, shape) and row width
+        """
+        layout = []
+        offset = 0
+        for field, value in output.items():
+            if field == "id":
+                continue
+            value = np.asarray(value)
+            layout.append((field, offset, int(value.size), value.dtype.str, list(value.shape)))
+            offset += int(value.size)
+        return layout, offset
 
+    def _unpack_row(self, row, id_):
+        output = {}
+        for field, offset, width, dtype, shape in self._preencoded["layout"]:
+            output[field] = np.asarray(row[offset: offset + width]).astype(dtype).reshape(shape)
+        output["id"] = id_
         return output
 
+    def _iterate_preencoding_inputs(self, ids):
+        for id_ in ids:
+            text, annotations = self._data_cache[id_]
+            yield id_, text, annotations
+
+    def _encode_records(self, ids, num_workers):
+        inputs = self._iterate_preencoding_inputs(ids)
+        if num_workers > 1:
+            with Pool(num_workers, initializer=_init_encoding_worker, initargs=(self,)) as pool:
+                yield from pool.imap(_encode_in_worker, inputs, chunksize=64)
+            return
+
+        for id_, text, annotations in inputs:
+            yield self._encode_record(self._prepare_record(id_, text, annotations))
+
+    def _preencode(self, num_workers=1):
+        """
+        Encode all records that fit into the maximum sequence length and store them as fixed length int32 rows
+        of a single memory mapped array. Rows are reused when the batcher is created again for the same records.
+        :param num_workers: number of processes used for encoding
+        """
+        path = Path(self._preencoded_path)
+        array_path = path.joinpath("rows.npy")
+        ids_path = path.joinpath("ids.npy")
+        layout_path = path.joinpath("layout.json")
+
+        if not layout_path.is_file():
+            ids = [id_ for id_ in self._iterate_record_ids() if self._length_cache[id_] < self._max_seq_len]
+            if len(ids) == 0:
+                return
+            tmp_path = Path(str(path) + ".tmp")
+            tmp_path.mkdir(parents=True, exist_ok=True)
+            np.save(tmp_path.joinpath("ids.npy"), np.array(ids, dtype=np.int64))
+
+            array = None
+            layout = None
+            for position, output in enumerate(
+                    tqdm(self._encode_records(ids, num_workers), total=len(ids), desc="Preencoding records")
+            ):
+                if array is None:
+                    layout, row_width = self._get_row_layout(output)
+                    array = np.lib.format.open_memmap(
+                        tmp_path.joinpath("rows.npy"), mode="w+", dtype=np.int32, shape=(len(ids), row_width)
+                    )
+                for field, offset, width, _, _ in layout:
+                    array[position, offset: offset + width] = np.asarray(output[field]).reshape(-1)
+
+            array.flush()
+            del array
+            # layout is written last and marks complete rows
+            write_mapping_to_json(layout, tmp_path.joinpath("layout.json"))
+            tmp_path.rename(path)
+
+        ids = np.load(ids_path)
+        self._preencoded = {
+            "array": np.load(array_path, mmap_mode="r"),
+            "rows": dict(zip(ids.tolist(), range(len(ids)))),
+            "layout": read_mapping_from_json(layout_path)
+        }
+
     def format_batch(self, batch):
         fbatch = defaultdict(list)
 
@@ -472,23 +656,27 @@ class Batcher:
         else:
             records = self._iterate_records(limit_max_length=True, shuffle=False)
 
-        for id_ in records:
-            if id_ in self._batch_cache:
-                batch.append(self._batch_cache[id_])
-            else:
-                batch.append(self._encode_for_batch(self.get_record_with_id(id_)))
-            if len(batch) >= self._batch_size:
+        try:
+            for id_ in records:
+                encoded = self._get_cached_encoding(id_)
+                if encoded is None:
+                    encoded = self._encode_for_batch(self.get_record_with_id(id_))
+                batch.append(encoded)
+                if len(batch) >= self._batch_size:
+                    yield self.format_batch(batch)
+                    batch.clear()
+
+            # for sent in records:
+            #     batch.append(self._encode_for_batch(sent))
+            #     if len(batch) >= self._batch_size:
+            #         yield self.format_batch(batch)
+            #         batch = []
+            if len(batch) > 0:
                 yield self.format_batch(batch)
-                batch.clear()
-
-        # for sent in records:
-        #     batch.append(self._encode_for_batch(sent))
-        #     if len(batch) >= self._batch_size:
-        #         yield self.format_batch(batch)
-        #         batch = []
-        if len(batch) > 0:
-            yield self.format_batch(batch)
-        # yield self.format_batch(batch)
+            # yield self.format_batch(batch)
+        finally:
+            # records encoded during the pass are committed even when iteration is interrupted
+            self._commit_batch_cache()
 
     def __iter__(self):
         self._batch_generator = self.generate_batches()
@@ -140,6 +140,15 @@ class ModelTrainer:
     def classes_for(self):
         return "tags"
 
+    @property
+    def batch_cache_params(self):
+        return {
+            "cache_commit_interval": self.trainer_params.get("batch_cache_commit_interval", 1000),
+            "hot_cache_size": self.trainer_params.get("batch_hot_cache_size", 10000),
+            "preencode": self.trainer_params.get("preencode_batches", False),
+            "num_workers": self.trainer_params.get("preencode_workers", 1),
+        }
+
     @property
     def vocab_mapping(self):
         if hasattr(self, "_vocab_mapping"):
@@ -403,7 +412,8 @@ class ModelTrainer:
         word_emb = self._load_word_embs()
 
         train_batcher, test_batcher = self.get_dataloaders(
-            word_emb, graph_emb, self.suffix_prefix_buckets, cache_dir=Path(self.data_path).joinpath("__cache__")
+            word_emb, graph_emb, self.suffix_prefix_buckets, cache_dir=Path(self.data_path).joinpath("__cache__"),
+            **self.batch_cache_params
         )
 
         # print(f"\n\n{params}")
@@ -0,0 +1,47 @@
+import argparse
+import tracemalloc
+from time import time
+
+import pandas as pd
+
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator
+
+
+def extract_with_dicts(source):
+    generator = AstGraphGenerator(source)
+    edges, _ = generator.parse(generator.root)
+    return pd.DataFrame(edges)
+
+
+def extract_compact(source):
+    generator = AstGraphGenerator(source, compact=True)
+    generator.parse(generator.root)
+    return generator.get_compact_edges(), generator.get_nodes()
+
+
+def measure(fn, *args):
+    start = time()
+    fn(*args)
+    elapsed = time() - start
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare default and compact AST graph extraction")
+    parser.add_argument("source_files", nargs="+", help="Python files, all of them are concatenated into one module")
+    args = parser.parse_args()
+
+    source = "\n".join(open(path).read() for path in args.source_files)
+
+    for name, fn in [("dict edges", extract_with_dicts), ("compact", extract_compact)]:
+        elapsed, peak = measure(fn, source)
+        print(f"{name}: {elapsed:.2f}s, peak memory {peak / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import tracemalloc
+from time import time
+
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, NodeString, materialize_node_strings
+
+
+class EagerStringsGenerator(AstGraphGenerator):
+    """
+    Restores node strings line by line at the moment nodes are created, as it was done before node strings
+    became ranges of the source buffer.
+    """
+    def get_name(self, **kwargs):
+        node = super().get_name(**kwargs)
+        if isinstance(node.string, NodeString):
+            ast_node = kwargs["node"]
+            node.string = self.get_source_by_lines(
+                ast_node.lineno, ast_node.end_lineno, ast_node.col_offset, ast_node.end_col_offset
+            )
+        return node
+
+    def get_source_by_lines(self, start_line, end_line, start_col, end_col):
+        if start_line == end_line:
+            return self.source[start_line - 1].encode("utf8")[start_col:end_col].decode("utf8").rstrip()
+
+        source = ""
+        for lineno in range(start_line - 1, end_line):
+            section = self.source[lineno].encode("utf8")
+            if lineno == start_line - 1:
+                section = section[start_col:]
+            elif lineno == end_line - 1:
+                section = section[:end_col]
+            source += section.decode("utf8") + "\n"
+        return source.rstrip()
+
+
+def generate_nested_source(depth, num_functions):
+    """
+    Generate module with deeply nested expressions and blocks. The source of every nested node is a large part of
+    the source of its parent, so the total size of node strings grows quadratically with depth.
+    """
+    functions = []
+    for function_id in range(num_functions):
+        lines = [f"def function_{function_id}(x):"]
+        indent = "    "
+        # python limits the number of indentation levels
+        for level in range(min(depth, 90)):
+            lines.append(f"{indent}if x > {level}:")
+            indent += "    "
+        # every level of the expression is on a separate line, nested nodes span many lines
+        expression = "x"
+        for level in range(depth):
+            expression = f"({expression}\n{indent}+ {level} * x)"
+        lines.append(f"{indent}return {expression}")
+        functions.append("\n".join(lines))
+    return "\n\n".join(functions) + "\n"
+
+
+def extract(generator_class, source):
+    generator = generator_class(source)
+    edges, _ = generator.parse(generator.root)
+    nodes = {id(edge[key]): edge[key] for edge in edges for key in ["src", "dst"]}
+    return materialize_node_strings(getattr(node, "string", None) for node in nodes.values())
+
+
+def measure(fn, *args):
+    start = time()
+    fn(*args)
+    elapsed = time() - start
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare lazy and eager node strings on deeply nested code")
+    parser.add_argument("--depth", type=int, default=60, help="Nesting depth of blocks and expressions, python parser does not accept depth above ~190")
+    parser.add_argument("--num_functions", type=int, default=50)
+    args = parser.parse_args()
+
+    source = generate_nested_source(args.depth, args.num_functions)
+
+    for name, generator_class in [("eager strings", EagerStringsGenerator), ("lazy strings", AstGraphGenerator)]:
+        elapsed, peak = measure(extract, generator_class, source)
+        print(f"{name}: {elapsed:.2f}s, peak memory {peak / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
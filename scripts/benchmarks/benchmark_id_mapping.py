@@ -0,0 +1,52 @@
+import argparse
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from SourceCodeTools.code.common import IdMapper
+
+
+def map_with_apply(column, mapping):
+    return column.apply(lambda x: mapping.get(x, pd.NA))
+
+
+def measure(fn, *args):
+    start = time()
+    result = fn(*args)
+    return result, time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row id mapping with vectorized IdMapper")
+    parser.add_argument("--num_rows", default=10_000_000, type=int, help="Number of ids to map")
+    parser.add_argument("--num_keys", default=1_000_000, type=int, help="Number of keys in the mapping")
+    parser.add_argument("--string_keys", action="store_true", help="Use md5-like string keys instead of integers")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    keys = rng.permutation(args.num_keys * 2)[:args.num_keys]
+    if args.string_keys:
+        keys = np.array([f"{key:032x}" for key in keys], dtype=object)
+    values = np.arange(args.num_keys)
+
+    # 1% of queried ids are missing from the mapping
+    query = pd.Series(keys[rng.integers(0, args.num_keys, args.num_rows)])
+    query[rng.random(args.num_rows) < 0.01] = pd.NA
+
+    mapping = dict(zip(keys, values))
+
+    expected, apply_time = measure(map_with_apply, query, mapping)
+    mapper, build_time = measure(IdMapper, keys, values)
+    mapped, map_time = measure(mapper.map, query)
+
+    assert (expected.astype("Int64") == mapped).fillna(expected.isna()).all()
+
+    print(f"Series.apply with dict: {apply_time:.2f}s")
+    print(f"IdMapper: {build_time + map_time:.2f}s (build {build_time:.2f}s, map {map_time:.2f}s)")
+    print(f"Speedup: {apply_time / (build_time + map_time):.1f}x")
+
+
+if __name__ == "__main__":
+    main()